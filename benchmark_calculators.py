@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import pyttanko
+
+from db import DifficultyAttributes
+from message_constructors.utils import vectorized_calculators
+from message_constructors.utils.osu_calculators import get_expanded_beatmap_file, recalculate_mods, PRECOMPUTED_MODS
+from message_constructors.utils.osu_file_store import OSU_FILE_EXT, COMPRESSED_EXT, read_osu_file, decode_osu_file
+from message_constructors.utils.vectorized_calculators import HitObjectArrays
+
+# Small bundled corpus with a marathon map, pass beatmap_files/osu_file to check every saved beatmap
+CORPUS_PATH = 'tests/beatmaps'
+ACCURACIES = [100.0, 99.0, 98.0, 97.0, 95.0, 90.0, 80.0]
+MISSES = [0, 1, 5, 20]
+
+
+def build_attributes(aim: float, speed: float, total: float, expanded_beatmap_file: pyttanko.beatmap) -> DifficultyAttributes:
+    return DifficultyAttributes(
+        aim=aim,
+        speed=speed,
+        total=total,
+        max_combo=expanded_beatmap_file.max_combo(),
+        circles=expanded_beatmap_file.ncircles,
+        sliders=expanded_beatmap_file.nsliders,
+        objects=len(expanded_beatmap_file.hitobjects),
+        ar=expanded_beatmap_file.ar,
+        od=expanded_beatmap_file.od,
+        ss_pp=0.0,
+    )
+
+
+def scenarios(max_combo: int) -> list[tuple[float, int]]:
+    """Accuracy and misses pairs that are possible on the beatmap."""
+    return [(accuracy, misses) for misses in MISSES if misses < max_combo for accuracy in ACCURACIES]
+
+
+def reference(expanded_beatmap_file: pyttanko.beatmap, mods_calc: int) -> tuple[tuple[float, ...], list[float]]:
+    stars = pyttanko.diff_calc().calc(expanded_beatmap_file, mods_calc)
+    attributes = build_attributes(stars.aim, stars.speed, stars.total, expanded_beatmap_file)
+    pp = []
+    for accuracy, misses in scenarios(attributes.max_combo):
+        n300, n100, n50 = pyttanko.acc_round(accuracy, attributes.objects, misses)
+        value, *_ = pyttanko.ppv2(attributes.aim, attributes.speed, max_combo=attributes.max_combo,
+                                  nsliders=attributes.sliders, ncircles=attributes.circles,
+                                  nobjects=attributes.objects, base_ar=attributes.ar, base_od=attributes.od,
+                                  mods=mods_calc, n300=n300, n100=n100, n50=n50, nmiss=misses)
+        pp.append(value)
+    return (stars.aim, stars.speed, stars.total), pp
+
+
+def vectorized(expanded_beatmap_file: pyttanko.beatmap, mods_calc: int) -> tuple[tuple[float, ...], list[float]]:
+    aim, speed, total = vectorized_calculators.calculate_difficulty(
+        HitObjectArrays.from_beatmap(expanded_beatmap_file),
+        expanded_beatmap_file.cs,
+        mods_calc,
+    )
+    attributes = build_attributes(aim, speed, total, expanded_beatmap_file)
+    accuracies, misses = zip(*scenarios(attributes.max_combo))
+    n300, n100, n50 = vectorized_calculators.acc_round(accuracies, attributes.objects, misses)
+    pp = vectorized_calculators.ppv2(attributes, mods_calc, n300=n300, n100=n100, n50=n50, nmiss=misses)
+    return (aim, speed, total), pp.tolist()
+
+
+def relative_difference(expected: list[float], actual: list[float]) -> float:
+    return max(abs(a - e) / max(abs(e), 1e-12) for e, a in zip(expected, actual))
+
+
+def timed(func, *args, repeat: int) -> tuple[float, tuple]:
+    started = perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return (perf_counter() - started) / repeat, result
+
+
+def main(path: str, repeat: int, tolerance: float) -> int:
+    file_names = sorted(name for name in os.listdir(path) if name.endswith((OSU_FILE_EXT, COMPRESSED_EXT)))
+    if not file_names:
+        print(f'No .osu files in {path}')
+        return 1
+    total_reference = total_vectorized = 0.0
+    worst = 0.0
+    print(f'{"file":<28}{"objects":>9}{"pyttanko ms":>13}{"numpy ms":>10}{"speedup":>9}{"max diff":>11}')
+    for file_name in file_names:
+        osu_file = read_osu_file(os.path.join(path, file_name))
+        expanded_beatmap_file = get_expanded_beatmap_file(decode_osu_file(osu_file))
+        if len(expanded_beatmap_file.hitobjects) < 2 or expanded_beatmap_file.mode != pyttanko.MODE_STD:
+            continue
+        reference_time = vectorized_time = difference = 0.0
+        for mods in PRECOMPUTED_MODS:
+            mods_calc = recalculate_mods(mods)
+            spent, (expected_stars, expected_pp) = timed(reference, expanded_beatmap_file, mods_calc, repeat=repeat)
+            reference_time += spent
+            spent, (stars, pp) = timed(vectorized, expanded_beatmap_file, mods_calc, repeat=repeat)
+            vectorized_time += spent
+            difference = max(difference,
+                             relative_difference(expected_stars, stars),
+                             relative_difference(expected_pp, pp))
+        total_reference += reference_time
+        total_vectorized += vectorized_time
+        worst = max(worst, difference)
+        print(f'{file_name[:27]:<28}{len(expanded_beatmap_file.hitobjects):>9}'
+              f'{reference_time * 1000:>13.1f}{vectorized_time * 1000:>10.1f}'
+              f'{reference_time / vectorized_time:>8.1f}x{difference:>11.1e}')
+    print(f'\nTotal: pyttanko {total_reference:.2f}s, numpy {total_vectorized:.2f}s, '
+          f'speedup {total_reference / max(total_vectorized, 1e-9):.1f}x, max relative difference {worst:.1e}')
+    if worst > tolerance:
+        print(f'Parity check failed, tolerance is {tolerance:.0e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares speed and results of the numpy calculator with pyttanko on saved .osu files.'
+    )
+    parser.add_argument('path', nargs='?', default=CORPUS_PATH, help='directory with .osu files')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per beatmap and mods')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='max allowed relative difference')
+    args = parser.parse_args()
+    sys.exit(main(args.path, args.repeat, args.tolerance))
@@ -5,11 +5,13 @@ from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, Update
 
 from db import Db
+from message_constructors.utils.cache_check import search_index
+from message_constructors.utils.compute import ComputeExecutor
 from config import DB_NAME, DB_HOST, DB_USER, DB_PASSWORD, REPORT_CHAT_ID
 from config import TG_TOKEN
 from handlers import recent_handler, top_five_handler, profile_handler, remember_me_handler, start_handler, \
     stat_handler, search_handler
-from config import TG_TOKEN, DB_NAME, DB_HOST, DB_USER, DB_PASSWORD
+from config import TG_TOKEN, DB_NAME, DB_HOST, DB_USER, DB_PASSWORD, CLIENT_ID, CLIENT_SECRET
 from request import create_request
 from traceback import format_exc
 import logging
@@ -17,11 +19,23 @@ import logging
 dp = Dispatcher()
 
 
+def describe_update(update: Update) -> tuple[str, str]:
+    """Returns what the user sent and where from, for any update type: inline queries and callbacks have no message."""
+    event = update.event
+    text = getattr(event, 'text', None) or getattr(event, 'query', None) or getattr(event, 'data', None) or ''
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return text, f'In chat: <code>{chat.id}</code>'
+    user = getattr(event, 'from_user', None)
+    return text, f'From user: <code>{user.id if user is not None else "unknown"}</code>'
+
+
 @dp.errors()
 async def errors_handler(update: Update, exception: Exception, bot: Bot):
-    message = f'While handling <code>{update.message.text}</code> an error occurred:\n' \
+    text, source = describe_update(update)
+    message = f'While handling {update.event_type} <code>{html.escape(text)}</code> an error occurred:\n' \
               f'<b>{exception.__class__.__name__}</b>: <code>{html.escape(format_exc())}</code>' \
-              f'\n\nIn chat: <code>{update.message.chat.id}</code>'
+              f'\n\n{source}'
     await bot.send_message(REPORT_CHAT_ID, message)
     logging.exception('АШЫБКА!!!!!!!!!!!!!', exc_info=exception)
 
@@ -47,7 +61,13 @@ async def main():
     dp.include_router(search_handler.router)
     dp.include_router(start_handler.router)
     dp.include_router(stat_handler.router)
-    await dp.start_polling(bot, request=await create_request(), db=db)
+    compute = ComputeExecutor()
+    search_index_refresher = asyncio.create_task(search_index.keep_fresh(db))
+    try:
+        await dp.start_polling(bot, request=await create_request(CLIENT_ID, CLIENT_SECRET), db=db, compute=compute)
+    finally:
+        search_index_refresher.cancel()
+        compute.shutdown()
 
 
 if __name__ == '__main__':
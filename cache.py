@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Dict-like cache that evicts the least recently used entry once it holds `maxsize` entries.
+
+    Counts hits, misses and evictions.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class TTLCache(LRUCache[K, V]):
+    """`LRUCache` whose entries expire `ttl` seconds after being set. Use `set` to give an entry its own ttl."""
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > monotonic()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        super().__setitem__(key, (monotonic() + (self.ttl if ttl is None else ttl), value))
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self.set(key, value)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+
+@dataclass
+class TieredCacheStats:
+    """Counts lookups of a memory -> Postgres -> API cache by the tier that served them."""
+    memory_hits: int = 0
+    db_hits: int = 0
+    api_fetches: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.memory_hits + self.db_hits + self.api_fetches
+
+    @property
+    def memory_hit_ratio(self) -> float:
+        return self.memory_hits / self.lookups if self.lookups else 0.0
+
+    @property
+    def db_hit_ratio(self) -> float:
+        """Share of lookups missed in memory that were served by Postgres."""
+        db_lookups = self.db_hits + self.api_fetches
+        return self.db_hits / db_lookups if db_lookups else 0.0
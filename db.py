@@ -1,9 +1,30 @@
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional, Union
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Optional, Union
 
 import asyncpg
 
+from cache import TTLCache
+
+IDENTITY_CACHE_SIZE = 4096
+IDENTITY_CACHE_TTL = 24 * 60 * 60
+# Unknown usernames may get registered, so they are forgotten sooner
+UNKNOWN_USERNAME_TTL = 10 * 60
+UNKNOWN_OSU_ID = 0
+
+_MISSING = object()
+
+SEARCH_PAGE_SIZE = 10
+# Statistics days start at midnight in this time zone
+STAT_TIME_ZONE = 'Asia/Yekaterinburg'
+
+
+def tokenize_music_text(text: str) -> list[str]:
+    """Splits song names, tags and search queries into lowercase words, the same way everywhere."""
+    return re.findall(r'\w+', text.lower())
+
 
 @dataclass
 class BeatmapData:
@@ -24,25 +45,49 @@ class MusicData:
     title: str
     artist: str
     length: int
+    mappers: list[str] = field(default_factory=list)
+
+
+@dataclass
+class DifficultyAttributes:
+    """Star rating and everything ppv2 needs, so pp can be calculated without the .osu file."""
+    aim: float
+    speed: float
+    total: float
+    max_combo: int
+    circles: int
+    sliders: int
+    objects: int
+    ar: float
+    od: float
+    ss_pp: float
 
 
 @dataclass
-class CommandStat:
-    date: datetime
-    command: str
-    tg_user_id: int
+class StatSummary:
+    """Command usage over a range of days, read from daily rollups."""
+    commands: dict[str, int]
+    users: int
 
 
 class Db:
     def __init__(self, pool: asyncpg.Pool):
         self._pool = pool
+        # Identity lookups in front of remembered_users and osu_users, this process is the only one writing them
+        self._osu_id_by_tg_id: TTLCache[int, Optional[int]] = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+        self._osu_id_by_username: TTLCache[str, int] = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
 
     async def close(self):
         await self._pool.close()
 
     @classmethod
     async def connect(cls, user: str, password: str, host: str, db: str):
-        return cls(await asyncpg.create_pool(f'postgresql://{user}:{password}@{host}/{db}'))
+        return cls(await asyncpg.create_pool(f'postgresql://{user}:{password}@{host}/{db}', init=cls._init_connection))
+
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection) -> None:
+        # JSONB is written as already serialized json str and read as decoded python objects
+        await conn.set_type_codec('jsonb', encoder=str, decoder=json.loads, schema='pg_catalog')
 
     async def cache_tg_user(self, tg_id: int, osu_id: int) -> None:
         """
@@ -58,20 +103,27 @@ class Db:
                                'VALUES ($1, $2) '
                                'ON CONFLICT(tg_id) DO UPDATE SET osu_id=$2',
                                tg_id, osu_id)
+        self._osu_id_by_tg_id[tg_id] = osu_id
 
     async def remove_user_from_remember_me(self, tg_user_id: int) -> None:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
             await conn.execute('DELETE FROM remembered_users '
                                'WHERE tg_id=$1',
                                tg_user_id)
+        self._osu_id_by_tg_id[tg_user_id] = None
 
     async def get_cached_osu_id_by_tg_id(self, tg_id: int) -> Optional[int]:
         """Returns osu user id. Returns None if no id saved."""
+        osu_id = self._osu_id_by_tg_id.get(tg_id, _MISSING)
+        if osu_id is not _MISSING:
+            return osu_id
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            return await conn.fetchval('SELECT osu_id '
-                                       'FROM remembered_users '
-                                       'WHERE tg_id=$1',
-                                       tg_id)
+            osu_id = await conn.fetchval('SELECT osu_id '
+                                         'FROM remembered_users '
+                                         'WHERE tg_id=$1',
+                                         tg_id)
+        self._osu_id_by_tg_id[tg_id] = osu_id
+        return osu_id
 
     async def cache_osu_user(self, username: str, osu_id: int) -> None:
         """
@@ -87,33 +139,60 @@ class Db:
                                'VALUES ($1, $2)'
                                'ON CONFLICT(osu_id) DO UPDATE SET username=$2',
                                osu_id, username)
+        self._osu_id_by_username[username] = osu_id
+
+    def cache_unknown_username(self, username: str) -> None:
+        """Remembers for a while that there is no osu user with this username. Only kept in memory."""
+        self._osu_id_by_username.set(username, UNKNOWN_OSU_ID, UNKNOWN_USERNAME_TTL)
 
     async def get_cached_osu_id_by_username(self, username: str) -> Optional[int]:
-        """Return osu user id. Returns None if no id saved."""
+        """Return osu user id. Returns None if no id saved, 0 if the username is known to be unknown."""
+        osu_id = self._osu_id_by_username.get(username)
+        if osu_id is not None:
+            return osu_id
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            return await conn.fetchval('SELECT osu_id '
-                                       'FROM osu_users '
-                                       'WHERE username=$1',
-                                       username)
+            osu_id = await conn.fetchval('SELECT osu_id '
+                                         'FROM osu_users '
+                                         'WHERE username=$1',
+                                         username)
+        if osu_id is not None:
+            self._osu_id_by_username[username] = osu_id
+        return osu_id
 
     async def cache_beatmap_data(self, map_id: int, beatmap_data: str, last_updated: datetime) -> None:
         """
         Saves beatmap data by beatmap id.
 
         :param map_id: Osu beatmap id.
-        :param beatmap_data: Osu beatmap data.
+        :param beatmap_data: Osu beatmap data as json str.
         :param last_updated: Beatmap last updated datetime.
         """
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
             await conn.execute('INSERT INTO beatmap_data(map_id, data, last_updated) '
                                'VALUES ($1, $2, $3) '
                                'ON CONFLICT (map_id) '
-                               'DO UPDATE SET map_id=$1, data=$2',
+                               'DO UPDATE SET data=$2, last_updated=$3',
                                map_id, beatmap_data, last_updated)
 
-    async def get_beatmap_data(self, map_id: int) -> Optional[tuple[str, datetime]]:
+    async def cache_beatmaps_data(self, beatmaps_data: list[tuple[int, str, datetime]]) -> None:
+        """
+        Saves data of many beatmaps in one query.
+
+        :param beatmaps_data: Tuples of osu beatmap id, beatmap data as json str and beatmap last updated datetime.
+        """
+        if not beatmaps_data:
+            return
+        map_ids, data, last_updated = zip(*beatmaps_data)
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            await conn.execute('INSERT INTO beatmap_data(map_id, data, last_updated) '
+                               'SELECT * FROM unnest($1::int[], $2::jsonb[], $3::timestamptz[]) '
+                               'ON CONFLICT (map_id) '
+                               'DO UPDATE SET data=EXCLUDED.data, last_updated=EXCLUDED.last_updated',
+                               map_ids, data, last_updated)
+
+    async def get_beatmap_data(self, map_id: int) -> Optional[tuple[dict[str, Any], datetime]]:
         """
-        Returns tuple of osu beatmap data as json str and last updated datetime. None if no data saved.
+        Returns tuple of osu beatmap data as decoded json and last updated datetime. None if no data saved.
 
         :param map_id: Osu map id.
         """
@@ -126,25 +205,111 @@ class Db:
             return None
         return record[0], record[1]
 
-    async def cache_user_score_position(self, score_id: int, position: int) -> None:
+    async def get_beatmaps_data(self, map_ids: list[int]) -> dict[int, tuple[dict[str, Any], datetime]]:
         """
-        Saves user's position on a map by score id.
+        Returns osu beatmap data as decoded json and last updated datetime by beatmap id. Beatmaps with no data saved are left out.
 
-        :param score_id: Osu score id.
-        :param position: User's position on a map.
+        :param map_ids: Osu map ids.
         """
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            await conn.execute('INSERT INTO score_positions(score_id, position) '
-                               'VALUES ($1, $2) ON CONFLICT(score_id) DO UPDATE SET position=$2',
-                               score_id, position)
+            result: list[asyncpg.Record] = await conn.fetch('SELECT map_id, data, last_updated '
+                                                            'FROM beatmap_data '
+                                                            'WHERE map_id = ANY($1::int[])',
+                                                            map_ids)
+        return {record[0]: (record[1], record[2]) for record in result}
 
-    async def get_user_score_position(self, score_id: int) -> Optional[int]:
-        """Returns user's position on a map by score id."""
+    async def get_difficulty_attributes(self, map_id: int, last_updated: datetime, mods: int) -> Optional[DifficultyAttributes]:
+        """
+        Returns difficulty attributes of a beatmap version with mods. None if not calculated yet.
+
+        :param map_id: Osu beatmap id.
+        :param last_updated: Beatmap last updated datetime.
+        :param mods: pyttanko mods bitmask.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            record: asyncpg.Record = await conn.fetchrow('SELECT aim, speed, stars, max_combo, circles, sliders, objects, '
+                                                         'ar, od, ss_pp '
+                                                         'FROM difficulty_attributes '
+                                                         'WHERE map_id=$1 AND mods=$2 AND last_updated=$3',
+                                                         map_id, mods, last_updated)
+        if record is None:
+            return None
+        return DifficultyAttributes(*record)
+
+    async def save_difficulty_attributes(self, attributes: list[tuple[int, datetime, int, DifficultyAttributes]]) -> None:
+        """
+        Saves difficulty attributes, replacing ones calculated for older beatmap versions.
+
+        :param attributes: Tuples of osu beatmap id, beatmap last updated datetime, pyttanko mods bitmask and attributes.
+        """
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            return await conn.fetchval('SELECT position '
-                                       'FROM score_positions '
-                                       'WHERE score_id=$1',
-                                       score_id)
+            await conn.executemany('INSERT INTO difficulty_attributes(map_id, last_updated, mods, aim, speed, stars, '
+                                   'max_combo, circles, sliders, objects, ar, od, ss_pp) '
+                                   'VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13) '
+                                   'ON CONFLICT (map_id, mods) DO UPDATE SET '
+                                   'last_updated=$2, aim=$4, speed=$5, stars=$6, max_combo=$7, circles=$8, '
+                                   'sliders=$9, objects=$10, ar=$11, od=$12, ss_pp=$13',
+                                   [(map_id, last_updated, mods, a.aim, a.speed, a.total, a.max_combo, a.circles,
+                                     a.sliders, a.objects, a.ar, a.od, a.ss_pp)
+                                    for map_id, last_updated, mods, a in attributes])
+
+    async def cache_user_score_positions(self, positions: list[tuple[int, Optional[int]]]) -> None:
+        """
+        Saves user's positions on maps by score id, marking them as checked now.
+
+        :param positions: Tuples of osu score id and user's position on a map, None if the score isn't on the leaderboard.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            await conn.executemany('INSERT INTO score_positions(score_id, position, updated_at) '
+                                   'VALUES ($1, $2, now()) '
+                                   'ON CONFLICT(score_id) DO UPDATE SET position=$2, updated_at=now()',
+                                   positions)
+
+    async def get_user_score_positions(self, score_ids: list[int]) -> dict[int, tuple[Optional[int], datetime]]:
+        """
+        Returns user's position on a map and when it was checked by score id. Scores with no position saved are left out.
+
+        :param score_ids: Osu score ids.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            result: list[asyncpg.Record] = await conn.fetch('SELECT score_id, position, updated_at '
+                                                            'FROM score_positions '
+                                                            'WHERE score_id = ANY($1::bigint[])',
+                                                            score_ids)
+        return {record[0]: (record[1], record[2]) for record in result}
+
+    async def get_telegram_file_id(self, kind: str, source: str) -> Optional[str]:
+        """
+        Returns telegram file_id of a file the bot has already sent. None if it wasn't sent yet.
+
+        :param kind: Kind of the file, e.g. "cover" or "top5".
+        :param source: What the file was made from, e.g. cover url.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            return await conn.fetchval('SELECT file_id '
+                                       'FROM telegram_files '
+                                       'WHERE kind=$1 AND source=$2',
+                                       kind, source)
+
+    async def cache_telegram_file_id(self, kind: str, source: str, file_id: str) -> None:
+        """
+        Saves telegram file_id of a sent file.
+
+        :param kind: Kind of the file, e.g. "cover" or "top5".
+        :param source: What the file was made from, e.g. cover url.
+        :param file_id: Telegram file_id.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            await conn.execute('INSERT INTO telegram_files(kind, source, file_id) '
+                               'VALUES ($1, $2, $3) '
+                               'ON CONFLICT (kind, source) DO UPDATE SET file_id=$3',
+                               kind, source, file_id)
+
+    async def remove_telegram_file_id(self, kind: str, source: str) -> None:
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            await conn.execute('DELETE FROM telegram_files '
+                               'WHERE kind=$1 AND source=$2',
+                               kind, source)
 
     async def add_score_stat(self, score: str, stat: str, is_stat: bool = False) -> int:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
@@ -164,46 +329,57 @@ class Db:
                                        'END',
                                        is_stat, score_id)
 
-    async def find_music(self, value: str, cursor: int) -> list[MusicData]:
-        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            result: list[asyncpg.Record] = await conn.fetch("SELECT music.id, file_id, artist, title, length "
-                                                            "FROM music "
-                                                            "JOIN music_mappers msm "
-                                                            "ON music.id = msm.music_id "
-                                                            "JOIN mappers m "
-                                                            "ON m.id = msm.mapper_id "
-                                                            f"WHERE music.artist || "
-                                                            f"' ' || music.title || "
-                                                            f"' ' || m.mapper "
-                                                            f"ILIKE $1 "
-                                                            f"OFFSET $2 "
-                                                            f"LIMIT 11",
-                                                            f"%{value}%", cursor*10)
-            music: list[MusicData] = []
-            for music_data in result:
-                music.append(MusicData(
-                    music_id=music_data[0],
-                    file_id=music_data[1],
-                    artist=music_data[2],
-                    title=music_data[3],
-                    length=music_data[4],
-                ))
-            return music
+    async def search_music_ids(self, query: str, limit: int) -> list[int]:
+        """
+        Returns ids of songs matching the query, most relevant first.
 
-    async def find_music_by_file_id(self, file_id: str) -> Optional[MusicData]:
+        Songs are found by full-text search over their search document, by trigram word similarity, so typos and
+        unfinished words still match, and by music_tokens.
+        """
+        tokens = list(dict.fromkeys(tokenize_music_text(query)))
+        ts_query = ' | '.join(f'{token}:*' for token in tokens)
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            result: list[asyncpg.Record] = await conn.fetch("SELECT id, file_id, artist, title, length "
-                                                            "FROM music "
-                                                            "WHERE file_id=$1",
-                                                            file_id)
-            if not result:
-                return None
-            return MusicData(
-                music_id=result[0],
-                file_id=result[1],
-                artist=result[2],
-                title=result[3],
-                length=result[4],)
+            result: list[asyncpg.Record] = await conn.fetch(
+                'WITH candidates AS ('
+                '    SELECT id FROM music '
+                "    WHERE search_vector @@ to_tsquery('simple', $2) OR $1 <% search_document "
+                '    UNION '
+                '    SELECT music_id FROM music_tokens WHERE word = ANY($3::TEXT[])'
+                ') '
+                'SELECT music.id '
+                'FROM candidates '
+                'JOIN music ON music.id = candidates.id '
+                "ORDER BY ts_rank(music.search_vector, to_tsquery('simple', $2)) "
+                '         + word_similarity($1, music.search_document) '
+                '         + 0.1 * (SELECT count(*) FROM music_tokens mt '
+                '                  WHERE mt.music_id = music.id AND mt.word = ANY($3::TEXT[])) DESC, '
+                '         music.id '
+                'LIMIT $4',
+                query, ts_query, tokens, limit)
+            return [music_id for music_id, in result]
+
+    async def get_music_by_ids(self, music_ids: list[int]) -> list[MusicData]:
+        """Returns songs with their mappers in the order of `music_ids`, missing ids are skipped."""
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            result: list[asyncpg.Record] = await conn.fetch(
+                'SELECT music.id, file_id, artist, title, length, '
+                '       ARRAY(SELECT DISTINCT m.mapper '
+                '             FROM music_mappers msm '
+                '             JOIN mappers m ON m.id = msm.mapper_id '
+                '             WHERE msm.music_id = music.id '
+                '             ORDER BY m.mapper) AS mappers '
+                'FROM music '
+                'WHERE music.id = ANY($1::BIGINT[])',
+                music_ids)
+            music = {music_data[0]: MusicData(
+                music_id=music_data[0],
+                file_id=music_data[1],
+                artist=music_data[2],
+                title=music_data[3],
+                length=music_data[4],
+                mappers=list(music_data[5]),
+            ) for music_data in result}
+            return [music[music_id] for music_id in music_ids if music_id in music]
 
     async def find_music_by_beatmap_id(self, beatmap_id: int) -> Optional[list[BeatmapData]]:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
@@ -244,17 +420,6 @@ class Db:
                 beatmap_ids.append(beatmap_id)
             return mappers, beatmap_ids
 
-    async def get_id_by_token(self, word: str) -> list[str]:
-        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            result: list[asyncpg.Record] = await conn.fetch('SELECT file_id '
-                                                            'FROM music_tokens '
-                                                            'WHERE word=$1',
-                                                            word)
-            id_list: list[str] = []
-            for file_id in result:
-                id_list.append(file_id[0])
-            return id_list
-
     async def get_file_id_by_music_id(self, music_id: int) -> str:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
             return await conn.fetchval('SELECT file_id '
@@ -264,58 +429,59 @@ class Db:
 
     async def save_command_stat(self, message_date: datetime, command: str, tg_user_id: int) -> None:
         """
-        Saves command info for statistics.
+        Saves command info for statistics and counts it in daily rollups in the same statement.
 
         :param message_date: Message date. Datetime with timezone.
         :param command: Bot commands as text. Available commands - "recent", "profile", "top5", "remember_me", "track".
         :param tg_user_id: Telegram user id.
         """
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            await conn.execute('INSERT INTO stat(date, command, tg_user_id) '
-                               'VALUES ($1, $2, $3)',
-                               message_date, command.lower(), tg_user_id)
-
-    async def get_all_stat(self, date: datetime = None) -> list[CommandStat]:
-        """
-        Returns message date, command and telegram user id for given day sa CommandStat dataclass. Returns all statistics if day is not given.
-        """
-        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            if date is None:
-                result: list[asyncpg.Record] = await conn.fetch("SELECT date, command, tg_user_id "
-                                                                "FROM stat")
-            else:
-                result: list[asyncpg.Record] = await conn.fetch("SELECT date, command, tg_user_id "
-                                                                "FROM stat "
-                                                                "WHERE EXTRACT("
-                                                                "DAY FROM date "
-                                                                "AT TIME ZONE 'Asia/Yekaterinburg'"
-                                                                ")=$1 "
-                                                                "AND EXTRACT("
-                                                                "MONTH FROM date "
-                                                                "AT TIME ZONE 'Asia/Yekaterinburg'"
-                                                                ")=$2 "
-                                                                "AND EXTRACT("
-                                                                "YEAR FROM date "
-                                                                "AT TIME ZONE 'Asia/Yekaterinburg'"
-                                                                ")=$3",
-                                                                date.day, date.month, date.year)
-        stat_list: list[CommandStat] = []
-        for record in result:
-            stat_list.append(CommandStat(record[0], record[1], record[2]))
-        return stat_list
-
-    async def save_music(self, file_id: str, artist: str, title: str, length: int, is_tv_size: bool, is_bpm_changed: bool) -> Optional[int]:
+            await conn.execute('WITH saved AS ('
+                               '    INSERT INTO stat(date, command, tg_user_id) '
+                               '    VALUES ($1, $2, $3) '
+                               '    RETURNING (date AT TIME ZONE $4)::DATE AS day'
+                               '), counted AS ('
+                               '    INSERT INTO stat_daily_commands(day, command, count) '
+                               '    SELECT day, $2, 1 FROM saved '
+                               '    ON CONFLICT (day, command) DO UPDATE SET count = stat_daily_commands.count + 1'
+                               ') '
+                               'INSERT INTO stat_daily_users(day, tg_user_id) '
+                               'SELECT day, $3 FROM saved '
+                               'ON CONFLICT DO NOTHING',
+                               message_date, command.lower(), tg_user_id, STAT_TIME_ZONE)
+
+    async def get_stat_summary(self, since: Optional[date] = None, until: Optional[date] = None) -> StatSummary:
+        """
+        Returns command counts and the number of distinct users for days from `since` to `until` inclusive,
+        days are in `STAT_TIME_ZONE`. Open ends aren't limited, so no days given means all time.
+        """
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            commands: list[asyncpg.Record] = await conn.fetch('SELECT command, sum(count) '
+                                                              'FROM stat_daily_commands '
+                                                              'WHERE ($1::DATE IS NULL OR day >= $1) '
+                                                              'AND ($2::DATE IS NULL OR day <= $2) '
+                                                              'GROUP BY command',
+                                                              since, until)
+            users = await conn.fetchval('SELECT count(DISTINCT tg_user_id) '
+                                        'FROM stat_daily_users '
+                                        'WHERE ($1::DATE IS NULL OR day >= $1) '
+                                        'AND ($2::DATE IS NULL OR day <= $2)',
+                                        since, until)
+        return StatSummary({command: int(count) for command, count in commands}, users)
+
+    async def save_music(self, file_id: str, artist: str, title: str, length: int, is_tv_size: bool, is_bpm_changed: bool,
+                         tags: str = '') -> Optional[int]:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
             music_id = await conn.fetchval('SELECT id FROM music '
                                                'WHERE artist=$1 AND title=$2 AND length=$3',
                                                artist, title, length)
             if music_id is not None:
                 return int(music_id)
-            return int(await conn.fetchval('INSERT INTO music(file_id, artist, title, length, is_tv_size, is_bpm_changed) '
-                                           'VALUES ($1, $2, $3, $4, $5, $6) '
+            return int(await conn.fetchval('INSERT INTO music(file_id, artist, title, length, is_tv_size, is_bpm_changed, tags) '
+                                           'VALUES ($1, $2, $3, $4, $5, $6, $7) '
                                            'ON CONFLICT (artist, title, length, file_id) DO NOTHING '
                                            'RETURNING id',
-                                           file_id, artist, title, length, is_tv_size, is_bpm_changed))
+                                           file_id, artist, title, length, is_tv_size, is_bpm_changed, tags))
 
     async def save_mapper(self, mapper: str, beatmap_id: int) -> int:
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
@@ -357,21 +523,92 @@ class Db:
                 music_id = data[2]
             return beatmap_id_list, file_id, music_id
 
-    async def add_music_token(self, word: str, file_id: str):
+    async def get_saved_music_keys(self) -> set[tuple[str, str, int]]:
+        """Returns (artist, title, length) of every saved song, the same criteria `is_music_saved` matches by."""
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            result: list[asyncpg.Record] = await conn.fetch('SELECT artist, title, length FROM music')
+            return {(artist, title, length) for artist, title, length in result}
+
+    async def import_music(
+            self,
+            music: list[tuple[int, Optional[str], str, str, int, bool, bool, str]],
+            links: list[tuple[int, str, int]],
+            tokens: list[tuple[int, str]],
+    ) -> int:
+        """
+        Bulk loads songs with their mappers and search tokens in one transaction. Rows are copied into temporary
+        tables, then merged: songs already saved with the same artist, title and length get only new mappers and tokens.
+
+        :param music: Tuples of import key, telegram file id (None for saved songs), artist, title, length,
+            is TV size, is BPM changed and tags.
+        :param links: Tuples of import key, mapper name and beatmapset id.
+        :param tokens: Tuples of import key and word.
+        :return: Number of new songs.
+        """
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            await conn.execute('INSERT INTO music_tokens(word, file_id) '
+            async with conn.transaction():
+                await conn.execute('CREATE TEMP TABLE import_music('
+                                   '    import_key INT, file_id TEXT, artist TEXT, title TEXT, length INT, '
+                                   '    is_tv_size BOOLEAN, is_bpm_changed BOOLEAN, tags TEXT'
+                                   ') ON COMMIT DROP;'
+                                   'CREATE TEMP TABLE import_links(import_key INT, mapper TEXT, beatmap_id INT) '
+                                   'ON COMMIT DROP;'
+                                   'CREATE TEMP TABLE import_tokens(import_key INT, word TEXT) ON COMMIT DROP')
+                await conn.copy_records_to_table('import_music', records=music)
+                await conn.copy_records_to_table('import_links', records=links)
+                await conn.copy_records_to_table('import_tokens', records=tokens)
+                status = await conn.execute('INSERT INTO music(file_id, artist, title, length, is_tv_size, '
+                                            '                  is_bpm_changed, tags) '
+                                            'SELECT DISTINCT ON (artist, title, length) '
+                                            '       file_id, artist, title, length, is_tv_size, is_bpm_changed, tags '
+                                            'FROM import_music im '
+                                            'WHERE file_id IS NOT NULL AND NOT EXISTS ('
+                                            '    SELECT 1 FROM music '
+                                            '    WHERE music.artist = im.artist AND music.title = im.title '
+                                            '      AND music.length = im.length'
+                                            ') '
+                                            'ORDER BY artist, title, length, import_key '
+                                            'ON CONFLICT DO NOTHING')
+                await conn.execute('CREATE TEMP TABLE import_music_ids ON COMMIT DROP AS '
+                                   'SELECT im.import_key, min(music.id) AS music_id '
+                                   'FROM import_music im '
+                                   'JOIN music ON music.artist = im.artist AND music.title = im.title '
+                                   '          AND music.length = im.length '
+                                   'GROUP BY im.import_key;'
+                                   'INSERT INTO mappers(mapper, beatmap_id) '
+                                   'SELECT DISTINCT mapper, beatmap_id FROM import_links '
+                                   'ON CONFLICT (mapper, beatmap_id) DO NOTHING;'
+                                   'INSERT INTO music_mappers(music_id, mapper_id) '
+                                   'SELECT DISTINCT ids.music_id, m.id '
+                                   'FROM import_links il '
+                                   'JOIN import_music_ids ids ON ids.import_key = il.import_key '
+                                   'JOIN mappers m ON m.mapper = il.mapper AND m.beatmap_id = il.beatmap_id '
+                                   'ON CONFLICT DO NOTHING;'
+                                   'INSERT INTO music_tokens(word, music_id) '
+                                   'SELECT DISTINCT it.word, ids.music_id '
+                                   'FROM import_tokens it '
+                                   'JOIN import_music_ids ids ON ids.import_key = it.import_key '
+                                   'ON CONFLICT DO NOTHING')
+                return int(status.split()[-1])
+
+    async def add_music_token(self, word: str, music_id: int):
+        async with self._pool.acquire() as conn:  # type: asyncpg.Connection
+            await conn.execute('INSERT INTO music_tokens(word, music_id) '
                                'VALUES ($1, $2) '
                                'ON CONFLICT DO NOTHING',
-                               word, file_id)
+                               word, music_id)
 
-    async def get_all_search_music_data(self) -> list[BeatmapData]:
+    async def get_all_search_music_data(self, after_music_id: int = 0) -> list[BeatmapData]:
+        """Returns a row per song mapper, for songs with id greater than `after_music_id` only."""
         async with self._pool.acquire() as conn:  # type: asyncpg.Connection
-            result: list[asyncpg.Record] = await conn.fetch('SELECT m.beatmap_id, file_id, artist, title, length, m.mapper, music.id '
+            result: list[asyncpg.Record] = await conn.fetch('SELECT m.beatmap_id, file_id, artist, title, length, m.mapper, music.id, tags '
                                                             'FROM music '
                                                             'JOIN music_mappers msm '
                                                             'ON music.id = msm.music_id '
                                                             'JOIN mappers m '
-                                                            'ON m.id = msm.mapper_id ')
+                                                            'ON m.id = msm.mapper_id '
+                                                            'WHERE music.id > $1',
+                                                            after_music_id)
             music_data_list: list[BeatmapData] = []
             for data in result:
                 music_data_list.append(BeatmapData(
@@ -381,7 +618,8 @@ class Db:
                     title=data[3],
                     length=data[4],
                     mapper=data[5],
-                    music_id=data[6]
+                    music_id=data[6],
+                    tags=data[7],
                 ))
             return music_data_list
 
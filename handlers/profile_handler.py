@@ -3,20 +3,25 @@ from typing import Optional
 
 from aiogram import Router, Bot
 from aiogram.dispatcher.filters import CommandObject
-from aiogram.types import Message, FSInputFile
-from httpx import ReadTimeout, HTTPStatusError
+from aiogram.types import Message
+from httpx import TimeoutException, HTTPStatusError
 
 from db import Db
 from message_constructors.utils.class_constructor import create_user_data_class, get_scores, create_score_class
 from message_constructors.profile_constructor import profile_message_constructor
-from request import Request
-from message_constructors.utils.cache_check import get_osu_id_by_username, get_osu_file
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.fetch_plan import FetchPlan
+from message_constructors.utils.telegram_files import reply_photo_cached, reply_rendered, remember_rendered
+from message_constructors.utils.utils import get_star_rating
+from request import Request, BanchoUnavailable
+from message_constructors.utils.cache_check import get_osu_id_by_username
 
 router = Router()
 
 
 @router.message(commands=['profile'])
-async def profile(message: Message, request: Request, db: Db, bot: Bot, command: CommandObject):
+async def profile(message: Message, request: Request, db: Db, bot: Bot, command: CommandObject,
+                  compute: ComputeExecutor):
     await bot.send_chat_action(message.chat.id, 'record_voice')
     username = command.args
     user_id = await get_osu_id_by_username(username, db, request, message.from_user.id)
@@ -27,11 +32,16 @@ async def profile(message: Message, request: Request, db: Db, bot: Bot, command:
         return message.reply('User not found.')
 
     try:
-        user_data = await create_user_data_class(user_id, request)
         scores = await get_scores(user_id, request, 'best', 1)
-        score = await create_score_class(scores[0], request, db)
-        star_rating = await request.get_star_rating(score.beatmap.id, score.mods, score.mode_int)
-    except ReadTimeout:
+        response_key = ('profile', user_id, scores[0]['id'])
+        if await reply_rendered(message, response_key) is not None:
+            return await db.save_command_stat(message.date, 'profile', message.from_user.id)
+        plan = FetchPlan('profile')
+        plan.add('user_data', lambda: create_user_data_class(user_id, request))
+        plan.add('score', lambda: create_score_class(scores[0], request, db))
+        plan.add('star_rating', lambda score: get_star_rating(score, request, db, compute), 'score')
+        results = await plan.run()
+    except (TimeoutException, BanchoUnavailable):
         return message.reply('Bancho is dead.')
     except HTTPStatusError as e:
         if e.response.status_code // 100 == 5:
@@ -39,11 +49,15 @@ async def profile(message: Message, request: Request, db: Db, bot: Bot, command:
         raise
     except TypeError as e:
         return message.reply("User hasn't set any scores yet.")
+    user_data, score, star_rating = results['user_data'], results['score'], results['star_rating']
 
-    photo = user_data.avatar_url
-    if await request.get_status_code(photo) >= 300:
-        photo = FSInputFile('images/default_user_avatar.png')
+    async def get_avatar() -> Optional[str]:
+        if not await request.is_url_available(user_data.avatar_url):
+            return None
+        return user_data.avatar_url
 
     msg = profile_message_constructor(user_data, score, star_rating)
-    await message.reply_photo(photo, msg)
+    sent = await reply_photo_cached(message, 'avatar', user_data.avatar_url, get_avatar, db, msg,
+                                    fallback='images/default_user_avatar.png')
+    remember_rendered(response_key, sent, msg)
     await db.save_command_stat(message.date, 'profile', message.from_user.id)
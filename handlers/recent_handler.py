@@ -1,21 +1,27 @@
+from typing import Optional
+
 from aiogram import Router, Bot
 from aiogram.dispatcher.filters import CommandObject
-from aiogram.types import Message, FSInputFile, CallbackQuery
-from httpx import HTTPStatusError
-from httpx import ReadTimeout
+from aiogram.types import Message, CallbackQuery
+from httpx import HTTPStatusError, TimeoutException
 
+from api_model.beatmap import Beatmap
 from db import Db
 from message_constructors.recent_constructor import recent_message_constructor, create_stat_button, \
     recent_message_stat_constructor, Stat
-from message_constructors.utils.cache_check import get_osu_id_by_username, get_osu_file
+from message_constructors.utils.cache_check import get_osu_id_by_username, get_difficulty_attributes
 from message_constructors.utils.class_constructor import create_user_data_class, get_scores, create_score_class
-from request import Request
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.fetch_plan import FetchPlan
+from message_constructors.utils.telegram_files import reply_photo_cached, reply_rendered, remember_rendered
+from request import Request, BanchoUnavailable
 
 router = Router()
 
 
 @router.message(commands=['recent'])
-async def recent(message: Message, request: Request, db: Db, command: CommandObject, bot: Bot):
+async def recent(message: Message, request: Request, db: Db, command: CommandObject, bot: Bot,
+                 compute: ComputeExecutor):
     await bot.send_chat_action(message.chat.id, 'upload_voice')
     username = command.args
     user_id = await get_osu_id_by_username(username, db, request, message.from_user.id)
@@ -27,10 +33,18 @@ async def recent(message: Message, request: Request, db: Db, command: CommandObj
 
     try:
         scores = await get_scores(user_id, request, 'recent', 1)
-        score = await create_score_class(scores[0], request, db)
-        osu_file = await get_osu_file(score.beatmap.id, score.beatmap.last_updated, request)
-        user_data = await create_user_data_class(user_id, request)
-    except ReadTimeout:
+        response_key = ('recent', user_id, scores[0]['id'])
+        if await reply_rendered(message, response_key) is not None:
+            return await db.save_command_stat(message.date, 'recent', message.from_user.id)
+        plan = FetchPlan('recent')
+        plan.add('user_data', lambda: create_user_data_class(user_id, request))
+        plan.add('score', lambda: create_score_class(scores[0], request, db))
+        # attributes only need the raw score, so they don't wait for beatmap data and leaderboard position
+        plan.add('attributes', lambda: get_difficulty_attributes(
+            Beatmap.parse_obj(scores[0]['beatmap']), scores[0]['mods'], db, request, compute
+        ))
+        results = await plan.run()
+    except (TimeoutException, BanchoUnavailable):
         return message.reply('Bancho is dead.')
     except HTTPStatusError as e:
         if e.response.status_code // 100 == 5:
@@ -38,21 +52,24 @@ async def recent(message: Message, request: Request, db: Db, command: CommandObj
         raise
     except TypeError:
         return message.reply('User is quit w (no recent scores for past 24 hours).')
+    score, attributes, user_data = results['score'], results['attributes'], results['user_data']
+    if attributes is None:
+        return message.reply("Can't calculate this beatmap :(")
 
-    photo = score.beatmapset.cover
-    if await request.get_status_code(photo) >= 300:
-        photo = FSInputFile('images/osu_bg.png')
+    async def get_cover() -> Optional[str]:
+        if not await request.is_url_available(score.beatmapset.cover):
+            return None
+        return score.beatmapset.cover
 
-    score_msg = recent_message_constructor(score, user_data, message.date, osu_file)
-    osu_file.seek(0)
-    stat_msg = recent_message_stat_constructor(score, osu_file)
+    score_msg = recent_message_constructor(score, user_data, message.date, attributes)
+    stat_msg = recent_message_stat_constructor(score, attributes)
     score_id = await db.add_score_stat(score_msg, stat_msg)
     button = create_stat_button(score_id, 'Statistics', False)
-    await message.reply_photo(photo, score_msg, reply_markup=button)
+    sent = await reply_photo_cached(message, 'cover', score.beatmapset.cover, get_cover, db, score_msg,
+                                    fallback='images/osu_bg.png', reply_markup=button)
+    remember_rendered(response_key, sent, score_msg, button)
     await db.save_command_stat(message.date, 'recent', message.from_user.id)
 
-    osu_file.close()
-
 
 @router.callback_query(Stat.filter())
 async def change_page(query: CallbackQuery, db: Db, callback_data: Stat):
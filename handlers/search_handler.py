@@ -1,19 +1,33 @@
-from typing import Union
+import html
+from typing import Optional, Union
 
 from aiogram import Router, Bot
 from aiogram.dispatcher.filters import CommandObject
 from aiogram.dispatcher.filters.callback_data import CallbackData
-from aiogram.types import Message, InlineKeyboardMarkup, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, CallbackQuery, InlineQuery, InlineQueryResultCachedAudio
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from db import Db, BeatmapData, MusicData
-from message_constructors.search_constructor import search_constructor
+from db import Db, BeatmapData, MusicData, SEARCH_PAGE_SIZE
+from message_constructors.search_constructor import search_constructor, get_search_page, SearchPage, \
+    SEARCH_SESSION_MAX_RESULTS
+from message_constructors.utils.cache_check import search_index
 
 router = Router()
 
+INLINE_RESULTS_LIMIT = 50
+INLINE_CACHE_TIME = 5 * 60
 
-class NextPage(CallbackData, prefix='next_page'):
+TRUNCATED_RESULTS_HINT = f'Showing the first {SEARCH_SESSION_MAX_RESULTS} results, refine your query to find more.'
+
+
+class NextPage(CallbackData, prefix='search_page'):
+    session: str
+    cursor: int
+
+
+class LegacyNextPage(CallbackData, prefix='next_page'):
+    """Page buttons sent before search sessions, they carry the query itself."""
     cursor: int
     query: str
 
@@ -28,40 +42,38 @@ async def search(message: Message, db: Db, command: CommandObject, bot: Bot):
     if args is None:
         return message.reply('Write map link with the command or try to find song by title, artist, mapper name.')
 
-    music = await search_constructor(args, 0, db)
-
-    if music:
-        await message.reply(
-            text=await create_message_text_beatmap(music)
-            if isinstance(music[0], BeatmapData)
-            else await create_message_text_music(music, db),
-            reply_markup=await create_music_buttons(music, args, 0)
-        )
-        await db.save_command_stat(message.date, 'search', message.from_user.id)
-        return
+    found = await search_constructor(args, db)
+    if isinstance(found, SearchPage) and found.music:
+        text = await create_message_text_music(found.music)
+        if found.is_truncated:
+            text += f'\n\n<i>{TRUNCATED_RESULTS_HINT}</i>'
+        reply_markup = await create_music_buttons(found.music, found)
+    elif isinstance(found, list) and found:
+        text = await create_message_text_beatmap(found)
+        reply_markup = await create_music_buttons(found)
     else:
         return message.reply('Track not found :(')
+    await message.reply(text=text, reply_markup=reply_markup)
+    await db.save_command_stat(message.date, 'search', message.from_user.id)
 
 
-async def create_music_buttons(music: list[Union[BeatmapData, MusicData]], args: str,
-                               cursor: int) -> InlineKeyboardMarkup:
+async def create_music_buttons(music: list[Union[BeatmapData, MusicData]],
+                               page: Optional[SearchPage] = None) -> InlineKeyboardMarkup:
     x = InlineKeyboardBuilder()
 
-    if cursor >= 1:
+    if page is not None and page.has_previous:
         x.button(
             text='⬅️⬅️⬅️',
-            callback_data=NextPage(cursor=cursor - 1, query=args)
+            callback_data=NextPage(session=page.session, cursor=page.cursor - 1)
         )
-    for i, song in enumerate(music):
-        if i == 10:
-            break
+    for i, song in enumerate(music[:SEARCH_PAGE_SIZE]):
         x.button(
             text=f'{i + 1}. {song.artist} - {song.title}',
             callback_data=Song(music_id=song.music_id))
-    if len(music) == 11:
+    if page is not None and page.has_next:
         x.button(
             text='➡️➡️➡️',
-            callback_data=NextPage(cursor=cursor + 1, query=args)
+            callback_data=NextPage(session=page.session, cursor=page.cursor + 1)
         )
     x.adjust(1, repeat=True)
     return x.as_markup()
@@ -74,11 +86,10 @@ async def create_message_text_beatmap(music: list[BeatmapData]) -> str:
     return text
 
 
-async def create_message_text_music(music: list[MusicData], db: Db) -> str:
+async def create_message_text_music(music: list[MusicData]) -> str:
     text = 'Songs found:'
     for i, song in enumerate(music):
-        mappers, _ = await db.find_beatmaps_by_music_id(song.music_id)
-        text += f'\n{i + 1}. <b>{song.artist}</b> - <b>{song.title}</b> | by {", ".join(f"<b>{mapper}</b>" for mapper in mappers)} | <b>{song.length // 60}:{song.length % 60}m</b>'
+        text += f'\n{i + 1}. <b>{song.artist}</b> - <b>{song.title}</b> | by {", ".join(f"<b>{mapper}</b>" for mapper in song.mappers)} | <b>{song.length // 60}:{song.length % 60}m</b>'
     return text
 
 
@@ -96,8 +107,38 @@ async def send_song(query: CallbackQuery, db: Db, callback_data: Song):
 
 @router.callback_query(NextPage.filter())
 async def send_new_page(query: CallbackQuery, db: Db, callback_data: NextPage):
-    await query.answer()
-    cursor = callback_data.cursor
-    args = callback_data.query
-    music = await search_constructor(args, cursor, db)
-    return query.message.edit_reply_markup(await create_music_buttons(music, args, cursor))
+    page = await get_search_page(callback_data.session, callback_data.cursor, db)
+    if page is None:
+        return query.answer('Search results have expired, send /search again.', show_alert=True)
+    await query.answer(TRUNCATED_RESULTS_HINT if page.is_truncated and not page.has_next else None)
+    if not page.music:
+        return
+    return query.message.edit_reply_markup(await create_music_buttons(page.music, page))
+
+
+@router.callback_query(LegacyNextPage.filter())
+async def send_legacy_page(query: CallbackQuery, db: Db, callback_data: LegacyNextPage):
+    """Searches the query of an old button again, its page buttons are switched to the new session."""
+    found = await search_constructor(callback_data.query, db)
+    page = await get_search_page(found.session, callback_data.cursor, db) if isinstance(found, SearchPage) else None
+    if page is None or not page.music:
+        return query.answer('Track not found :(', show_alert=True)
+    await query.answer(TRUNCATED_RESULTS_HINT if page.is_truncated and not page.has_next else None)
+    return query.message.edit_reply_markup(await create_music_buttons(page.music, page))
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery):
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    if not query.query.strip():
+        return query.answer([], cache_time=INLINE_CACHE_TIME)
+    songs = search_index.search(query.query, offset + INLINE_RESULTS_LIMIT + 1)
+    page = songs[offset:offset + INLINE_RESULTS_LIMIT]
+    results = [InlineQueryResultCachedAudio(
+        id=str(song.music_id),
+        audio_file_id=song.file_id,
+        caption=f'<b>{html.escape(song.artist)}</b> - <b>{html.escape(song.title)}</b> | '
+                f'by {", ".join(html.escape(mapper) for mapper in song.mappers)}',
+    ) for song in page]
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if len(songs) > offset + INLINE_RESULTS_LIMIT else ''
+    return query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
@@ -1,29 +1,105 @@
 from aiogram import Router, F
 from aiogram.types import Message
-from collections import Counter
 
 import config
-from db import Db, CommandStat
+from cache import TieredCacheStats
+from db import Db, StatSummary
+from message_constructors.utils.batch import BatchExecutor
+from message_constructors.utils.cache_check import beatmap_data_stats, image_store, osu_file_store, position_batch, \
+    search_index
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.image_store import ImageStore
+from message_constructors.utils.osu_file_store import OsuFileStore
+from message_constructors.utils.search_index import SearchIndex
+from message_constructors.utils.utils import image_batch, star_rating_batch
+from request import Request, RequestScheduler
 
 router = Router()
 
 
-def stat_builder(list_stat: list[CommandStat]) -> str:
-    user_list = []
-    command_stat: Counter[str, int] = Counter()
-    for stat in list_stat:
-        if stat.tg_user_id not in user_list:
-            user_list.append(stat.tg_user_id)
-        command_stat[stat.command] += 1
+def stat_builder(summary: StatSummary) -> str:
     result_message = 'Commands:\n'
-    for command, count in sorted(command_stat.items()):
+    for command, count in sorted(summary.commands.items()):
         result_message += f'{command.upper()}: {count}\n'
-    result_message += f'\nUsers in total: {len(user_list)}'
+    result_message += f'\nUsers in total: {summary.users}'
     return result_message
 
 
 @router.message(F.chat.id == config.REPORT_CHAT_ID, commands=['all_stat', 'as', 'a'])
 async def stat_handler(message: Message, db: Db):
-    list_stat = await db.get_all_stat()
-    stat = stat_builder(list_stat)
+    stat = stat_builder(await db.get_stat_summary())
     await message.answer(f'Stat for all time:\n\n{stat}')
+
+
+def tiered_cache_stat_builder(name: str, stats: TieredCacheStats) -> str:
+    return f'{name}: {stats.lookups} lookups\n' \
+           f'Memory: {stats.memory_hits} ({stats.memory_hit_ratio:.1%})\n' \
+           f'DB: {stats.db_hits} ({stats.db_hit_ratio:.1%} of memory misses)\n' \
+           f'API: {stats.api_fetches}\n'
+
+
+def image_store_stat_builder(name: str, store: ImageStore) -> str:
+    stats = store.stats
+    return f'{name}: {len(store)} files, {store.size / 2 ** 20:.1f}/{store.max_bytes / 2 ** 20:.0f} MiB\n' \
+           f'Hits: {stats.hits} ({stats.hit_ratio:.1%}), misses: {stats.misses}\n' \
+           f'Read: {stats.bytes_read / 2 ** 20:.1f} MiB, written: {stats.bytes_written / 2 ** 20:.1f} MiB\n' \
+           f'Evicted: {stats.evictions} files, {stats.bytes_evicted / 2 ** 20:.1f} MiB, ' \
+           f'outdated removed: {stats.outdated_removed}\n'
+
+
+def osu_file_store_stat_builder(name: str, store: OsuFileStore) -> str:
+    stats = store.stats
+    return f'{name}: {len(store)} files, {store.size / 2 ** 20:.1f}/{store.max_bytes / 2 ** 20:.0f} MiB\n' \
+           f'Hits: {stats.hits} ({stats.hit_ratio:.1%}), misses: {stats.misses}\n' \
+           f'Downloaded: {stats.bytes_downloaded / 2 ** 20:.1f} MiB\n' \
+           f'Compressed: {stats.compressed}, outdated removed: {stats.outdated_removed}, evicted: {stats.evictions}\n'
+
+
+def batch_stat_builder(executor: BatchExecutor) -> str:
+    stats = executor.stats
+    return f'{executor.name}: {stats.items} items in {stats.batches} batches, ' \
+           f'{stats.failures} failed ({stats.timeouts} timed out), ' \
+           f'max {stats.max_in_flight}/{executor.limit} at once\n'
+
+
+def search_index_stat_builder(name: str, index: SearchIndex) -> str:
+    stats = index.stats
+    return f'{name}: {len(index)} songs, {index.words} words\n' \
+           f'Searches: {stats.searches}, avg {stats.average_seconds * 1000:.2f} ms, ' \
+           f'max {stats.max_seconds * 1000:.2f} ms\n'
+
+
+def compute_stat_builder(compute: ComputeExecutor) -> str:
+    """Compute pool tasks and caches of its worker processes, summed over workers."""
+    stats = compute.stats
+    result_message = f'Compute workers: {stats.completed} done, {stats.pending} pending, {stats.failed} failed\n' \
+                     f'Wait: avg {stats.average_wait * 1000:.1f} ms, max {stats.max_wait * 1000:.1f} ms, ' \
+                     f'run: avg {stats.average_run * 1000:.1f} ms\n'
+    for name, cache_stats in stats.caches.items():
+        result_message += f'{name}: hits {cache_stats.hits} ({cache_stats.hit_ratio:.1%}), ' \
+                          f'misses {cache_stats.misses}, evicted {cache_stats.evictions}\n'
+    return result_message
+
+
+def scheduler_stat_builder(scheduler: RequestScheduler) -> str:
+    result_message = f'Scheduler: {scheduler.penalties} 429 penalties\n'
+    queue_depth = scheduler.queue_depth
+    for lane, stats in scheduler.stats.items():
+        result_message += f'{lane.name.lower()}: {queue_depth[lane]} queued, {stats.served} served, ' \
+                          f'wait avg {stats.average_wait * 1000:.0f} ms, max {stats.max_wait * 1000:.0f} ms\n'
+    return result_message
+
+
+@router.message(F.chat.id == config.REPORT_CHAT_ID, commands=['cache_stat', 'cs'])
+async def cache_stat_handler(message: Message, request: Request, compute: ComputeExecutor):
+    await message.answer(f'Cache stat since start:\n\n'
+                         f'{tiered_cache_stat_builder("Beatmap data", beatmap_data_stats)}\n'
+                         f'{image_store_stat_builder("Covers", image_store)}\n'
+                         f'{osu_file_store_stat_builder(".osu files", osu_file_store)}\n'
+                         f'{search_index_stat_builder("Search index", search_index)}\n'
+                         f'{compute_stat_builder(compute)}\n'
+                         f'{scheduler_stat_builder(request.scheduler)}\n'
+                         f'Batches:\n'
+                         f'{batch_stat_builder(image_batch)}'
+                         f'{batch_stat_builder(star_rating_batch)}'
+                         f'{batch_stat_builder(position_batch)}')
@@ -11,15 +11,16 @@ from handlers.stat_handler import stat_builder
 
 async def everyday_stat_handler():
     db = await Db.connect(config.DB_USER, config.DB_PASSWORD, config.DB_HOST, config.DB_NAME)
-    list_stat = await db.get_all_stat(datetime.datetime.utcnow())
+    day = datetime.datetime.utcnow().date()
+    summary = await db.get_stat_summary(day, day)
     await db.close()
-    if not list_stat:
+    if not summary.commands:
         return
-    stat = stat_builder(list_stat)
+    stat = stat_builder(summary)
     bot = Bot(config.TG_TOKEN)
     await bot.send_message(
         config.REPORT_CHAT_ID,
-        f'Stat for {humanize.naturalday(list_stat[0].date)}:\n\n{stat}'
+        f'Stat for {humanize.naturalday(day)}:\n\n{stat}'
     )
     await bot.session.close()
     await asyncio.sleep(0.1)
@@ -1,24 +1,30 @@
-from io import BytesIO
+import asyncio
+from typing import Optional
 
-from PIL import Image
 from aiogram import Router, Bot
 from aiogram.dispatcher.filters import CommandObject
 from aiogram.types import Message, BufferedInputFile
-from httpx import ReadTimeout, HTTPStatusError
+from httpx import TimeoutException, HTTPStatusError
 
+from api_model.beatmap import Beatmap
 from db import Db
 from message_constructors.top_five_constructor import top_five_message_constructor, thumbnail_maker
 from message_constructors.utils.cache_check import get_osu_id_by_username
-from message_constructors.utils.class_constructor import create_user_data_class, get_scores
-from message_constructors.utils.utils import gather_requests, get_saved_image
+from message_constructors.utils.class_constructor import create_user_data_class, get_scores, create_score_classes
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.fetch_plan import FetchPlan
+from message_constructors.utils.telegram_files import reply_photo_cached, reply_rendered, remember_rendered
+from message_constructors.utils.utils import get_saved_image, get_beatmap_star_rating, image_batch, \
+    star_rating_batch
 from model.score import Score
-from request import Request
+from request import Request, BanchoUnavailable
 
 router = Router()
 
 
 @router.message(commands=['top5'])
-async def top_five(message: Message, command: CommandObject, request: Request, db: Db, bot: Bot,):
+async def top_five(message: Message, command: CommandObject, request: Request, db: Db, bot: Bot,
+                   compute: ComputeExecutor):
     await bot.send_chat_action(message.chat.id, 'upload_video')
     username = command.args
     user_id = await get_osu_id_by_username(username, db, request, message.from_user.id)
@@ -29,11 +35,20 @@ async def top_five(message: Message, command: CommandObject, request: Request, d
         return message.reply('User not found.')
     try:
         dict_scores = await get_scores(user_id, request, 'best', 5)
-        scores: list[Score] = await gather_requests(dict_scores, 'score', request, db)
-        images: list[Image.Image] = await gather_requests(scores, 'image', request, db)
-        user_data = await create_user_data_class(user_id, request)
-        star_ratings = await gather_requests(scores, 'sr', request, db)
-    except ReadTimeout:
+        response_key = ('top5', user_id, max(score['id'] for score in dict_scores))
+        if await reply_rendered(message, response_key) is not None:
+            return await db.save_command_stat(message.date, 'top5', message.from_user.id)
+        plan = FetchPlan('top5')
+        plan.add('user_data', lambda: create_user_data_class(user_id, request))
+        plan.add('scores', lambda: create_score_classes(dict_scores, request, db))
+        # star ratings only need raw scores, so every score's .osu file download and calculation runs
+        # while scores are built, and only for mods that change star rating
+        plan.add('star_ratings', lambda: star_rating_batch.map(lambda score: get_beatmap_star_rating(
+            Beatmap.parse_obj(score['beatmap']), score['mods'], score['mode_int'],
+            score['beatmap']['difficulty_rating'], request, db, compute,
+        ), dict_scores))
+        results = await plan.run()
+    except (TimeoutException, BanchoUnavailable):
         return message.reply('Bancho is dead.')
     except HTTPStatusError as e:
         if e.response.status_code // 100 == 5:
@@ -41,15 +56,38 @@ async def top_five(message: Message, command: CommandObject, request: Request, d
         raise
     except TypeError as e:
         return message.reply("User hasn't set any scores yet.")
+    scores: list[Score] = results['scores']
+    user_data = results['user_data']
+    # a failed rating shouldn't fail the whole command, nomod rating is shown instead
+    star_ratings = results['star_ratings'].values_or(lambda i: scores[i].beatmap_data.stars)
 
-    if len(images) == 5:
-        thumbnail = thumbnail_maker(images)
-    else:  # dumb situation fix when user have less than 5 scores
-        bg = await get_saved_image(scores[0].beatmap.id, scores[0].beatmapset.cover, request)
-        thumbnail = BytesIO()
-        bg.save(thumbnail, 'png')
-    thumbnail.seek(0)
+    async def get_thumbnail() -> Optional[BufferedInputFile]:
+        images = await image_batch.map(lambda score: get_saved_image(
+            'list@2x', score.beatmapset.id, score.beatmapset.square_cover, request
+        ), scores)
+        try:
+            covers = images.values()
+        except HTTPStatusError:  # a missing cover, the placeholder is sent instead
+            return None
+        return BufferedInputFile(await compute.run(thumbnail_maker, covers), "file.png")
+
+    async def get_cover() -> Optional[BufferedInputFile]:
+        try:
+            cover = await get_saved_image('cover', scores[0].beatmapset.id, scores[0].beatmapset.cover, request)
+        except HTTPStatusError:
+            return None
+        return BufferedInputFile(cover, "file.png")
 
     msg = top_five_message_constructor(scores, user_data, star_ratings)
-    await message.reply_photo(BufferedInputFile(thumbnail.read(), "file.png"), msg)
+    try:
+        if len(scores) == 5:
+            thumbnail_source = ' '.join(score.beatmapset.square_cover for score in scores)
+            sent = await reply_photo_cached(message, 'top5', thumbnail_source, get_thumbnail, db, msg,
+                                            fallback='images/osu_bg.png')
+        else:  # dumb situation fix when user have less than 5 scores, the cover is sent as is
+            sent = await reply_photo_cached(message, 'cover', scores[0].beatmapset.cover, get_cover, db, msg,
+                                            fallback='images/osu_bg.png')
+    except (TimeoutException, asyncio.TimeoutError, BanchoUnavailable):
+        return message.reply('Bancho is dead.')
+    remember_rendered(response_key, sent, msg)
     await db.save_command_stat(message.date, 'top5', message.from_user.id)
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from pathlib import Path
+from time import monotonic
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import FSInputFile
+from tinytag import TinyTag
+
+import config
+from db import Db, tokenize_music_text
+from message_constructors.utils.utils import get_edited_bpm
+
+STATE_PATH = 'import_songs_state.json'
+# Bot API upload limit
+MAX_AUDIO_SIZE = 50 * 1024 * 1024
+# Formats telegram keeps as audio, others (.ogg, .wav) come back as documents or voice messages, whose file ids
+# can't be sent as audio
+AUDIO_EXTENSIONS = {'.mp3', '.m4a'}
+TV_SIZE = re.compile(r'tv[ .\-_]?(size|ver)', re.IGNORECASE)
+
+
+@dataclass
+class Track:
+    folder: str
+    audio_path: str  # relative to the Songs folder, also the key of the uploaded file id in the state file
+    artist: str
+    title: str
+    length: int
+    is_tv_size: bool
+    is_bpm_changed: bool
+    tags: str
+    mappers: set[tuple[str, int]] = field(default_factory=set)  # (mapper, beatmapset id)
+    words: set[str] = field(default_factory=set)  # names that aren't in the search document, e.g. unicode ones
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        return self.artist, self.title, self.length
+
+
+def read_osu_metadata(path: str) -> dict[str, str]:
+    """Returns [General] and [Metadata] values of a .osu file, stops reading before hit objects."""
+    metadata = {}
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line in ('[Difficulty]', '[Events]', '[TimingPoints]', '[HitObjects]'):
+                break
+            key, sep, value = line.partition(':')
+            if sep and not line.startswith('['):
+                metadata[key.strip()] = value.strip()
+    return metadata
+
+
+def scan_beatmapset(songs_path: str, folder: str) -> list[Track]:
+    """Returns a track per audio file used by difficulties of a beatmapset folder."""
+    folder_path = os.path.join(songs_path, folder)
+    try:
+        file_names = os.listdir(folder_path)
+    except (NotADirectoryError, FileNotFoundError):
+        return []
+    folder_set_id = folder.split(' ', 1)[0]
+    tracks: dict[str, Track] = {}
+    for file_name in file_names:
+        if not file_name.endswith('.osu'):
+            continue
+        osu_path = os.path.join(folder_path, file_name)
+        try:
+            metadata = read_osu_metadata(osu_path)
+        except OSError:
+            continue
+        audio_name = metadata.get('AudioFilename')
+        set_id = metadata.get('BeatmapSetID', folder_set_id)
+        if not audio_name or not set_id.isdigit() or int(set_id) <= 0:  # unsubmitted maps have nothing to link to
+            continue
+        if os.path.splitext(audio_name)[1].lower() not in AUDIO_EXTENSIONS:
+            continue
+        track = tracks.get(audio_name)
+        if track is None:
+            audio_path = os.path.join(folder_path, audio_name)
+            try:
+                if os.path.getsize(audio_path) > MAX_AUDIO_SIZE:
+                    continue
+                length = round(TinyTag.get(audio_path).duration or 0)
+            except Exception:  # missing or broken audio, tinytag raises its own errors too
+                continue
+            if length <= 0:
+                continue
+            title = metadata.get('Title', '')
+            track = tracks[audio_name] = Track(
+                folder=folder,
+                audio_path=os.path.join(folder, audio_name),
+                artist=metadata.get('Artist', ''),
+                title=title,
+                length=length,
+                is_tv_size=TV_SIZE.search(title) is not None,
+                is_bpm_changed=get_edited_bpm(Path(audio_path), Path(osu_path)) is not None,
+                tags=metadata.get('Tags', ''),
+            )
+        elif not track.is_bpm_changed:
+            track.is_bpm_changed = get_edited_bpm(Path(folder_path, audio_name), Path(osu_path)) is not None
+        if metadata.get('Creator'):
+            track.mappers.add((metadata['Creator'], int(set_id)))
+        for name in ('ArtistUnicode', 'TitleUnicode', 'Source'):
+            track.words.update(tokenize_music_text(metadata.get(name, '')))
+    for track in tracks.values():
+        track.words -= set(tokenize_music_text(' '.join([track.artist, track.title, track.tags])))
+    return list(tracks.values())
+
+
+def scan_beatmapset_args(args: tuple[str, str]) -> list[Track]:
+    return scan_beatmapset(*args)
+
+
+def merge_tracks(tracks: list[Track]) -> list[Track]:
+    """Dedupes tracks by artist, title and length, joining their mappers and words."""
+    merged: dict[tuple[str, str, int], Track] = {}
+    for track in tracks:
+        saved = merged.get(track.key)
+        if saved is None:
+            merged[track.key] = track
+            continue
+        saved.mappers |= track.mappers
+        saved.words |= track.words
+        saved.is_bpm_changed = saved.is_bpm_changed or track.is_bpm_changed
+    return list(merged.values())
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'uploads': {}, 'imported': []}
+
+
+def save_state(path: str, state: dict) -> None:
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(f'{path}.tmp', path)
+
+
+async def upload_tracks(bot: Bot, chat_id: int, songs_path: str, tracks: list[Track], state: dict, state_path: str,
+                        concurrency: int) -> None:
+    """Sends audio of new tracks to the chat to get telegram file ids, saving them to the state file as they come."""
+    semaphore = asyncio.Semaphore(concurrency)
+    started = monotonic()
+    done = 0
+
+    async def upload(track: Track) -> None:
+        nonlocal done
+        async with semaphore:
+            while True:
+                try:
+                    message = await bot.send_audio(
+                        chat_id, FSInputFile(os.path.join(songs_path, track.audio_path)),
+                        performer=track.artist, title=track.title, duration=track.length,
+                    )
+                    break
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except (TelegramAPIError, OSError) as e:
+                    print(f'Failed to upload {track.audio_path}: {e}')
+                    return
+        if message.audio is None:  # telegram didn't take the file as audio
+            print(f'Failed to upload {track.audio_path}: sent as {message.content_type}')
+            return
+        state['uploads'][track.audio_path] = message.audio.file_id
+        done += 1
+        if done % 20 == 0 or done == len(tracks):
+            save_state(state_path, state)
+            print(f'{done}/{len(tracks)} uploaded, {round(done / (monotonic() - started), 1)} tracks/s')
+
+    await asyncio.gather(*(upload(track) for track in tracks))
+    save_state(state_path, state)
+
+
+async def main(songs_path: str, workers: Optional[int], uploads: int, chat_id: int, state_path: str):
+    state = load_state(state_path)
+    imported = set(state['imported'])
+    folders = [folder for folder in sorted(os.listdir(songs_path)) if folder not in imported]
+    started = monotonic()
+    tracks = []
+    with Pool(workers) as pool:
+        scanned = pool.imap_unordered(scan_beatmapset_args, ((songs_path, folder) for folder in folders), chunksize=8)
+        for i, folder_tracks in enumerate(scanned, 1):
+            tracks.extend(folder_tracks)
+            if i % 500 == 0 or i == len(folders):
+                print(f'{i}/{len(folders)} beatmapsets scanned, {round(i / (monotonic() - started), 1)} sets/s')
+    tracks = merge_tracks(tracks)
+    if not tracks:
+        print('Nothing to import')
+        return
+
+    db = await Db.connect(config.DB_USER, config.DB_PASSWORD, config.DB_HOST, config.DB_NAME)
+    saved_keys = await db.get_saved_music_keys()
+    new_tracks = [track for track in tracks if track.key not in saved_keys]
+    print(f'{len(tracks)} tracks, {len(new_tracks)} new')
+    bot = Bot(config.TG_TOKEN)
+    try:
+        await upload_tracks(bot, chat_id, songs_path,
+                            [track for track in new_tracks if track.audio_path not in state['uploads']],
+                            state, state_path, uploads)
+    finally:
+        await bot.session.close()
+
+    # new tracks that failed to upload are left out, so their folders are scanned again on the next run
+    failed_folders = {track.folder for track in new_tracks if track.audio_path not in state['uploads']}
+    music, links, tokens = [], [], []
+    for import_key, track in enumerate(tracks):
+        if track.key not in saved_keys and track.audio_path not in state['uploads']:
+            continue
+        music.append((import_key, state['uploads'].get(track.audio_path), track.artist, track.title, track.length,
+                      track.is_tv_size, track.is_bpm_changed, track.tags))
+        links.extend((import_key, mapper, beatmapset_id) for mapper, beatmapset_id in track.mappers)
+        tokens.extend((import_key, word) for word in track.words)
+    new_count = await db.import_music(music, links, tokens)
+    await db.close()
+    print(f'{new_count} songs saved, {len(links)} mapper links and {len(tokens)} tokens merged')
+
+    state['imported'] = sorted(imported | {folder for folder in folders if folder not in failed_folders})
+    save_state(state_path, state)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports songs from an osu! Songs folder into the music catalog.')
+    parser.add_argument('songs_path', help='osu! Songs folder')
+    parser.add_argument('--workers', type=int, default=None, help='number of scanning processes, defaults to CPU count')
+    parser.add_argument('--uploads', type=int, default=4, help='audio files uploaded at once')
+    parser.add_argument('--chat-id', type=int, default=config.REPORT_CHAT_ID,
+                        help='chat audio is uploaded to for telegram file ids, defaults to the report chat')
+    parser.add_argument('--state', default=STATE_PATH,
+                        help='file with uploaded file ids and imported folders, to resume interrupted imports')
+    args = parser.parse_args()
+    asyncio.run(main(args.songs_path, args.workers, args.uploads, args.chat_id, args.state))
@@ -1,6 +1,5 @@
 from datetime import datetime
 from html import escape
-from typing import Iterator
 
 from aiogram.dispatcher.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup
@@ -9,8 +8,8 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from api_model.beatmap import BeatmapData
 from api_model.user_data import UserData
 from message_constructors.score_info_constructors import get_score_as_text_full
-from message_constructors.utils.osu_calculators import get_expanded_beatmap_file, get_converted_star_rating, \
-    get_pp_flexible
+from db import DifficultyAttributes
+from message_constructors.utils.osu_calculators import get_pp_for_accuracies
 from message_constructors.utils.utils import build_flag, build_user_url, parse_mods, build_combo_line, build_miss_line, \
     parse_score_rank, build_completed_percentage_line, get_pp_line, is_star_rating_right, build_position_line
 from model.score import Score
@@ -82,7 +81,12 @@ def get_stat_message_text(
            f"{pp_line}"
 
 
-def recent_message_constructor(score: Score, user: UserData, message_date: datetime, osu_file: Iterator[str]) -> str:
+def recent_message_constructor(
+        score: Score,
+        user: UserData,
+        message_date: datetime,
+        attributes: DifficultyAttributes,
+) -> str:
     flag = build_flag(user.country_code)
     user_url = build_user_url(score.user_id)
     score_time = humanize.naturaltime(message_date - score.created_at)
@@ -91,13 +95,11 @@ def recent_message_constructor(score: Score, user: UserData, message_date: datet
     miss_line = build_miss_line(score.statistics.count_miss)
     position_line = build_position_line(score.position)
     parsed_rank = parse_score_rank(score.rank)
-    expanded_beatmap_file = get_expanded_beatmap_file(osu_file)
-    stars = get_converted_star_rating(score.mods, expanded_beatmap_file)
     star_rating = score.beatmap_data.stars \
         if is_star_rating_right(mods) \
-        else stars.total
+        else attributes.total
     completed_line = build_completed_percentage_line(score.statistics, score.beatmap_data)
-    pp_line = get_pp_line(score, parsed_rank, stars, expanded_beatmap_file)
+    pp_line = get_pp_line(score, parsed_rank, attributes)
     message = get_message_text(
         score,
         star_rating,
@@ -117,19 +119,11 @@ def recent_message_constructor(score: Score, user: UserData, message_date: datet
     return message
 
 
-def recent_message_stat_constructor(score: Score, osu_file: Iterator[str]) -> str:
-    expanded_beatmap_file = get_expanded_beatmap_file(osu_file)
-    stars = get_converted_star_rating(score.mods, expanded_beatmap_file)
+def recent_message_stat_constructor(score: Score, attributes: DifficultyAttributes) -> str:
     acc = [1.0, 0.99, 0.98, 0.97, 0.95]
+    pp_values = get_pp_for_accuracies(acc, score.mods, score.beatmap_data, attributes)
     pp_line = ''
-    for a in acc:
-        pp = get_pp_flexible(
-            a,
-            score.mods,
-            score.beatmap_data,
-            stars,
-            expanded_beatmap_file
-        )
+    for a, pp in zip(acc, pp_values.tolist()):
         pp_line += f'<b>{round(pp, 2)}pp</b> for <b>{round(a * 100)}%</b>\n'
     message = get_stat_message_text(
         score.beatmap_data,
@@ -139,7 +133,7 @@ def recent_message_stat_constructor(score: Score, osu_file: Iterator[str]) -> st
         score.beatmap_data.difficulty_name,
         score.beatmap_data.url,
         score.beatmap_data.bpm,
-        stars.total,
+        attributes.total,
         score.beatmap_data.total_length,
         pp_line
     )
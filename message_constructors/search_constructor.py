@@ -1,29 +1,50 @@
 import re
+import secrets
+from dataclasses import dataclass
 from typing import Optional, Union
 
-from db import BeatmapData, Db, MusicData
-from message_constructors.utils.utils import get_id_list
+from db import BeatmapData, Db, MusicData, SEARCH_PAGE_SIZE
+from message_constructors.utils.cache_check import search_sessions
 
+# Sessions keep at most that many results, with the session count cap it bounds the store memory
+SEARCH_SESSION_MAX_RESULTS = 20 * SEARCH_PAGE_SIZE
 
-async def search_constructor(args: str, cursor: int, db: Db) -> Union[list[BeatmapData], list[MusicData], None]:
+
+@dataclass
+class SearchPage:
+    session: str
+    cursor: int
+    music: list[MusicData]
+    has_next: bool
+    is_truncated: bool = False  # more than `SEARCH_SESSION_MAX_RESULTS` songs were found, the rest aren't kept
+
+    @property
+    def has_previous(self) -> bool:
+        return self.cursor > 0
+
+
+async def search_constructor(args: str, db: Db) -> Union[list[BeatmapData], SearchPage, None]:
     match = re.match(r'https://osu\.ppy\.sh/beatmapsets/([0-9]+)*', args)
     if match is not None:
         songs = await db.find_music_by_beatmap_id(int(match[1]))
         return songs
 
-    music: list[MusicData] = []
-    music.extend(await db.find_music(args, cursor))
-    sorted_ids = await get_id_list(args, db)
-
-    for i, file_id in enumerate(sorted_ids):
-        if i < cursor * 10:
-            continue
-        if len(music) > 10:
-            break
-        in_music = False
-        for song in music:
-            if file_id == song.file_id:
-                in_music = True
-        if not in_music:
-            music.append(await db.find_music_by_file_id(file_id))
-    return music
+    music_ids = await db.search_music_ids(args, SEARCH_SESSION_MAX_RESULTS + 1)
+    if not music_ids:
+        return None
+    session = secrets.token_urlsafe(6)
+    is_truncated = len(music_ids) > SEARCH_SESSION_MAX_RESULTS
+    search_sessions[session] = (tuple(music_ids[:SEARCH_SESSION_MAX_RESULTS]), is_truncated)
+    return await get_search_page(session, 0, db)
+
+
+async def get_search_page(session: str, cursor: int, db: Db) -> Optional[SearchPage]:
+    """Returns a page of saved search results, or None if the session has expired."""
+    saved = search_sessions.get(session)
+    if saved is None:
+        return None
+    music_ids, is_truncated = saved
+    start = cursor * SEARCH_PAGE_SIZE
+    music = await db.get_music_by_ids(list(music_ids[start:start + SEARCH_PAGE_SIZE]))
+    return SearchPage(session, cursor, music, has_next=len(music_ids) > start + SEARCH_PAGE_SIZE,
+                      is_truncated=is_truncated)
@@ -20,8 +20,9 @@ class MapData:
 
 
 # TODO: write pp and score place on bg || 09.02.2022
-def thumbnail_maker(image_list: list[Image.Image], pp_list: list[int] = [1, 1, 1, 1, 1]) -> BytesIO:
+def thumbnail_maker(image_list: list[bytes], pp_list: list[int] = [1, 1, 1, 1, 1]) -> bytes:
     parts = []
+    image_list = [Image.open(BytesIO(image)) for image in image_list]
     plays_data = [
         MapData(image_list[3], pp_list[3], 4, 80),
         MapData(image_list[1], pp_list[1], 2, 120),
@@ -50,9 +51,13 @@ def thumbnail_maker(image_list: list[Image.Image], pp_list: list[int] = [1, 1, 1
     indent = [0, 109, 155, 226, 340]
     for i, part in enumerate(parts):
         bg.paste(part, (300 * i - indent[i], 0, 300 + 300 * i - indent[i], 300), part)
+    return image_to_png(bg)
+
+
+def image_to_png(image: Image.Image) -> bytes:
     tmp = BytesIO()
-    bg.save(tmp, 'png')
-    return tmp
+    image.save(tmp, 'png')
+    return tmp.getvalue()
 
 
 def top_five_message_constructor(scores: list[Score], user: UserData, star_ratings: list[float]) -> str:
@@ -0,0 +1,90 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Iterable, Optional, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    items: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    max_in_flight: int = 0
+
+
+@dataclass
+class BatchResult(Generic[R]):
+    """Results and errors of a batch in item order, exactly one of them is set for every item."""
+    results: list[Optional[R]]
+    errors: list[Optional[BaseException]]
+
+    @property
+    def failed(self) -> int:
+        return sum(error is not None for error in self.errors)
+
+    def values(self) -> list[R]:
+        """Returns results, raising the first error if any item failed."""
+        for error in self.errors:
+            if error is not None:
+                raise error
+        return self.results
+
+    def values_or(self, fallback: Callable[[int], R]) -> list[R]:
+        """Returns results with failed items replaced by `fallback(index)`."""
+        return [fallback(i) if error is not None else result
+                for i, (result, error) in enumerate(zip(self.results, self.errors))]
+
+
+class BatchExecutor:
+    """
+    Runs a coroutine function over a list of items with bounded concurrency.
+
+    The limit is shared by every batch of the executor, so concurrent commands together don't run more than `limit`
+    items at once and large batches queue instead of exhausting the connection pool. One item failing or timing out
+    doesn't cancel the others, the caller decides what to do with partial results.
+
+    :param name: Used in stats.
+    :param limit: Max items running at once.
+    :param timeout: Seconds one item may run, waiting for a free slot isn't counted.
+    """
+    def __init__(self, name: str, limit: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.stats = BatchStats()
+        self._semaphore = asyncio.Semaphore(limit)
+        self._in_flight = 0
+
+    async def _run_item(self, func: Callable[[T], Awaitable[R]], item: T) -> R:
+        async with self._semaphore:
+            self._in_flight += 1
+            self.stats.max_in_flight = max(self.stats.max_in_flight, self._in_flight)
+            try:
+                return await asyncio.wait_for(func(item), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                raise
+            finally:
+                self._in_flight -= 1
+
+    async def map(self, func: Callable[[T], Awaitable[R]], items: Iterable[T]) -> BatchResult[R]:
+        """Runs `func` for every item and returns results in item order."""
+        items = list(items)
+        self.stats.batches += 1
+        self.stats.items += len(items)
+        outcomes = await asyncio.gather(*(self._run_item(func, item) for item in items), return_exceptions=True)
+        result = BatchResult([], [])
+        for outcome in outcomes:
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                self.stats.failures += 1
+                result.results.append(None)
+                result.errors.append(outcome)
+            else:
+                result.results.append(outcome)
+                result.errors.append(None)
+        return result
@@ -1,21 +1,52 @@
-from datetime import datetime
-from io import BytesIO
-from typing import Optional, TextIO
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
 
-from PIL import Image
 from httpx import HTTPStatusError
 from pydantic import ValidationError
 
-from api_model.beatmap import BeatmapData
-from db import Db
+from api_model.base_score import BaseScore
+from api_model.beatmap import Beatmap, BeatmapData
+from cache import LRUCache, TieredCacheStats, TTLCache
+from db import Db, DifficultyAttributes
+from message_constructors.utils.batch import BatchExecutor
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.image_store import ImageStore
+from message_constructors.utils.osu_file_store import EmptyOsuFile, OsuFileStore
+from message_constructors.utils.search_index import SearchIndex
+from message_constructors.utils.osu_calculators import recalculate_mods, get_difficulty_attributes as calculate_attributes
 from request import Request
 
+# Saved leaderboard positions are re-checked after this interval...
+POSITION_RECHECK_INTERVAL = timedelta(hours=1)
+# ...unless the map leaderboard is final and the score was this old when its position was checked
+POSITION_FREEZE_AGE = timedelta(days=30)
+FROZEN_LEADERBOARD_STATUSES = {'ranked', 'approved', 'loved'}
+
+# Validated beatmap data with the last updated datetime it was saved for, in front of the beatmap_data table
+beatmap_data_cache: LRUCache[int, tuple[BeatmapData, datetime]] = LRUCache(2048)
+beatmap_data_stats = TieredCacheStats()
+
+# Beatmapset covers, shared by all difficulties of a set
+image_store = ImageStore('images/cache', 512 * 1024 * 1024)
+osu_file_store = OsuFileStore('beatmap_files/osu_file', 1024 * 1024 * 1024)
+
+# Ranked music ids of /search results and whether more were found, by session id, so page turns don't search again
+SEARCH_SESSION_TTL = 30 * 60
+search_sessions: TTLCache[str, tuple[tuple[int, ...], bool]] = TTLCache(1024, SEARCH_SESSION_TTL)
+
+# Whole music catalog for inline search, filled by `SearchIndex.keep_fresh` started with the bot
+search_index = SearchIndex()
+
+# Leaderboard position requests of all commands, a position that fails or times out is shown as unknown
+position_batch = BatchExecutor('score positions', limit=8, timeout=15)
+
 
 async def _get_osu_id(username: str, db: Db, request: Request) -> Optional[int]:
     osu_id = await db.get_cached_osu_id_by_username(username)
     if osu_id is None:
         osu_id = await request.get_user_id(username)
         if osu_id == 0:
+            db.cache_unknown_username(username)
             return osu_id
         await db.cache_osu_user(username, osu_id)
     return osu_id
@@ -40,77 +71,189 @@ async def bind_osu_id_with_tg_id(username: str, db: Db, request: Request, tg_use
     return True
 
 
-async def get_score_position(score_id: int, created_at: datetime, user_id: int, beatmap_id: int, request: Request) -> Optional[int]:
-    position = None
-    if score_id is not None:
-        try:
-            raw_submitted_user_beatmap_score = await request.get_user_beatmap_score(beatmap_id, user_id)
-        except HTTPStatusError as e:
-            if e.response.status_code == 404:
-                return None
-            raise
-        position = raw_submitted_user_beatmap_score['position'] \
-            if datetime.fromisoformat(raw_submitted_user_beatmap_score['score']['created_at']) == created_at \
-            else None
-    return position
+def is_saved_position_actual(created_at: datetime, status: str, updated_at: datetime, now: datetime) -> bool:
+    """
+    Positions of old scores on maps with a final leaderboard are frozen, everything else is re-checked
+    every `POSITION_RECHECK_INTERVAL`.
+    """
+    if status in FROZEN_LEADERBOARD_STATUSES and updated_at - created_at >= POSITION_FREEZE_AGE:
+        return True
+    return now - updated_at < POSITION_RECHECK_INTERVAL
+
+
+async def _request_score_position(score: BaseScore, request: Request) -> Optional[int]:
+    try:
+        raw_submitted_user_beatmap_score = await request.get_user_beatmap_score(score.beatmap.id, score.user_id)
+    except HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return None
+        raise
+    return raw_submitted_user_beatmap_score['position'] \
+        if datetime.fromisoformat(raw_submitted_user_beatmap_score['score']['created_at']) == score.created_at \
+        else None
+
+
+async def get_score_positions(scores: list[BaseScore], statuses: list[str], db: Db, request: Request) -> list[Optional[int]]:
+    """
+    Returns user's leaderboard position for every score. Saved positions are read in one query, stale or missing ones
+    are requested concurrently and saved back in one query. Positions that can't be requested are None.
+
+    :param scores: Scores to get positions for, ones without best id have no position.
+    :param statuses: Beatmap status for every score.
+    """
+    best_ids = [score.best_id for score in scores if score.best_id is not None]
+    if not best_ids:
+        return [None] * len(scores)
+    saved = await db.get_user_score_positions(best_ids)
+    now = datetime.now(timezone.utc)
+    to_cache = []
+
+    async def get_position(score_with_status: tuple[BaseScore, str]) -> Optional[int]:
+        score, status = score_with_status
+        if score.best_id is None:
+            return None
+        if score.best_id in saved:
+            position, updated_at = saved[score.best_id]
+            if is_saved_position_actual(score.created_at, status, updated_at, now):
+                return position
+        position = await _request_score_position(score, request)
+        to_cache.append((score.best_id, position))
+        return position
+
+    positions = await position_batch.map(get_position, zip(scores, statuses))
+    if to_cache:
+        await db.cache_user_score_positions(to_cache)
+    return positions.values_or(lambda i: None)
+
+
+async def get_score_position(score: BaseScore, status: str, db: Db, request: Request) -> Optional[int]:
+    positions = await get_score_positions([score], [status], db, request)
+    return positions[0]
+
+
+def _get_memory_cached_beatmap_data(beatmap_id: int, actual_last_updated: datetime) -> Optional[BeatmapData]:
+    cached = beatmap_data_cache.get(beatmap_id)
+    if cached is None:
+        return None
+    beatmap_data, last_updated = cached
+    if last_updated != actual_last_updated:
+        beatmap_data_cache.pop(beatmap_id)
+        return None
+    return beatmap_data
+
+
+def _parse_saved_beatmap_data(
+        saved: Optional[tuple[dict[str, Any], datetime]],
+        actual_last_updated: datetime,
+) -> Optional[BeatmapData]:
+    """Returns saved beatmap data if it's saved for the actual beatmap version and still valid, otherwise None."""
+    if saved is None:
+        return None
+    saved_beatmap_data, saved_last_updated = saved
+    if saved_last_updated != actual_last_updated:
+        return None
+    try:
+        return BeatmapData.parse_obj(saved_beatmap_data)
+    except ValidationError:
+        return None
 
 
 async def get_beatmap_data(beatmap_id: int, actual_last_updated: datetime, db: Db, request: Request) -> BeatmapData:
-    saved_beatmap_data, saved_last_updated = None, None
-    result = await db.get_beatmap_data(beatmap_id)
-    if result is not None:
-        saved_beatmap_data, saved_last_updated = result
-    if saved_beatmap_data is None or actual_last_updated != saved_last_updated:
+    """
+    Returns beatmap data from the first tier that has it for the actual beatmap version: memory, Postgres or the API.
+    Lower tiers are filled on the way back.
+    """
+    beatmap_data = _get_memory_cached_beatmap_data(beatmap_id, actual_last_updated)
+    if beatmap_data is not None:
+        beatmap_data_stats.memory_hits += 1
+        return beatmap_data
+    beatmap_data = _parse_saved_beatmap_data(await db.get_beatmap_data(beatmap_id), actual_last_updated)
+    if beatmap_data is not None:
+        beatmap_data_stats.db_hits += 1
+    else:
         raw_beatmap_data = await request.get_beatmap(beatmap_id)
         beatmap_data = BeatmapData.parse_obj(raw_beatmap_data)
         await db.cache_beatmap_data(beatmap_id, beatmap_data.json(by_alias=True), actual_last_updated)
-    else:
-        try:
-            beatmap_data = BeatmapData.parse_raw(saved_beatmap_data)
-        except ValidationError as e:
-            raw_beatmap_data = await request.get_beatmap(beatmap_id)
-            beatmap_data = BeatmapData.parse_obj(raw_beatmap_data)
-            await db.cache_beatmap_data(beatmap_id, beatmap_data.json(by_alias=True), actual_last_updated)
+        beatmap_data_stats.api_fetches += 1
+    beatmap_data_cache[beatmap_id] = (beatmap_data, actual_last_updated)
     return beatmap_data
 
 
-def get_saved_pic(path: str, osu_id: int) -> Optional[Image.Image]:
+async def get_beatmaps_data(beatmaps: list[Beatmap], db: Db, request: Request) -> dict[int, BeatmapData]:
     """
-    Tries to get an Image from path.
+    Batched `get_beatmap_data`. Reads memory first, then Postgres in one query, fetches everything missing or outdated
+    in one request and saves it back in one query.
 
-    :param path: Path, where image should be.
-    :param osu_id: For osu map cover - "map_bg_cover". For osu user pfp - "user_pfp".
-    :return: PIL.Image.Image. If image is not found, returns None.
+    :return: BeatmapData by beatmap id.
     """
-    try:
-        img: Image.Image = Image.open(f'images/cache/{path}/{osu_id}.png')
-    except FileNotFoundError:
-        return None
-    return img
+    actual_last_updated = {beatmap.id: beatmap.last_updated for beatmap in beatmaps}
+    beatmaps_data: dict[int, BeatmapData] = {}
+    for beatmap_id, last_updated in actual_last_updated.items():
+        beatmap_data = _get_memory_cached_beatmap_data(beatmap_id, last_updated)
+        if beatmap_data is not None:
+            beatmaps_data[beatmap_id] = beatmap_data
+            beatmap_data_stats.memory_hits += 1
 
+    not_in_memory = [beatmap_id for beatmap_id in actual_last_updated if beatmap_id not in beatmaps_data]
+    if not not_in_memory:
+        return beatmaps_data
+    saved = await db.get_beatmaps_data(not_in_memory)
+    for beatmap_id in not_in_memory:
+        beatmap_data = _parse_saved_beatmap_data(saved.get(beatmap_id), actual_last_updated[beatmap_id])
+        if beatmap_data is not None:
+            beatmaps_data[beatmap_id] = beatmap_data
+            beatmap_data_cache[beatmap_id] = (beatmap_data, actual_last_updated[beatmap_id])
+            beatmap_data_stats.db_hits += 1
 
-def save_pic(path: str, osu_id: int, byte_cover: bytes) -> Image.Image:
-    """
-    Saves an Image.
+    missing = [beatmap_id for beatmap_id in not_in_memory if beatmap_id not in beatmaps_data]
+    if not missing:
+        return beatmaps_data
+    to_cache = []
+    for raw_beatmap_data in await request.get_beatmaps(missing):
+        beatmap_id = raw_beatmap_data['id']
+        beatmap_data = BeatmapData.parse_obj(raw_beatmap_data)
+        beatmaps_data[beatmap_id] = beatmap_data
+        beatmap_data_cache[beatmap_id] = (beatmap_data, actual_last_updated[beatmap_id])
+        beatmap_data_stats.api_fetches += 1
+        to_cache.append((beatmap_id, beatmap_data.json(by_alias=True), actual_last_updated[beatmap_id]))
+    await db.cache_beatmaps_data(to_cache)
+    for beatmap_id in missing:
+        if beatmap_id not in beatmaps_data:  # not returned by the multi-id endpoint, let the single one raise
+            beatmaps_data[beatmap_id] = await get_beatmap_data(beatmap_id, actual_last_updated[beatmap_id], db, request)
+    return beatmaps_data
 
-    :param path: Path, where image should be. For osu map cover - "map_bg_cover". For osu user pfp - "user_pfp".
-    :param osu_id: Osu map id or user id. Basically the name of the file.
-    :param byte_cover: Byte representation of the Image.
-    :return: Saved image as PIL.Image.Image.
-    """
-    bg = BytesIO(byte_cover)
-    img: Image.Image = Image.open(bg)
-    img.save(f'images/cache/{path}/{osu_id}.png')
-    return img
 
+async def get_osu_file(beatmap_id: int, last_updated: datetime, request: Request) -> bytes:
+    """Returns .osu file contents of the given beatmap version, downloading it if it isn't stored yet."""
+    return await osu_file_store.get(beatmap_id, last_updated, request.download_osu_file)
 
-async def get_osu_file(beatmap_id: int, last_updated: datetime, request: Request) -> TextIO:
-    file_path = f'beatmap_files/osu_file/{beatmap_id}_{int(last_updated.timestamp())}.osu'
+
+async def get_difficulty_attributes(
+        beatmap: Beatmap,
+        mods: list[str],
+        db: Db,
+        request: Request,
+        compute: ComputeExecutor
+) -> Optional[DifficultyAttributes]:
+    """
+    Returns difficulty attributes of a beatmap with mods. Saved ones are used if there are any, otherwise they're
+    calculated from the .osu file in the compute pool and saved.
+
+    Returns None if the .osu file can't be downloaded (4xx), is empty, has no hit objects or isn't an osu!standard map.
+    """
+    mods_calc = recalculate_mods(mods)
+    attributes = await db.get_difficulty_attributes(beatmap.id, beatmap.last_updated, mods_calc)
+    if attributes is not None:
+        return attributes
     try:
-        osu_file = open(file_path, encoding='UTF-8')
-    except FileNotFoundError:
-        osu_file = await request.get_osu_file(beatmap_id)
-        with open(file_path, 'w', encoding='UTF-8') as f:
-            f.write(osu_file)
-        osu_file = open(file_path, encoding='UTF-8')
-    return osu_file
+        osu_file = await get_osu_file(beatmap.id, beatmap.last_updated, request)
+    except HTTPStatusError as e:
+        if e.response.status_code // 100 == 4:
+            return None
+        raise
+    except EmptyOsuFile:
+        return None
+    attributes = await compute.run(calculate_attributes, beatmap.id, beatmap.last_updated, mods, osu_file)
+    if attributes is not None:
+        await db.save_difficulty_attributes([(beatmap.id, beatmap.last_updated, mods_calc, attributes)])
+    return attributes
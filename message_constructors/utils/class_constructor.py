@@ -5,7 +5,8 @@ from api_model.base_score import BaseScore
 from api_model.beatmap import BeatmapData
 from api_model.user_data import UserData
 from db import Db
-from message_constructors.utils.cache_check import get_score_position, get_beatmap_data
+from message_constructors.utils.cache_check import get_score_position, get_beatmap_data, get_beatmaps_data, \
+    get_score_positions
 from model.score import Score
 from request import Request
 
@@ -18,13 +19,27 @@ async def get_scores(user_id: int, request: Request, score_type: str, limit: int
     return scores
 
 
-async def create_score_class(score: dict, request: Request, db: Db) -> Score:
+async def create_score_class(score: dict, request: Request, db: Db, beatmap_data: Optional[BeatmapData] = None) -> Score:
     base_score = BaseScore.parse_obj(score)
-    beatmap_data = await get_beatmap_data(base_score.beatmap.id, base_score.beatmap.last_updated, db, request)
-    position = await get_score_position(base_score.best_id, base_score.created_at, base_score.user_id, base_score.beatmap.id, request)
+    if beatmap_data is None:
+        beatmap_data = await get_beatmap_data(base_score.beatmap.id, base_score.beatmap.last_updated, db, request)
+    position = await get_score_position(base_score, beatmap_data.status, db, request)
     return Score.parse_obj({**base_score.dict(by_alias=True), "beatmap_data": beatmap_data, "position": position})
 
 
+async def create_score_classes(scores: list[dict], request: Request, db: Db) -> list[Score]:
+    """Creates many scores, looking up all their beatmaps and leaderboard positions in batches."""
+    base_scores = [BaseScore.parse_obj(score) for score in scores]
+    beatmaps_data = await get_beatmaps_data([base_score.beatmap for base_score in base_scores], db, request)
+    score_beatmaps_data = [beatmaps_data[base_score.beatmap.id] for base_score in base_scores]
+    positions = await get_score_positions(base_scores, [beatmap_data.status for beatmap_data in score_beatmaps_data],
+                                          db, request)
+    return [
+        Score.parse_obj({**base_score.dict(by_alias=True), "beatmap_data": beatmap_data, "position": position})
+        for base_score, beatmap_data, position in zip(base_scores, score_beatmaps_data, positions)
+    ]
+
+
 async def create_user_data_class(user_id: int, request: Request) -> UserData:
     raw_user_data = await request.get_user_data(user_id)
     # pprint(raw_user_data)
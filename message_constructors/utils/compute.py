@@ -0,0 +1,108 @@
+import multiprocessing
+from asyncio import get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter
+from typing import Any, Callable, Optional, TypeVar
+
+from cache import LRUCache
+
+T = TypeVar('T')
+
+# Caches living in worker processes whose counters are reported back with every result, by name
+_worker_caches: dict[str, LRUCache] = {}
+
+
+def report_worker_cache(name: str, cache: LRUCache) -> None:
+    """Makes hits, misses and evictions of a cache used by compute functions show up in `ComputeStats.caches`."""
+    _worker_caches[name] = cache
+
+
+@dataclass
+class WorkerCacheStats:
+    """Counters of a worker process cache, summed over all workers."""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class ComputeStats:
+    submitted: int = 0
+    pending: int = 0
+    completed: int = 0
+    failed: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    total_run: float = 0.0
+    caches: dict[str, WorkerCacheStats] = field(default_factory=dict)
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.completed if self.completed else 0.0
+
+    @property
+    def average_run(self) -> float:
+        return self.total_run / self.completed if self.completed else 0.0
+
+
+def _cache_counters() -> dict[str, tuple[int, int, int]]:
+    return {name: (cache.hits, cache.misses, cache.evictions) for name, cache in _worker_caches.items()}
+
+
+def _timed(func: Callable[..., T], args: tuple) -> tuple[T, float, dict[str, tuple[int, int, int]]]:
+    """Runs in a worker. Returns the result, run time and how cache counters changed during the call."""
+    counters = _cache_counters()
+    started = perf_counter()
+    result = func(*args)
+    run_time = perf_counter() - started
+    deltas = {}
+    for name, (hits, misses, evictions) in _cache_counters().items():
+        previous = counters.get(name, (0, 0, 0))
+        deltas[name] = (hits - previous[0], misses - previous[1], evictions - previous[2])
+    return result, run_time, deltas
+
+
+class ComputeExecutor:
+    """
+    Process pool for CPU heavy work (pyttanko calculations, Pillow rendering), so it doesn't stall the event loop.
+
+    Submitted functions and their arguments must be picklable, so pass file contents instead of open files.
+
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    """
+    def __init__(self, workers: Optional[int] = None):
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self.stats = ComputeStats()
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs `func(*args)` in a worker process and returns its result."""
+        self.stats.submitted += 1
+        self.stats.pending += 1
+        started = monotonic()
+        try:
+            result, run_time, cache_deltas = await get_running_loop().run_in_executor(self._pool, _timed, func, args)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.pending -= 1
+        waited = monotonic() - started - run_time
+        self.stats.completed += 1
+        self.stats.total_run += run_time
+        self.stats.total_wait += waited
+        self.stats.max_wait = max(self.stats.max_wait, waited)
+        for name, (hits, misses, evictions) in cache_deltas.items():
+            cache_stats = self.stats.caches.setdefault(name, WorkerCacheStats())
+            cache_stats.hits += hits
+            cache_stats.misses += misses
+            cache_stats.evictions += evictions
+        return result
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+
+@dataclass
+class StepTiming:
+    started: float  # seconds since the plan started
+    duration: float
+
+
+@dataclass
+class Step:
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    requires: tuple[str, ...]
+
+
+class FetchPlan:
+    """
+    Declares what a handler needs to fetch and what each step depends on, then runs independent steps concurrently.
+
+    Every step is a coroutine function that gets results of the steps it requires as keyword arguments. A step starts
+    as soon as its requirements are done. If any step fails, the rest are cancelled and the error is raised from `run`.
+
+    :param name: Used in timing logs.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._steps: dict[str, Step] = {}
+        self.timings: dict[str, StepTiming] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], *requires: str) -> 'FetchPlan':
+        """Adds a step. Required steps must be added before, so plans can't have cycles."""
+        if name in self._steps:
+            raise ValueError(f'step {name!r} is already added')
+        for required in requires:
+            if required not in self._steps:
+                raise ValueError(f'step {name!r} requires unknown step {required!r}')
+        self._steps[name] = Step(name, func, requires)
+        return self
+
+    async def run(self) -> dict[str, Any]:
+        """Runs all steps and returns their results by step name."""
+        plan_started = perf_counter()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_step(step: Step) -> Any:
+            kwargs = {required: await tasks[required] for required in step.requires}
+            started = perf_counter()
+            try:
+                return await step.func(**kwargs)
+            finally:
+                self.timings[step.name] = StepTiming(started - plan_started, perf_counter() - started)
+
+        for step in self._steps.values():
+            tasks[step.name] = asyncio.create_task(run_step(step))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            logging.info(f'{self.name} fetch plan: {self.format_timings()}, total {perf_counter() - plan_started:.3f}s')
+        return dict(zip(tasks, results))
+
+    def format_timings(self) -> str:
+        return ', '.join(f'{name} {timing.duration:.3f}s (+{timing.started:.3f}s)'
+                         for name, timing in sorted(self.timings.items(), key=lambda item: item[1].started))
@@ -0,0 +1,193 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+from singleflight import SingleFlight
+
+
+def get_url_version(url: str) -> int:
+    """Returns image version from the url query, osu! covers and avatars end with `?{timestamp}`. 0 if there is none."""
+    query = urlparse(url).query
+    return int(query) if query.isdigit() else 0
+
+
+def parse_file_name(file_name: str) -> Optional[tuple[int, int]]:
+    """Returns owner id and version from `{id}_{version}{ext}`. Files saved before versioning have version 0."""
+    name, _ = os.path.splitext(file_name)
+    owner_id, _, version = name.partition('_')
+    if not owner_id.isdigit() or version and not version.isdigit():
+        return None
+    return int(owner_id), int(version or 0)
+
+
+@dataclass
+class ImageStoreStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    bytes_evicted: int = 0
+    outdated_removed: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ImageStore:
+    """
+    On-disk cache of downloaded images, stored as original bytes without re-encoding.
+
+    Images are kept by kind (e.g. "cover", "list@2x") and owner id (e.g. beatmapset id) in a sharded layout:
+    `{root}/{kind}/{id % 256:02x}/{id}_{version}{ext}`, where version comes from the url query. An url with another
+    version is downloaded again and replaces the stored image. Once the files take more than `max_bytes`, least
+    recently used ones are removed. Recency is tracked in memory and falls back to modification time after a restart.
+
+    All disk I/O runs in the default executor.
+
+    :param root: Directory to keep images in.
+    :param max_bytes: Disk budget for all kinds together.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = ImageStoreStats()
+        # (kind, id) -> (version, path, size)
+        self._files: OrderedDict[tuple[str, int], tuple[int, str, int]] = OrderedDict()
+        self._index_loaded = False
+        self._index_lock = asyncio.Lock()
+        self._downloads = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _scan(self) -> tuple[list[tuple[float, tuple[str, int], tuple[int, str, int]]], list[str]]:
+        """Returns stored images ordered by modification time and paths of outdated versions."""
+        latest: dict[tuple[str, int], tuple[float, tuple[int, str, int]]] = {}
+        outdated = []
+        if not os.path.isdir(self.root):
+            return [], outdated
+        for kind in os.listdir(self.root):
+            for dir_path, _, file_names in os.walk(os.path.join(self.root, kind)):
+                for file_name in file_names:
+                    parsed_name = parse_file_name(file_name)
+                    if parsed_name is None:
+                        continue
+                    owner_id, version = parsed_name
+                    path = os.path.join(dir_path, file_name)
+                    stat = os.stat(path)
+                    key = (kind, owner_id)
+                    previous = latest.get(key)
+                    if previous is not None and previous[1][0] >= version:
+                        outdated.append(path)
+                        continue
+                    if previous is not None:
+                        outdated.append(previous[1][1])
+                    latest[key] = (stat.st_mtime, (version, path, stat.st_size))
+        files = sorted(((mtime, key, saved) for key, (mtime, saved) in latest.items()), key=lambda file: file[0])
+        return files, outdated
+
+    async def _load_index(self) -> None:
+        async with self._index_lock:
+            if self._index_loaded:
+                return
+            loop = asyncio.get_running_loop()
+            files, outdated = await loop.run_in_executor(None, self._scan)
+            for _, key, saved in files:
+                self._files[key] = saved
+                self.size += saved[2]
+            self._index_loaded = True
+            if outdated:
+                self.stats.outdated_removed += len(outdated)
+                await loop.run_in_executor(None, self._remove, outdated)
+
+    def _path(self, kind: str, owner_id: int, version: int, url: str) -> str:
+        ext = os.path.splitext(urlparse(url).path)[1] or '.img'
+        return os.path.join(self.root, kind, f'{owner_id % 256:02x}', f'{owner_id}_{version}{ext}')
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _evict(self) -> None:
+        evicted = []
+        while self.size > self.max_bytes and len(self._files) > 1:
+            _, (_, path, size) = self._files.popitem(last=False)
+            self.size -= size
+            self.stats.evictions += 1
+            self.stats.bytes_evicted += size
+            evicted.append(path)
+        if evicted:
+            await asyncio.get_running_loop().run_in_executor(None, self._remove, evicted)
+
+    async def get(self, kind: str, owner_id: int, url: str, download: Callable[[str], Awaitable[bytes]]) -> bytes:
+        """
+        Returns saved image bytes, downloading and saving them first if needed.
+
+        :param kind: Kind of the image, images of different kinds with the same owner id are stored separately.
+        :param owner_id: Id of the image owner, e.g. beatmapset id for covers.
+        :param url: Image url, used for downloading, for the version and for the file extension.
+        :param download: Coroutine function returning image bytes by url.
+        """
+        if not self._index_loaded:
+            await self._load_index()
+        loop = asyncio.get_running_loop()
+        key = (kind, owner_id)
+        version = get_url_version(url)
+        saved = self._files.get(key)
+        if saved is not None and saved[0] == version:
+            content = await loop.run_in_executor(None, self._read, saved[1])
+            if content is not None:
+                self._files.move_to_end(key)
+                self.stats.hits += 1
+                self.stats.bytes_read += len(content)
+                return content
+            if self._files.get(key) is saved:  # removed from disk by someone else
+                del self._files[key]
+                self.size -= saved[2]
+        self.stats.misses += 1
+        return await self._downloads.do((*key, version), lambda: self._download(key, version, url, download))
+
+    async def _download(self, key: tuple[str, int], version: int, url: str,
+                        download: Callable[[str], Awaitable[bytes]]) -> bytes:
+        content = await download(url)
+        loop = asyncio.get_running_loop()
+        path = self._path(*key, version, url)
+        await loop.run_in_executor(None, self._write, path, content)
+        previous = self._files.pop(key, None)
+        if previous is not None:
+            self.size -= previous[2]
+            if previous[1] != path:
+                self.stats.outdated_removed += 1
+                await loop.run_in_executor(None, self._remove, [previous[1]])
+        self._files[key] = (version, path, len(content))
+        self.size += len(content)
+        self.stats.bytes_written += len(content)
+        await self._evict()
+        return content
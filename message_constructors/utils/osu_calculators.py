@@ -1,32 +1,122 @@
 import operator
+from datetime import datetime
 from functools import reduce
-from typing import Iterator
+from typing import Iterable, Optional, Sequence
 
+import numpy as np
 import pyttanko
 from pyttanko import beatmap
 
 from api_model.base_score import Statistics
 from api_model.beatmap import BeatmapData
+from cache import LRUCache
+from db import DifficultyAttributes
+from message_constructors.utils import vectorized_calculators
+from message_constructors.utils.compute import report_worker_cache
+from message_constructors.utils.osu_file_store import decode_osu_file
+from message_constructors.utils.vectorized_calculators import HitObjectArrays
 
 pyttanko_parser = pyttanko.parser()
 
+# Caches live in each compute worker process, keyed by beatmap id, last updated and (for difficulty) mods bitmask.
+# Their counters are summed over workers in `ComputeExecutor.stats`.
+beatmap_cache: LRUCache[tuple[int, datetime], beatmap] = LRUCache(32)
+difficulty_cache: LRUCache[tuple[int, datetime, int], DifficultyAttributes] = LRUCache(256)
+report_worker_cache('Parsed beatmaps', beatmap_cache)
+report_worker_cache('Difficulty', difficulty_cache)
 
-def get_expanded_beatmap_file(osu_file: Iterator[str]) -> beatmap:
+# Most played combinations, precomputed for saved .osu files.
+# Mods that don't change difficulty or pp (PF, SD) are ignored anyway.
+PRECOMPUTED_MODS = [
+    [], ['HD'], ['HR'], ['DT'], ['HD', 'HR'], ['HD', 'DT'], ['HR', 'DT'], ['HD', 'HR', 'DT'],
+    ['EZ'], ['HT'], ['FL'], ['HD', 'FL'], ['NF'], ['HD', 'NF'],
+]
+
+# Mods pyttanko doesn't define that don't change star rating either
+STAR_RATING_NEUTRAL_MODS = {'PF', 'SD', 'V2', 'MR', 'CL'}
+
+
+def get_expanded_beatmap_file(osu_file: Iterable[str]) -> beatmap:
     return pyttanko_parser.map(osu_file)
 
 
 def recalculate_mods(mods: list[str]):
+    """Returns pyttanko mods bitmask. Mods pyttanko doesn't define (PF, SD, RX, AP, V2, ...) are skipped."""
     mods_calc = reduce(operator.or_,
-                       (getattr(pyttanko, f'MODS_{mod}') for mod in mods if mod != 'PF' and mod != 'SD'),
+                       (getattr(pyttanko, f'MODS_{mod}') for mod in mods if hasattr(pyttanko, f'MODS_{mod}')),
                        pyttanko.MODS_NOMOD)
     return mods_calc
 
 
+def is_star_rating_calculable(mods: list[str]) -> bool:
+    """Whether pyttanko gets star rating right with these mods, i.e. every mod it skips doesn't change difficulty."""
+    return all(hasattr(pyttanko, f'MODS_{mod}') or mod in STAR_RATING_NEUTRAL_MODS for mod in mods)
+
+
 def get_converted_star_rating(mods: list[str], expanded_beatmap_file: beatmap):
     mods_calc = recalculate_mods(mods)
     return pyttanko.diff_calc().calc(expanded_beatmap_file, mods_calc)
 
 
+def calculate_difficulty_attributes(mods: list[str], expanded_beatmap_file: beatmap) -> DifficultyAttributes:
+    mods_calc = recalculate_mods(mods)
+    if len(expanded_beatmap_file.hitobjects) >= 2:
+        aim, speed, total = vectorized_calculators.calculate_difficulty(
+            HitObjectArrays.from_beatmap(expanded_beatmap_file),
+            expanded_beatmap_file.cs,
+            mods_calc,
+        )
+    else:
+        stars = get_converted_star_rating(mods, expanded_beatmap_file)
+        aim, speed, total = stars.aim, stars.speed, stars.total
+    attributes = DifficultyAttributes(
+        aim=aim,
+        speed=speed,
+        total=total,
+        max_combo=expanded_beatmap_file.max_combo(),
+        circles=expanded_beatmap_file.ncircles,
+        sliders=expanded_beatmap_file.nsliders,
+        objects=len(expanded_beatmap_file.hitobjects),
+        ar=expanded_beatmap_file.ar,
+        od=expanded_beatmap_file.od,
+        ss_pp=0.0,
+    )
+    attributes.ss_pp = float(vectorized_calculators.ppv2(attributes, mods_calc))
+    return attributes
+
+
+def get_parsed_beatmap(beatmap_id: int, last_updated: datetime, osu_file: bytes) -> beatmap:
+    """Returns parsed .osu file, parsing it only if it isn't cached yet."""
+    key = (beatmap_id, last_updated)
+    expanded_beatmap_file = beatmap_cache.get(key)
+    if expanded_beatmap_file is None:
+        expanded_beatmap_file = get_expanded_beatmap_file(decode_osu_file(osu_file))
+        beatmap_cache[key] = expanded_beatmap_file
+    return expanded_beatmap_file
+
+
+def get_difficulty_attributes(
+        beatmap_id: int,
+        last_updated: datetime,
+        mods: list[str],
+        osu_file: bytes
+) -> Optional[DifficultyAttributes]:
+    """
+    Returns difficulty attributes with mods, parsing the .osu file only if needed. Meant to be run in the compute pool.
+
+    Returns None if the file has no hit objects or isn't an osu!standard map.
+    """
+    key = (beatmap_id, last_updated, recalculate_mods(mods))
+    attributes = difficulty_cache.get(key)
+    if attributes is None:
+        expanded_beatmap_file = get_parsed_beatmap(beatmap_id, last_updated, osu_file)
+        if not expanded_beatmap_file.hitobjects or expanded_beatmap_file.mode != pyttanko.MODE_STD:
+            return None
+        attributes = calculate_difficulty_attributes(mods, expanded_beatmap_file)
+        difficulty_cache[key] = attributes
+    return attributes
+
+
 def get_pp_for_score(
         accuracy: float,
         score_max_combo: int,
@@ -34,42 +124,34 @@ def get_pp_for_score(
         mods: list[str],
         beatmap_data: BeatmapData,
         statistics: Statistics,
-        star_rating,
-        expanded_beatmap_file: beatmap
+        attributes: DifficultyAttributes,
 ) -> tuple[float, float, float]:
     mods_calc = recalculate_mods(mods)
     objects = beatmap_data.count_circles + beatmap_data.count_sliders + beatmap_data.count_spinners
-    fail_acc = pyttanko.acc_round(round(accuracy * 100), objects, statistics.count_miss)
-    ss_pp, *_ = pyttanko.ppv2(star_rating.aim, star_rating.speed, mods=mods_calc, bmap=expanded_beatmap_file)
-    fc_pp, *_ = pyttanko.ppv2(star_rating.aim, star_rating.speed, mods=mods_calc, bmap=expanded_beatmap_file,
-                              n300=fail_acc[0] + statistics.count_miss,
-                              n100=fail_acc[1],
-                              n50=fail_acc[2],
-                              nmiss=0)
-    if pp is None:
-        score_pp, *_ = pyttanko.ppv2(star_rating.aim, star_rating.speed, mods=mods_calc, bmap=expanded_beatmap_file,
-                                     n100=statistics.count_100,
-                                     n50=statistics.count_50,
-                                     nmiss=statistics.count_miss,
-                                     combo=score_max_combo)
-    else:
+    n300, n100, n50 = pyttanko.acc_round(round(accuracy * 100), objects, statistics.count_miss)
+    # first scenario is the same score without misses, second is the score itself
+    fc_pp, score_pp = vectorized_calculators.ppv2(
+        attributes,
+        mods_calc,
+        n300=[n300 + statistics.count_miss, attributes.objects - statistics.count_100 - statistics.count_50 - statistics.count_miss],
+        n100=[n100, statistics.count_100],
+        n50=[n50, statistics.count_50],
+        nmiss=[0, statistics.count_miss],
+        combo=[max(attributes.max_combo, 1), score_max_combo],
+    )
+    if pp is not None:
         score_pp = pp
-    return score_pp, fc_pp, ss_pp
+    return float(score_pp), float(fc_pp), attributes.ss_pp
 
 
-def get_pp_flexible(
-        accuracy: float,
+def get_pp_for_accuracies(
+        accuracies: Sequence[float],
         mods: list[str],
         beatmap_data: BeatmapData,
-        star_rating,
-        expanded_beatmap_file: beatmap
-) -> float:
+        attributes: DifficultyAttributes,
+) -> np.ndarray:
+    """Returns full combo pp for every accuracy (0.0-1.0) in one vectorized evaluation."""
     mods_calc = recalculate_mods(mods)
     objects = beatmap_data.count_circles + beatmap_data.count_sliders + beatmap_data.count_spinners
-    fail_acc = pyttanko.acc_round(round(accuracy * 100), objects, 0)
-    pp, *_ = pyttanko.ppv2(star_rating.aim, star_rating.speed, mods=mods_calc, bmap=expanded_beatmap_file,
-                           n300=fail_acc[0],
-                           n100=fail_acc[1],
-                           n50=fail_acc[2],
-                           nmiss=0)
-    return pp
+    n300, n100, n50 = vectorized_calculators.acc_round(np.round(np.asarray(accuracies) * 100), objects, 0)
+    return vectorized_calculators.ppv2(attributes, mods_calc, n300=n300, n100=n100, n50=n50, nmiss=0)
@@ -0,0 +1,259 @@
+import asyncio
+import gzip
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from time import time
+from typing import Awaitable, BinaryIO, Callable, Optional
+
+from singleflight import SingleFlight
+
+OSU_FILE_EXT = '.osu'
+COMPRESSED_EXT = '.osu.gz'
+
+
+def parse_file_name(file_name: str) -> Optional[tuple[int, int, bool]]:
+    """Returns beatmap id, last updated timestamp and whether the file is compressed from `{id}_{timestamp}.osu[.gz]`."""
+    compressed = file_name.endswith(COMPRESSED_EXT)
+    if compressed:
+        name = file_name[:-len(COMPRESSED_EXT)]
+    elif file_name.endswith(OSU_FILE_EXT):
+        name = file_name[:-len(OSU_FILE_EXT)]
+    else:
+        return None
+    beatmap_id, _, timestamp = name.partition('_')
+    if not beatmap_id.isdigit() or not timestamp.isdigit():
+        return None
+    return int(beatmap_id), int(timestamp), compressed
+
+
+def read_osu_file(path: str) -> bytes:
+    """Reads a stored .osu file, decompressing it if needed. Blocking, use in executors and workers."""
+    if path.endswith(COMPRESSED_EXT):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def decode_osu_file(osu_file: bytes) -> list[str]:
+    """Splits .osu file contents into lines for the pyttanko parser."""
+    return osu_file.decode('UTF-8', errors='replace').splitlines()
+
+
+class EmptyOsuFile(Exception):
+    """Raised when a downloaded .osu file has no content, osu! serves empty bodies for some unavailable maps."""
+
+
+@dataclass
+class OsuFileStoreStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_downloaded: int = 0
+    outdated_removed: int = 0
+    compressed: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class StoredOsuFile:
+    timestamp: int
+    path: str
+    size: int
+    last_access: float
+
+
+class OsuFileStore:
+    """
+    On-disk store of .osu files, one file per beatmap: `{root}/{id}_{timestamp}.osu`.
+
+    Downloading a new beatmap version removes the old one. Files not read for `cold_after` seconds are gzipped
+    in the background, compressed files are read transparently. Once the files take more than `max_bytes`,
+    least recently used beatmaps are removed.
+
+    All disk I/O runs in the default executor, files are handed out as bytes.
+
+    :param root: Directory to keep files in.
+    :param max_bytes: Disk budget.
+    :param cold_after: Seconds without reads after which a file is compressed.
+    :param sweep_interval: Min seconds between searches for cold files.
+    """
+    def __init__(self, root: str, max_bytes: int, cold_after: float = 7 * 24 * 60 * 60, sweep_interval: float = 60 * 60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.cold_after = cold_after
+        self.sweep_interval = sweep_interval
+        self.size = 0
+        self.stats = OsuFileStoreStats()
+        self._files: OrderedDict[int, StoredOsuFile] = OrderedDict()
+        self._index_loaded = False
+        self._index_lock = asyncio.Lock()
+        self._downloads = SingleFlight()
+        self._last_sweep = time()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _scan(self) -> tuple[list[tuple[float, int, StoredOsuFile]], list[str]]:
+        """Returns stored files ordered by modification time and paths of outdated versions."""
+        os.makedirs(self.root, exist_ok=True)
+        latest: dict[int, tuple[float, StoredOsuFile]] = {}
+        outdated = []
+        for file_name in os.listdir(self.root):
+            parsed_name = parse_file_name(file_name)
+            if parsed_name is None:
+                continue
+            beatmap_id, timestamp, _ = parsed_name
+            path = os.path.join(self.root, file_name)
+            stat = os.stat(path)
+            stored = StoredOsuFile(timestamp, path, stat.st_size, stat.st_mtime)
+            previous = latest.get(beatmap_id)
+            if previous is not None and previous[1].timestamp >= timestamp:
+                outdated.append(path)
+                continue
+            if previous is not None:
+                outdated.append(previous[1].path)
+            latest[beatmap_id] = (stat.st_mtime, stored)
+        files = sorted(((mtime, beatmap_id, stored) for beatmap_id, (mtime, stored) in latest.items()),
+                       key=lambda file: file[0])
+        return files, outdated
+
+    async def _load_index(self) -> None:
+        async with self._index_lock:
+            if self._index_loaded:
+                return
+            loop = asyncio.get_running_loop()
+            files, outdated = await loop.run_in_executor(None, self._scan)
+            for _, beatmap_id, stored in files:
+                self._files[beatmap_id] = stored
+                self.size += stored.size
+            self._index_loaded = True
+            if outdated:
+                self.stats.outdated_removed += len(outdated)
+                await loop.run_in_executor(None, self._remove, outdated)
+            await self._evict()
+
+    @staticmethod
+    def _remove(paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _evict(self) -> None:
+        evicted = []
+        while self.size > self.max_bytes and len(self._files) > 1:
+            _, stored = self._files.popitem(last=False)
+            self.size -= stored.size
+            self.stats.evictions += 1
+            evicted.append(stored.path)
+        if evicted:
+            await asyncio.get_running_loop().run_in_executor(None, self._remove, evicted)
+
+    async def get(
+            self,
+            beatmap_id: int,
+            last_updated: datetime,
+            download: Callable[[int, BinaryIO], Awaitable[bytes]],
+    ) -> bytes:
+        """
+        Returns .osu file contents of the beatmap version, downloading it first if it isn't stored.
+        Raises `EmptyOsuFile` if the download has no content, nothing is stored then.
+
+        :param download: Coroutine function streaming .osu file by beatmap id into a binary file and returning
+            its contents.
+        """
+        if not self._index_loaded:
+            await self._load_index()
+        self._schedule_sweep()
+        timestamp = int(last_updated.timestamp())
+        stored = self._files.get(beatmap_id)
+        if stored is not None and stored.timestamp == timestamp:
+            try:
+                osu_file = await asyncio.get_running_loop().run_in_executor(None, read_osu_file, stored.path)
+            except FileNotFoundError:
+                pass  # compressed or removed meanwhile, download again
+            else:
+                if beatmap_id in self._files:
+                    self._files.move_to_end(beatmap_id)
+                stored.last_access = time()
+                self.stats.hits += 1
+                return osu_file
+        self.stats.misses += 1
+        return await self._downloads.do((beatmap_id, timestamp), lambda: self._download(beatmap_id, timestamp, download))
+
+    async def _download(
+            self,
+            beatmap_id: int,
+            timestamp: int,
+            download: Callable[[int, BinaryIO], Awaitable[bytes]],
+    ) -> bytes:
+        loop = asyncio.get_running_loop()
+        path = os.path.join(self.root, f'{beatmap_id}_{timestamp}{OSU_FILE_EXT}')
+        tmp_path = f'{path}.part'
+        file = await loop.run_in_executor(None, open, tmp_path, 'wb')
+        try:
+            try:
+                osu_file = await download(beatmap_id, file)
+            finally:
+                await loop.run_in_executor(None, file.close)
+            if not osu_file:
+                raise EmptyOsuFile(beatmap_id)
+            await loop.run_in_executor(None, os.replace, tmp_path, path)
+        except BaseException:
+            await loop.run_in_executor(None, self._remove, [tmp_path])
+            raise
+        size = len(osu_file)
+        self.stats.bytes_downloaded += size
+
+        previous = self._files.pop(beatmap_id, None)
+        if previous is not None:
+            self.size -= previous.size
+            if previous.path != path:
+                self.stats.outdated_removed += 1
+                await loop.run_in_executor(None, self._remove, [previous.path])
+        self._files[beatmap_id] = StoredOsuFile(timestamp, path, size, time())
+        self.size += size
+        await self._evict()
+        return osu_file
+
+    def _schedule_sweep(self) -> None:
+        if time() - self._last_sweep < self.sweep_interval or self._sweeper is not None:
+            return
+        self._last_sweep = time()
+        self._sweeper = asyncio.create_task(self._compress_cold_files())
+        self._sweeper.add_done_callback(lambda _: setattr(self, '_sweeper', None))
+
+    @staticmethod
+    def _compress(path: str) -> tuple[str, int]:
+        compressed_path = path[:-len(OSU_FILE_EXT)] + COMPRESSED_EXT
+        with open(path, 'rb') as src, gzip.open(f'{compressed_path}.part', 'wb') as dst:
+            dst.write(src.read())
+        os.replace(f'{compressed_path}.part', compressed_path)
+        os.remove(path)
+        return compressed_path, os.path.getsize(compressed_path)
+
+    async def _compress_cold_files(self) -> None:
+        loop = asyncio.get_running_loop()
+        cold_before = time() - self.cold_after
+        cold = [(beatmap_id, stored) for beatmap_id, stored in self._files.items()
+                if stored.last_access < cold_before and not stored.path.endswith(COMPRESSED_EXT)]
+        for beatmap_id, stored in cold:
+            try:
+                compressed_path, compressed_size = await loop.run_in_executor(None, self._compress, stored.path)
+            except FileNotFoundError:
+                continue
+            if self._files.get(beatmap_id) is not stored:  # replaced by a new version meanwhile
+                await loop.run_in_executor(None, self._remove, [compressed_path])
+                continue
+            self.size += compressed_size - stored.size
+            stored.path, stored.size = compressed_path, compressed_size
+            self.stats.compressed += 1
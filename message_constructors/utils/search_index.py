@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import logging
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter
+from typing import Iterable, Optional
+
+from db import BeatmapData, Db, tokenize_music_text
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Score multipliers for words matched not exactly
+PREFIX_WEIGHT = 0.8
+TYPO_WEIGHT = 0.6
+# Unfinished words shorter than that aren't expanded, they match too much
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 32
+
+SEARCH_INDEX_REFRESH_INTERVAL = 5 * 60
+SEARCH_INDEX_REBUILD_INTERVAL = 24 * 60 * 60
+
+
+def max_typos(word: str) -> int:
+    """Edit distance allowed for a word: none for short words, they'd match almost anything."""
+    if len(word) >= 8:
+        return 2
+    if len(word) >= 4:
+        return 1
+    return 0
+
+
+@dataclass
+class IndexedSong:
+    music_id: int
+    file_id: str
+    artist: str
+    title: str
+    length: int
+    mappers: list[str] = field(default_factory=list)
+    tags: str = ''
+
+    def tokens(self) -> list[str]:
+        return tokenize_music_text(' '.join([self.artist, self.title, *self.mappers, self.tags]))
+
+
+@dataclass
+class SearchIndexStats:
+    searches: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def average_seconds(self) -> float:
+        return self.total_seconds / self.searches if self.searches else 0.0
+
+
+class _TrieNode:
+    __slots__ = ('children', 'word')
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.word: Optional[str] = None
+
+
+class _IndexState:
+    """Everything a search reads, replaced as a whole on rebuilds."""
+    def __init__(self):
+        self.songs: dict[int, IndexedSong] = {}
+        self.postings: dict[str, dict[int, int]] = {}  # word -> music id -> term frequency
+        self.lengths: dict[int, int] = {}
+        self.total_length = 0
+        self.trie = _TrieNode()
+        self.last_music_id = 0
+
+    def add(self, song: IndexedSong) -> None:
+        self.remove(song.music_id)
+        tokens = Counter(song.tokens())
+        for word, frequency in tokens.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                self._insert_word(word)
+            postings[song.music_id] = frequency
+        self.songs[song.music_id] = song
+        self.lengths[song.music_id] = sum(tokens.values())
+        self.total_length += self.lengths[song.music_id]
+        self.last_music_id = max(self.last_music_id, song.music_id)
+
+    def remove(self, music_id: int) -> None:
+        song = self.songs.pop(music_id, None)
+        if song is None:
+            return
+        for word in set(song.tokens()):
+            postings = self.postings.get(word)
+            if postings is not None:
+                postings.pop(music_id, None)
+                if not postings:  # the word stays in the trie, expansions skip words without postings
+                    del self.postings[word]
+        self.total_length -= self.lengths.pop(music_id)
+
+    def _insert_word(self, word: str) -> None:
+        node = self.trie
+        for char in word:
+            node = node.children.setdefault(char, _TrieNode())
+        node.word = word
+
+    def expand_prefix(self, prefix: str) -> list[str]:
+        """Returns indexed words starting with the prefix, most frequent first."""
+        node = self.trie
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        words = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.word is not None and node.word in self.postings:
+                words.append(node.word)
+            stack.extend(node.children.values())
+        return heapq.nlargest(MAX_PREFIX_EXPANSIONS, words, key=lambda word: len(self.postings[word]))
+
+    def find_similar(self, word: str, distance: int) -> list[str]:
+        """Returns indexed words within Levenshtein distance, walking the trie with one DP row per node."""
+        similar = []
+        first_row = list(range(len(word) + 1))
+        stack = [(child, char, first_row) for char, child in self.trie.children.items()]
+        while stack:
+            node, char, previous_row = stack.pop()
+            row = [previous_row[0] + 1]
+            for i in range(1, len(word) + 1):
+                row.append(min(row[i - 1] + 1, previous_row[i] + 1, previous_row[i - 1] + (word[i - 1] != char)))
+            if row[-1] <= distance and node.word is not None and node.word in self.postings:
+                similar.append(node.word)
+            if min(row) <= distance:
+                stack.extend((child, next_char, row) for next_char, child in node.children.items())
+        return similar
+
+
+class SearchIndex:
+    """
+    In-memory song search over the music catalog, for answers faster than a database round trip.
+
+    Words are kept in an inverted index scored with BM25 and in a prefix trie. The last query word is treated as
+    unfinished and expanded by prefix, words that aren't indexed are matched with typos. Every query word adds
+    the score of its best matching indexed word, so songs matching more words go first.
+    """
+    def __init__(self):
+        self._state = _IndexState()
+        self.stats = SearchIndexStats()
+
+    def __len__(self) -> int:
+        return len(self._state.songs)
+
+    @property
+    def words(self) -> int:
+        return len(self._state.postings)
+
+    @property
+    def last_music_id(self) -> int:
+        return self._state.last_music_id
+
+    @staticmethod
+    def _group(rows: Iterable[BeatmapData]) -> dict[int, IndexedSong]:
+        """Joins mapper rows of the same song."""
+        songs: dict[int, IndexedSong] = {}
+        for row in rows:
+            song = songs.get(row.music_id)
+            if song is None:
+                song = songs[row.music_id] = IndexedSong(
+                    row.music_id, row.file_id, row.artist, row.title, row.length, tags=row.tags or '')
+            if row.mapper not in song.mappers:
+                song.mappers.append(row.mapper)
+        return songs
+
+    def rebuild(self, rows: Iterable[BeatmapData]) -> None:
+        """Replaces the whole index. Searches see the old index until the new one is ready, so it can run in a thread."""
+        state = _IndexState()
+        for song in self._group(rows).values():
+            state.add(song)
+        self._state = state
+
+    def add(self, rows: Iterable[BeatmapData]) -> None:
+        """Adds new songs, or new mappers to indexed songs."""
+        state = self._state
+        for music_id, song in self._group(rows).items():
+            indexed = state.songs.get(music_id)
+            if indexed is not None:
+                song.mappers = indexed.mappers + [mapper for mapper in song.mappers if mapper not in indexed.mappers]
+            state.add(song)
+
+    def _expand(self, state: _IndexState, word: str, is_last: bool) -> dict[str, float]:
+        """Returns indexed words the query word may mean with their score multipliers."""
+        expansions = {}
+        if is_last and len(word) >= MIN_PREFIX_LENGTH:
+            expansions = {indexed: PREFIX_WEIGHT for indexed in state.expand_prefix(word)}
+        if word in state.postings:
+            expansions[word] = 1.0
+        if not expansions and max_typos(word):
+            expansions = {indexed: TYPO_WEIGHT for indexed in state.find_similar(word, max_typos(word))}
+        return expansions
+
+    def search(self, query: str, limit: int = 50) -> list[IndexedSong]:
+        """Returns up to `limit` songs matching the query, best matches first."""
+        started = perf_counter()
+        state = self._state
+        words = list(dict.fromkeys(tokenize_music_text(query)))
+        scores: Counter[int] = Counter()
+        if state.songs:
+            average_length = state.total_length / len(state.songs)
+            for i, word in enumerate(words):
+                best: dict[int, float] = {}
+                for indexed, weight in self._expand(state, word, i == len(words) - 1).items():
+                    postings = state.postings[indexed]
+                    idf = math.log(1 + (len(state.songs) - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for music_id, frequency in postings.items():
+                        normalization = K1 * (1 - B + B * state.lengths[music_id] / average_length)
+                        score = weight * idf * frequency * (K1 + 1) / (frequency + normalization)
+                        if score > best.get(music_id, 0.0):
+                            best[music_id] = score
+                scores.update(best)
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        elapsed = perf_counter() - started
+        self.stats.searches += 1
+        self.stats.total_seconds += elapsed
+        self.stats.max_seconds = max(self.stats.max_seconds, elapsed)
+        return [state.songs[music_id] for music_id, _ in top]
+
+    async def keep_fresh(self, db: Db, interval: float = SEARCH_INDEX_REFRESH_INTERVAL,
+                         rebuild_interval: float = SEARCH_INDEX_REBUILD_INTERVAL) -> None:
+        """
+        Builds the index and keeps adding songs saved since. Changes to already indexed songs are picked up by
+        rebuilding from scratch every `rebuild_interval` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        rebuilt_at = None
+        while True:
+            try:
+                if rebuilt_at is None or monotonic() - rebuilt_at >= rebuild_interval:
+                    rows = await db.get_all_search_music_data()
+                    await loop.run_in_executor(None, self.rebuild, rows)
+                    rebuilt_at = monotonic()
+                    logging.info(f'Search index built: {len(self)} songs, {self.words} words')
+                else:
+                    self.add(await db.get_all_search_music_data(self.last_music_id))
+            except Exception:
+                logging.exception('Failed to refresh search index')
+            await asyncio.sleep(interval)
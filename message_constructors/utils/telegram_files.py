@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InputFile, Message
+
+from cache import TTLCache
+from db import Db
+
+# How long a rendered response is reused for the same command, user and latest score
+RESPONSE_REUSE_TTL = 60
+# Placeholders are cached under this kind with their path as the source, never under the photo they replace
+FALLBACK_KIND = 'fallback'
+# Parts of Bad Request descriptions telegram gives for file ids it doesn't accept anymore
+FILE_ID_ERRORS = ('file identifier', 'file_id', 'file reference', 'file_reference')
+
+
+@dataclass
+class RenderedResponse:
+    caption: str
+    file_id: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+
+
+# (command, osu id, latest score id) -> response sent last time
+rendered_responses: TTLCache[tuple[str, int, Optional[int]], RenderedResponse] = TTLCache(512, RESPONSE_REUSE_TTL)
+
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    """Whether telegram rejected the file id itself, other bad requests (caption, markup) would fail with any photo."""
+    return any(part in error.message.lower() for part in FILE_ID_ERRORS)
+
+
+async def _reply_with_cached_file_id(
+        message: Message,
+        kind: str,
+        source: str,
+        db: Db,
+        caption: str,
+        **kwargs,
+) -> Optional[Message]:
+    """Replies with the file_id saved for the photo. Returns None if there is none or it's not valid anymore."""
+    file_id = await db.get_telegram_file_id(kind, source)
+    if file_id is None:
+        return None
+    try:
+        return await message.reply_photo(file_id, caption, **kwargs)
+    except TelegramBadRequest as e:
+        if not is_file_id_error(e):
+            raise
+        await db.remove_telegram_file_id(kind, source)
+        return None
+
+
+async def reply_photo_cached(
+        message: Message,
+        kind: str,
+        source: str,
+        get_photo: Callable[[], Awaitable[Optional[Union[InputFile, str]]]],
+        db: Db,
+        caption: str,
+        fallback: Optional[str] = None,
+        **kwargs,
+) -> Message:
+    """
+    Replies with a photo, reusing telegram file_id if the same photo was sent before.
+
+    The photo is made with `get_photo` only if there is no file_id saved yet or telegram doesn't accept it anymore.
+
+    :param kind: Kind of the photo, e.g. "cover" or "top5".
+    :param source: What the photo is made from, must change whenever the photo does.
+    :param get_photo: Coroutine function returning the photo as url or file to upload, or None if it's unavailable.
+    :param fallback: Path of the placeholder sent when the photo is unavailable. Its file_id is saved for the
+        placeholder itself, so the photo is tried again next time.
+    """
+    sent = await _reply_with_cached_file_id(message, kind, source, db, caption, **kwargs)
+    if sent is not None:
+        return sent
+    photo = await get_photo()
+    if photo is not None:
+        sent = await message.reply_photo(photo, caption, **kwargs)
+        await db.cache_telegram_file_id(kind, source, sent.photo[-1].file_id)
+        return sent
+    if fallback is None:
+        raise ValueError(f'{kind} photo of {source} is unavailable and there is no fallback')
+    sent = await _reply_with_cached_file_id(message, FALLBACK_KIND, fallback, db, caption, **kwargs)
+    if sent is None:
+        sent = await message.reply_photo(FSInputFile(fallback), caption, **kwargs)
+        await db.cache_telegram_file_id(FALLBACK_KIND, fallback, sent.photo[-1].file_id)
+    return sent
+
+
+async def reply_rendered(message: Message, key: tuple[str, int, Optional[int]]) -> Optional[Message]:
+    """
+    Replies with the response rendered for the same key less than `RESPONSE_REUSE_TTL` seconds ago.
+
+    Returns None if there is no such response, then the caller renders it and saves with `remember_rendered`.
+
+    :param key: Command, osu id and id of the latest score the response shows, so a new score isn't missed.
+        Keys without score id are never reused.
+    """
+    if key[2] is None:
+        return None
+    response = rendered_responses.get(key)
+    if response is None:
+        return None
+    try:
+        return await message.reply_photo(response.file_id, response.caption, reply_markup=response.reply_markup)
+    except TelegramBadRequest as e:
+        if not is_file_id_error(e):
+            raise
+        rendered_responses.pop(key)
+        return None
+
+
+def remember_rendered(key: tuple[str, int, Optional[int]], sent: Message, caption: str,
+                      reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """Saves a sent photo response for `reply_rendered`. Caption is passed as is, `sent.caption` has no markup."""
+    if key[2] is None:
+        return
+    rendered_responses[key] = RenderedResponse(caption, sent.photo[-1].file_id, reply_markup)
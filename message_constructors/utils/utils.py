@@ -1,20 +1,23 @@
-import asyncio
 import re
-from collections import Counter
 from pathlib import Path
 
-from PIL import Image
-from pyttanko import beatmap
+from httpx import HTTPError
 
 from api_model.base_score import Statistics
-from api_model.beatmap import BeatmapData
+from api_model.beatmap import Beatmap, BeatmapData
 from db import Db
-from message_constructors.utils.cache_check import save_pic, get_saved_pic, get_osu_file
-from message_constructors.utils.class_constructor import create_score_class
-from message_constructors.utils.osu_calculators import get_pp_for_score
+from db import DifficultyAttributes
+from message_constructors.utils.batch import BatchExecutor
+from message_constructors.utils.cache_check import get_difficulty_attributes, image_store
+from message_constructors.utils.compute import ComputeExecutor
+from message_constructors.utils.osu_calculators import get_pp_for_score, is_star_rating_calculable
 from model.score import Score
 from request import Request
 
+# limits are shared by all commands, sized to stay well below the request pool and the compute workers
+image_batch = BatchExecutor('images', limit=8, timeout=15)
+star_rating_batch = BatchExecutor('star ratings', limit=4, timeout=30)
+
 
 def build_flag(code: str) -> str:
     flag = "".join(chr(ord("🇦") + (ord(x.lower()) - ord("a"))) for x in f"{code}")
@@ -117,7 +120,7 @@ def build_user_rank_line(
            f'({flag} #{country_rank}) [{rank_history_line}]\n\n'
 
 
-def get_pp_line(score: Score, rank: str, stars, expanded_beatmap_file: beatmap) -> str:
+def get_pp_line(score: Score, rank: str, attributes: DifficultyAttributes) -> str:
     pp, fc_pp, ss_pp = get_pp_for_score(
         score.accuracy,
         score.max_combo,
@@ -125,8 +128,7 @@ def get_pp_line(score: Score, rank: str, stars, expanded_beatmap_file: beatmap)
         score.mods,
         score.beatmap_data,
         score.statistics,
-        stars,
-        expanded_beatmap_file,
+        attributes,
     )
     pp_line = f'{round(pp, 2)}pp'
     fc_pp_line = f'{round(fc_pp, 2)}pp'
@@ -140,21 +142,47 @@ def get_pp_line(score: Score, rank: str, stars, expanded_beatmap_file: beatmap)
     return f'{pp_line} | {fc_pp_line} if FC | {ss_pp_line} if SS'
 
 
-async def get_saved_image(beatmap_id: int, img_link: str, request: Request) -> Image.Image:
-    img = get_saved_pic('map_bg_cover', beatmap_id)
-    if img is None:
-        byte_cover = await request.get_pic_as_bytes(img_link)
-        img = save_pic('map_bg_cover', beatmap_id, byte_cover)
-    return img
-
-
-async def get_id_list(args: str, db: Db) -> list[str]:
-    id_count: Counter[str, int] = Counter()
-    divided_args = re.findall('([a-z0-9]*)', args, re.IGNORECASE)
-    for word in divided_args:
-        id_list = await db.get_id_by_token(word)
-        id_count.update(id_list)
-    return [x[0] for x in id_count.most_common()]
+async def get_saved_image(kind: str, beatmapset_id: int, img_link: str, request: Request) -> bytes:
+    """
+    Returns beatmapset cover as original bytes from the image store, downloading it if needed.
+
+    :param kind: Cover kind, key in `Beatmapset.covers`.
+    """
+    return await image_store.get(kind, beatmapset_id, img_link, request.get_pic_as_bytes)
+
+
+async def get_star_rating(score: Score, request: Request, db: Db, compute: ComputeExecutor) -> float:
+    """Returns star rating of the score's beatmap with the score's mods, see `get_beatmap_star_rating`."""
+    return await get_beatmap_star_rating(score.beatmap, score.mods, score.mode_int, score.beatmap_data.stars,
+                                         request, db, compute)
+
+
+async def get_beatmap_star_rating(
+        beatmap: Beatmap,
+        mods: list[str],
+        mode_int: int,
+        nomod_stars: float,
+        request: Request,
+        db: Db,
+        compute: ComputeExecutor,
+) -> float:
+    """
+    Returns star rating of a beatmap with mods. Needs only what a raw score has, so it can run before the score is built.
+
+    Ratings that mods don't change are `nomod_stars`, the rest come from saved difficulty attributes or
+    are calculated from the cached .osu file. Falls back to osu! difficulty-rating endpoint if the file is
+    unavailable or pyttanko doesn't know some of the mods (RX, AP, ...).
+    """
+    if is_star_rating_right(parse_mods(mods)):
+        return nomod_stars
+    if mode_int == 0 and is_star_rating_calculable(mods):  # pyttanko calculates osu!standard only
+        try:
+            attributes = await get_difficulty_attributes(beatmap, mods, db, request, compute)
+        except (HTTPError, OSError):
+            attributes = None
+        if attributes is not None:
+            return attributes.total
+    return await request.get_star_rating(beatmap.id, mods, mode_int)
 
 
 def get_edited_bpm(audio_file: Path, beatmap_file: Path):
@@ -165,25 +193,4 @@ def get_edited_bpm(audio_file: Path, beatmap_file: Path):
         if not edited_bpm:
             return None
         return f'{edited_bpm[1]}x' if edited_bpm[1] else f'{edited_bpm[2]}bpm'
-
-
-# TODO: try to compress requests in one function
-async def gather_requests(item_list: list, operation: str, request: Request, db: Db) -> list:
-    result_list = []
-    if operation == 'score':
-        for item in item_list:  # type: dict
-            result_list.append(create_score_class(item, request, db))
-    elif operation == 'osu_file':
-        for item in item_list:  # type: Score
-            result_list.append(get_osu_file(item.beatmap.id, item.beatmap.last_updated, request))
-    elif operation == 'image':
-        for item in item_list:  # type: Score
-            result_list.append(get_saved_image(item.beatmap.id, item.beatmapset.square_cover, request))
-    elif operation == 'status_code':
-        for item in item_list:  # type: str
-            result_list.append(request.get_status_code(item))
-    elif operation == 'sr':
-        for item in item_list:  # type: Score
-            result_list.append(request.get_star_rating(item.beatmap.id, item.mods, item.mode_int))
-    result = await asyncio.gather(*result_list)
-    return [item for item in result]
+    return edited_bpm[1]
@@ -0,0 +1,302 @@
+"""
+NumPy port of pyttanko's difficulty and pp calculation.
+
+Strains are calculated over arrays of hit objects and pp is evaluated for a whole vector of scenarios
+(accuracy, misses, combo) in one call. Results match pyttanko up to float rounding, see
+tests/test_vectorized_calculators.py and benchmark_calculators.py.
+"""
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pyttanko
+from pyttanko import beatmap
+
+DIFF_SPEED = 0
+DIFF_AIM = 1
+DECAY_BASE = (0.3, 0.15)
+WEIGHT_SCALING = (1400.0, 26.25)
+DECAY_WEIGHT = 0.9
+STAR_SCALING_FACTOR = 0.0675
+EXTREME_SCALING_FACTOR = 0.5
+PLAYFIELD_WIDTH = 512.0
+CIRCLESIZE_BUFF_THRESHOLD = 30.0
+
+# strain recurrence is evaluated in closed form inside blocks of this many seconds, keeps decay powers in float range
+STRAIN_BLOCK_SECONDS = 30.0
+
+
+@dataclass
+class HitObjectArrays:
+    time: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    is_spinner: np.ndarray
+
+    @classmethod
+    def from_beatmap(cls, expanded_beatmap_file: beatmap) -> 'HitObjectArrays':
+        objects = expanded_beatmap_file.hitobjects
+        count = len(objects)
+        time = np.empty(count)
+        x = np.zeros(count)
+        y = np.zeros(count)
+        is_spinner = np.zeros(count, dtype=bool)
+        for i, obj in enumerate(objects):
+            time[i] = obj.time
+            if obj.objtype & pyttanko.OBJ_SPINNER:
+                is_spinner[i] = True
+            else:
+                x[i] = obj.data.pos.x
+                y[i] = obj.data.pos.y
+        return cls(time, x, y, is_spinner)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+
+def _spacing_weight(
+        difftype: int,
+        distance: np.ndarray,
+        delta_time: np.ndarray,
+        prev_distance: np.ndarray,
+        prev_delta_time: np.ndarray,
+        angle: np.ndarray,
+) -> np.ndarray:
+    """Vectorized `pyttanko.d_spacing_weight`. Angles of objects that have none are NaN."""
+    strain_time = np.maximum(delta_time, 50.0)
+    prev_strain_time = np.maximum(prev_delta_time, 50.0)
+    has_angle = ~np.isnan(angle)
+    angle = np.where(has_angle, angle, 0.0)
+
+    if difftype == DIFF_AIM:
+        angle_bonus_begin = math.pi / 3
+        use_bonus = has_angle & (angle > angle_bonus_begin)
+        angle_bonus = np.sqrt(
+            np.maximum(prev_distance - 90, 0.0) *
+            np.sin(angle - angle_bonus_begin) ** 2.0 *
+            np.maximum(distance - 90, 0.0)
+        )
+        result = np.where(use_bonus, 1.5 * np.maximum(0.0, angle_bonus) ** 0.99 / np.maximum(107, prev_strain_time), 0.0)
+        weighted_distance = distance ** 0.99
+        return np.maximum(result + weighted_distance / np.maximum(107, strain_time), weighted_distance / strain_time)
+
+    distance = np.minimum(distance, 125.0)
+    delta_time = np.maximum(delta_time, 45.0)
+    speed_bonus = np.where(delta_time < 75.0, 1.0 + ((75.0 - delta_time) / 40.0) ** 2, 1.0)
+    angle_bonus_begin = 5 * math.pi / 6
+    s = np.sin(1.5 * (angle_bonus_begin - angle))
+    angle_bonus = np.where(has_angle & (angle < angle_bonus_begin), 1.0 + s * s / 3.57, 1.0)
+    sharp = has_angle & (angle < math.pi / 2.0)
+    close = np.minimum((90 - distance) / 10.0, 1.0)
+    sharp_bonus = np.where(
+        distance < 90,
+        np.where(
+            angle < math.pi / 4.0,
+            1.28 + (1.0 - 1.28) * close,
+            1.28 + (1.0 - 1.28) * close * np.sin((math.pi / 2.0 - angle) * 4.0 / math.pi),
+        ),
+        1.28,
+    )
+    angle_bonus = np.where(sharp, sharp_bonus, angle_bonus)
+    return (
+        (1 + (speed_bonus - 1) * 0.75) * angle_bonus *
+        (0.95 + speed_bonus * (distance / 125.0) ** 3.5)
+    ) / strain_time
+
+
+def _strains(values: np.ndarray, delta_time: np.ndarray, decay_base: float) -> np.ndarray:
+    """
+    Solves `strain[i] = strain[i - 1] * decay_base ** (delta_time[i] / 1000) + values[i]` for every object.
+
+    Inside a block the recurrence is a cumulative sum of values scaled by decay powers relative to the block start,
+    blocks are short enough for these powers to stay in float range.
+    """
+    strains = np.zeros(len(values) + 1)
+    elapsed = np.cumsum(delta_time / 1000.0)
+    blocks = np.floor(elapsed / STRAIN_BLOCK_SECONDS)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(blocks)) + 1, [len(values)]))
+    log_base = math.log(decay_base)
+    carried = 0.0
+    for start, end in zip(starts[:-1], starts[1:]):
+        offset = elapsed[start:end] - elapsed[start]
+        carried *= decay_base ** (delta_time[start] / 1000.0)
+        scaled = values[start:end] * np.exp(-offset * log_base)
+        block = np.exp(offset * log_base) * (carried + np.cumsum(scaled))
+        strains[start + 1:end + 1] = block
+        carried = block[-1]
+    return strains
+
+
+def _difficulty(
+        difftype: int,
+        time: np.ndarray,
+        values: np.ndarray,
+        delta_time: np.ndarray,
+        speed_mul: float,
+) -> float:
+    """Vectorized `pyttanko.diff_calc.calc_individual`, returns weighted difficulty."""
+    decay_base = DECAY_BASE[difftype]
+    strains = _strains(values, delta_time, decay_base)  # strains[0] is the first object, it never has strain
+
+    strain_step = 400.0 * speed_mul
+    first_interval_end = math.ceil(time[0] / strain_step) * strain_step
+    interval = np.maximum(np.ceil((time[1:] - first_interval_end) / strain_step), 0).astype(np.int64)
+    interval_count = int(interval[-1]) + 1
+
+    peaks = np.zeros(interval_count)
+    np.maximum.at(peaks, interval, strains[1:])
+
+    # every interval after the first starts from the strain of the last object before it, decayed to its start
+    interval_starts = first_interval_end + strain_step * np.arange(interval_count - 1)
+    previous = np.searchsorted(time, interval_starts, side='right') - 1
+    initial = strains[previous] * decay_base ** ((interval_starts - time[previous]) / 1000.0)
+    peaks[1:] = np.maximum(peaks[1:], initial)
+
+    peaks[::-1].sort()
+    return float(np.sum(peaks * DECAY_WEIGHT ** np.arange(interval_count)))
+
+
+def calculate_difficulty(objects: HitObjectArrays, cs: float, mods_calc: int) -> tuple[float, float, float]:
+    """
+    Vectorized `pyttanko.diff_calc.calc`.
+
+    :param objects: Hit objects of the beatmap.
+    :param cs: Base circle size.
+    :param mods_calc: pyttanko mods bitmask.
+    :return: aim, speed and total stars.
+    """
+    if len(objects) < 2:
+        raise ValueError('beatmap needs at least 2 hit objects')
+    speed_mul, _, _, cs, _ = pyttanko.mods_apply(mods_calc, cs=cs)
+    radius = (PLAYFIELD_WIDTH / 16.0) * (1.0 - 0.7 * (cs - 5.0) / 5.0)
+    scaling_factor = 52.0 / radius
+    if radius < CIRCLESIZE_BUFF_THRESHOLD:
+        scaling_factor *= 1.0 + min(CIRCLESIZE_BUFF_THRESHOLD - radius, 5.0) / 50.0
+    center = PLAYFIELD_WIDTH / 2 * scaling_factor
+    x = np.where(objects.is_spinner, center, objects.x * scaling_factor)
+    y = np.where(objects.is_spinner, center, objects.y * scaling_factor)
+
+    angle = np.full(len(objects), np.nan)
+    v1x, v1y = x[:-2] - x[1:-1], y[:-2] - y[1:-1]
+    v2x, v2y = x[2:] - x[1:-1], y[2:] - y[1:-1]
+    angle[2:] = np.abs(np.arctan2(v1x * v2y - v1y * v2x, v1x * v2x + v1y * v2y))
+
+    delta_time = (objects.time[1:] - objects.time[:-1]) / speed_mul
+    dx, dy = x[1:] - x[:-1], y[1:] - y[:-1]
+    is_hit = ~objects.is_spinner[1:]
+    # spinners keep their distance at 0 and the first object has no delta time, like in pyttanko
+    distance = np.where(is_hit, np.sqrt(dx * dx + dy * dy), 0.0)
+    prev_distance = np.concatenate(([0.0], distance[:-1]))
+    prev_delta_time = np.concatenate(([0.0], delta_time[:-1]))
+
+    stars = []
+    for difftype in (DIFF_SPEED, DIFF_AIM):
+        values = _spacing_weight(difftype, distance, delta_time, prev_distance, prev_delta_time, angle[1:])
+        values = np.where(is_hit, values * WEIGHT_SCALING[difftype], 0.0)
+        stars.append(_difficulty(difftype, objects.time, values, delta_time, speed_mul))
+    speed, aim = (math.sqrt(value) * STAR_SCALING_FACTOR for value in stars)
+    if mods_calc & pyttanko.MODS_TOUCH_DEVICE:
+        aim = aim ** 0.8
+    total = aim + speed + abs(speed - aim) * EXTREME_SCALING_FACTOR
+    return aim, speed, total
+
+
+def acc_round(acc_percent: np.ndarray, nobjects: int, misses: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized `pyttanko.acc_round`, returns n300, n100, n50 arrays."""
+    acc_percent = np.asarray(acc_percent, dtype=float)
+    misses = np.minimum(nobjects, np.broadcast_to(misses, acc_percent.shape))
+    max300 = nobjects - misses
+    max_acc = max300 * 300.0 / (nobjects * 300.0) * 100.0
+    acc_percent = np.maximum(0.0, np.minimum(max_acc, acc_percent))
+    n100 = np.round(-3.0 * ((acc_percent * 0.01 - 1.0) * nobjects + misses) * 0.5).astype(np.int64)
+    n50 = np.round(-6.0 * ((acc_percent * 0.01 - 1.0) * nobjects + misses) * 0.5).astype(np.int64)
+    only_50s = n100 > nobjects - misses
+    n50 = np.where(only_50s, np.minimum(max300, n50), 0)
+    n100 = np.where(only_50s, 0, np.minimum(max300, n100))
+    return nobjects - n100 - n50 - misses, n100, n50
+
+
+def ppv2(
+        attributes,
+        mods_calc: int,
+        n300: Optional[np.ndarray] = None,
+        n100: np.ndarray = 0,
+        n50: np.ndarray = 0,
+        nmiss: np.ndarray = 0,
+        combo: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Vectorized `pyttanko.ppv2` for score v1. Every score argument may be an array, returns pp for each scenario.
+
+    :param attributes: DifficultyAttributes of the beatmap with the same mods.
+    :param mods_calc: pyttanko mods bitmask.
+    """
+    n100, n50, nmiss = (np.asarray(value, dtype=float) for value in (n100, n50, nmiss))
+    nobjects = attributes.objects
+    max_combo = max(attributes.max_combo, 1)
+    if combo is None:
+        combo = max_combo - nmiss
+    combo = np.asarray(combo, dtype=float)
+    if n300 is None:
+        n300 = nobjects - n100 - n50 - nmiss
+    n300 = np.asarray(n300, dtype=float)
+
+    hits = n300 + n100 + n50 + nmiss
+    accuracy = np.where(hits > 0, (n50 * 50.0 + n100 * 100.0 + n300 * 300.0) / (np.maximum(hits, 1) * 300.0), 0.0)
+    nspinners = nobjects - attributes.sliders - attributes.circles
+    real_hits = n300 - attributes.sliders - nspinners + n100 + n50 + nmiss
+    real_acc = np.where(
+        real_hits > 0,
+        ((n300 - attributes.sliders - nspinners) * 300.0 + n100 * 100.0 + n50 * 50.0) / (np.where(real_hits > 0, real_hits, 1) * 300.0),
+        0.0,
+    )
+    real_acc = np.maximum(0.0, real_acc)
+
+    nobjects_over_2k = nobjects / 2000.0
+    length_bonus = 0.95 + 0.4 * min(1.0, nobjects_over_2k)
+    if nobjects > 2000:
+        length_bonus += math.log10(nobjects_over_2k) * 0.5
+    miss_ratio = (nmiss / nobjects) ** 0.775
+    miss_penalty_aim = np.where(nmiss > 0, 0.97 * (1 - miss_ratio) ** nmiss, 1.0)
+    miss_penalty_speed = np.where(nmiss > 0, 0.97 * (1 - miss_ratio) ** (nmiss ** 0.875), 1.0)
+    combo_break = combo ** 0.8 / max_combo ** 0.8
+
+    _, ar, od, _, _ = pyttanko.mods_apply(mods_calc, ar=attributes.ar, od=attributes.od)
+    ar_bonus = 0.0
+    if ar > 10.33:
+        ar_bonus += 0.4 * (ar - 10.33)
+    elif ar < 8.0:
+        ar_bonus += 0.01 * (8.0 - ar)
+    ar_multiplier = 1.0 + min(ar_bonus, ar_bonus * (nobjects / 1000.0))
+    hd_bonus = 1.0 + 0.04 * (12.0 - ar) if mods_calc & pyttanko.MODS_HD else 1.0
+
+    aim = pyttanko.pp_base(attributes.aim) * length_bonus * miss_penalty_aim * combo_break * ar_multiplier * hd_bonus
+    if mods_calc & pyttanko.MODS_FL:
+        fl_bonus = 1.0 + 0.35 * min(1.0, nobjects / 200.0)
+        if nobjects > 200:
+            fl_bonus += 0.3 * min(1, (nobjects - 200) / 300.0)
+        if nobjects > 500:
+            fl_bonus += (nobjects - 500) / 1200.0
+        aim = aim * fl_bonus
+    od_squared = od * od
+    aim = aim * (0.5 + accuracy / 2.0) * (0.98 + od_squared / 2500.0)
+
+    speed = pyttanko.pp_base(attributes.speed) * length_bonus * miss_penalty_speed * combo_break
+    if ar > 10.33:
+        speed = speed * ar_multiplier
+    speed = speed * hd_bonus * (0.95 + od_squared / 750.0) * accuracy ** ((14.5 - max(od, 8.0)) / 2.0)
+    speed = np.where(n50 >= nobjects / 500.0, speed * 0.98 ** (n50 - nobjects / 500.0), speed)
+
+    acc = 1.52163 ** od * real_acc ** 24.0 * 2.83 * min(1.15, (attributes.circles / 1000.0) ** 0.3)
+    if mods_calc & pyttanko.MODS_HD:
+        acc = acc * 1.08
+    if mods_calc & pyttanko.MODS_FL:
+        acc = acc * 1.02
+
+    final_multiplier = 1.12
+    if mods_calc & pyttanko.MODS_NF:
+        final_multiplier = final_multiplier * np.maximum(0.9, 1.0 - 0.2 * nmiss)
+    if mods_calc & pyttanko.MODS_SO:
+        final_multiplier *= 1.0 - (nspinners / nobjects) ** 0.85
+    return (aim ** 1.1 + speed ** 1.1 + acc ** 1.1) ** (1.0 / 1.1) * final_multiplier
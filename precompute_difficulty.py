@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from multiprocessing import Pool
+from time import monotonic
+from typing import Optional
+
+import pyttanko
+
+import config
+from db import Db, DifficultyAttributes
+from message_constructors.utils.osu_calculators import get_expanded_beatmap_file, calculate_difficulty_attributes, \
+    recalculate_mods, PRECOMPUTED_MODS
+from message_constructors.utils.osu_file_store import parse_file_name, read_osu_file, decode_osu_file
+
+OSU_FILES_PATH = 'beatmap_files/osu_file'
+
+
+def calculate_file(file_name: str) -> list[tuple[int, datetime, int, DifficultyAttributes]]:
+    parsed_name = parse_file_name(file_name)
+    if parsed_name is None:
+        return []
+    beatmap_id, timestamp, _ = parsed_name
+    last_updated = datetime.fromtimestamp(timestamp, timezone.utc)
+    osu_file = read_osu_file(os.path.join(OSU_FILES_PATH, file_name))
+    expanded_beatmap_file = get_expanded_beatmap_file(decode_osu_file(osu_file))
+    if not expanded_beatmap_file.hitobjects or expanded_beatmap_file.mode != pyttanko.MODE_STD:
+        return []
+    return [
+        (beatmap_id, last_updated, recalculate_mods(mods), calculate_difficulty_attributes(mods, expanded_beatmap_file))
+        for mods in PRECOMPUTED_MODS
+    ]
+
+
+async def main(workers: Optional[int], batch_size: int):
+    db = await Db.connect(config.DB_USER, config.DB_PASSWORD, config.DB_HOST, config.DB_NAME)
+    file_names = os.listdir(OSU_FILES_PATH)
+    started = monotonic()
+    batch = []
+    with Pool(workers) as pool:
+        for i, attributes in enumerate(pool.imap_unordered(calculate_file, file_names, chunksize=4), 1):
+            batch.extend(attributes)
+            if len(batch) >= batch_size:
+                await db.save_difficulty_attributes(batch)
+                batch = []
+            if i % 100 == 0 or i == len(file_names):
+                print(f'{i}/{len(file_names)} files, {round(i / (monotonic() - started), 1)} files/s')
+    await db.save_difficulty_attributes(batch)
+    await db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes difficulty attributes for saved .osu files.')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, defaults to CPU count')
+    parser.add_argument('--batch-size', type=int, default=1000, help='attributes saved per query')
+    args = parser.parse_args()
+    asyncio.run(main(args.workers, args.batch_size))
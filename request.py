@@ -1,12 +1,54 @@
-from asyncio import sleep, create_task
-from typing import Any, Optional, Union
+import logging
+import random
+from asyncio import sleep, create_task, get_running_loop, Future, Lock, Task, CancelledError
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from math import isfinite
+from time import monotonic
+from typing import Any, BinaryIO, Iterator, Optional, Union
 
 import httpx
-import config
+from cache import TTLCache
+from singleflight import SingleFlight
 
 BASE_URL = 'https://osu.ppy.sh'
 API_V2 = 'api/v2'
 
+API_RATE_LIMIT = 60  # requests per minute, see https://osu.ppy.sh/docs/index.html#terms-of-use
+API_BURST = 20
+
+OAUTH_URL = 'https://osu.ppy.sh/oauth/token'
+TOKEN_REFRESH_MARGIN = 300  # seconds before expiry when the token gets refreshed
+TOKEN_RETRY_DELAY = 30
+
+POOL_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30)
+TIMEOUTS = {
+    'api': httpx.Timeout(10, connect=5),
+    'osu_file': httpx.Timeout(20, connect=5),
+    'cdn': httpx.Timeout(10, connect=5),
+    'oauth': httpx.Timeout(10, connect=5),
+}
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+RETRY_AFTER_DEFAULT = 60  # seconds to hold osu! requests after a 429 without a usable Retry-After
+
+BEATMAPS_PER_REQUEST = 50
+
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+
+# Covers and avatars urls change with their content, so availability rarely changes; missing ones may get uploaded
+URL_AVAILABILITY_CACHE_SIZE = 8192
+URL_AVAILABLE_TTL = 24 * 60 * 60
+URL_UNAVAILABLE_TTL = 10 * 60
+
 
 def api_build_url(fragment: str) -> str:
     return BASE_URL + '/' + API_V2 + '/' + fragment.lstrip('/')
@@ -16,24 +58,296 @@ def api_build_sr_url(fragment: str) -> str:
     return BASE_URL + '/' + fragment.lstrip('/')
 
 
+def _freeze_params(params: Optional[dict[str, Any]]) -> tuple:
+    if not params:
+        return ()
+    return tuple(sorted((key, tuple(value) if isinstance(value, list) else value) for key, value in params.items()))
+
+
+class BanchoUnavailable(Exception):
+    """Raised without sending anything while the circuit breaker is open."""
+
+
+class Priority(IntEnum):
+    """Scheduler lanes. Lower value is served first. Commands are interactive, bulk jobs like imports are batch."""
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+_priority: ContextVar[Priority] = ContextVar('request_priority', default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def request_priority(lane: Priority) -> Iterator[None]:
+    """Runs every osu! request made inside the block (and in tasks spawned from it) in the given lane."""
+    token = _priority.set(lane)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@dataclass
+class LaneStats:
+    served: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.served if self.served else 0.0
+
+
+class RequestScheduler:
+    """
+    Token bucket shared by every request to osu.ppy.sh.
+
+    Requests that can't be served right away wait in priority lanes, so interactive commands go before batch
+    and background work.
+
+    :param rate: Tokens added per second.
+    :param burst: Bucket size.
+    """
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = monotonic()
+        self._lanes: dict[Priority, deque[Future]] = {lane: deque() for lane in Priority}
+        self._dispatcher: Optional[Task] = None
+        self.stats: dict[Priority, LaneStats] = {lane: LaneStats() for lane in Priority}
+        self.penalties = 0
+
+    @property
+    def queue_depth(self) -> dict[Priority, int]:
+        return {lane: len(waiters) for lane, waiters in self._lanes.items()}
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def penalize(self, delay: float) -> None:
+        """Empties the bucket so that nothing is sent for `delay` seconds. Used after 429 responses."""
+        self.penalties += 1
+        self._refill()
+        self._tokens = min(self._tokens, 0) - delay * self._rate
+
+    async def acquire(self, lane: Optional[Priority] = None) -> None:
+        lane = _priority.get() if lane is None else lane
+        started = monotonic()
+        self._refill()
+        if self._tokens >= 1 and not any(self._lanes.values()):
+            self._tokens -= 1
+        else:
+            waiter = get_running_loop().create_future()
+            self._lanes[lane].append(waiter)
+            if self._dispatcher is None:
+                self._dispatcher = create_task(self._dispatch())
+            try:
+                await waiter
+            except CancelledError:
+                if waiter in self._lanes[lane]:
+                    self._lanes[lane].remove(waiter)
+                raise
+        waited = monotonic() - started
+        stats = self.stats[lane]
+        stats.served += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+
+    async def _dispatch(self) -> None:
+        while True:
+            waiters = next((waiters for waiters in self._lanes.values() if waiters), None)
+            if waiters is None:
+                self._dispatcher = None
+                return
+            if waiters[0].done():
+                waiters.popleft()
+                continue
+            self._refill()
+            if self._tokens < 1:
+                await sleep((1 - self._tokens) / self._rate)
+                continue
+            self._tokens -= 1
+            waiters.popleft().set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while osu.ppy.sh is down.
+
+    Opens after `threshold` failures in a row. Once `reset_timeout` seconds pass, one trial request is let through:
+    success closes the circuit, failure opens it again.
+    """
+    def __init__(self, threshold: int, reset_timeout: float):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> None:
+        if self.opened_at is None:
+            return
+        if monotonic() - self.opened_at < self._reset_timeout:
+            self.rejected += 1
+            raise BanchoUnavailable
+        self.opened_at = monotonic()
+        self.failures = self._threshold - 1
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self._threshold:
+            self.opened_at = monotonic()
+
+
+def _retry_delay(attempt: int) -> float:
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Returns seconds to wait from a Retry-After header, either delay seconds or an HTTP date."""
+    if value is None:
+        return RETRY_AFTER_DEFAULT
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return RETRY_AFTER_DEFAULT
+        if retry_at.tzinfo is None:  # "-0000" zone, RFC 5322 treats it as UTC
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    if not isfinite(delay):
+        return RETRY_AFTER_DEFAULT
+    return max(delay, 0.0)
+
+
 class Request:
-    def __init__(self, token: str):
+    def __init__(
+            self,
+            token: str,
+            client_id: int,
+            client_secret: str,
+            rate_limit: int = API_RATE_LIMIT,
+            burst: int = API_BURST,
+            limits: httpx.Limits = POOL_LIMITS,
+            timeouts: Optional[dict[str, httpx.Timeout]] = None,
+            http2: bool = True,
+            max_retries: int = MAX_RETRIES,
+    ):
+        """
+        :param token: osu! api v2 access token.
+        :param client_id: osu! api v2 client id, used to get new tokens.
+        :param client_secret: osu! api v2 client secret.
+        :param rate_limit: Requests per minute allowed to osu.ppy.sh.
+        :param burst: How many requests can be sent at once after being idle.
+        :param limits: Connection pool size.
+        :param timeouts: Timeouts by endpoint kind - "api", "osu_file", "cdn", "oauth". Missing kinds use defaults.
+        :param http2: Use HTTP/2 where the server supports it.
+        :param max_retries: How many times idempotent requests are retried on timeouts, connection errors and 5xx.
+        """
         self._token = token
-        self._session = httpx.AsyncClient()
-
-    async def update_token(self, delay: int = 0) -> None:
-        if delay:
-            await sleep(delay)
-        resp = await self._session.post('https://osu.ppy.sh/oauth/token', json={
-            'client_id': config.CLIENT_ID,
-            'client_secret': config.CLIENT_SECRET,
-            'grant_type': 'client_credentials',
-            'scope': 'public',
-        })
-        resp.raise_for_status()
-        data = resp.json()
-        self._token = data['access_token']
-        create_task(self.update_token(data['expires_in'] - 60))
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._token_expires_at = 0.0
+        self._token_lock = Lock()
+        self._token_refresher: Optional[Task] = None
+        self._session = httpx.AsyncClient(http2=http2, limits=limits)
+        self._timeouts = {**TIMEOUTS, **(timeouts or {})}
+        self._max_retries = max_retries
+        self.scheduler = RequestScheduler(rate_limit / 60, burst)
+        self.in_flight = SingleFlight()
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.url_availability: TTLCache[str, bool] = TTLCache(URL_AVAILABILITY_CACHE_SIZE, URL_AVAILABLE_TTL)
+
+    async def _send(
+            self,
+            http_method: str,
+            url: str,
+            endpoint: str = 'api',
+            stream: bool = False,
+            **kwargs
+    ) -> httpx.Response:
+        """
+        Sends a request, retrying idempotent ones with jittered exponential backoff.
+
+        Requests to osu.ppy.sh also wait for the scheduler and go through the circuit breaker.
+
+        :param stream: Don't read the body, the caller must close the returned response.
+        """
+        to_osu = url.startswith(BASE_URL)
+        attempts = self._max_retries + 1 if http_method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if to_osu:
+                self.breaker.check()
+                await self.scheduler.acquire()
+            try:
+                request = self._session.build_request(http_method, url, timeout=self._timeouts[endpoint], **kwargs)
+                response = await self._session.send(request, stream=stream)
+            except httpx.TransportError:
+                if to_osu:
+                    self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            else:
+                if response.status_code == 429:
+                    if to_osu:
+                        self.scheduler.penalize(parse_retry_after(response.headers.get('Retry-After')))
+                elif response.status_code < 500:
+                    if to_osu:
+                        self.breaker.record_success()
+                    return response
+                elif to_osu:
+                    self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+                await response.aclose()
+            await sleep(_retry_delay(attempt))
+
+    async def update_token(self) -> None:
+        """Gets a new access token and keeps refreshing it ahead of expiry."""
+        await self._refresh_token(force=True)
+        if self._token_refresher is None:
+            self._token_refresher = create_task(self._keep_token_fresh())
+
+    async def _refresh_token(self, force: bool = False) -> None:
+        token = self._token
+        async with self._token_lock:
+            if self._token != token:  # refreshed by someone else while we were waiting
+                return
+            if not force and monotonic() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                return
+            resp = await self._session.post(OAUTH_URL, timeout=self._timeouts['oauth'], json={
+                'client_id': self._client_id,
+                'client_secret': self._client_secret,
+                'grant_type': 'client_credentials',
+                'scope': 'public',
+            })
+            resp.raise_for_status()
+            data = resp.json()
+            self._token = data['access_token']
+            self._token_expires_at = monotonic() + data['expires_in']
+
+    async def _keep_token_fresh(self) -> None:
+        while True:
+            await sleep(max(self._token_expires_at - TOKEN_REFRESH_MARGIN - monotonic(), 0))
+            try:
+                await self._refresh_token()
+            except httpx.HTTPError:
+                logging.exception('Failed to refresh osu! api token')
+                await sleep(TOKEN_RETRY_DELAY)
 
     async def api_request(
             self,
@@ -43,13 +357,14 @@ class Request:
             json: Optional[dict[str, Union[int, list[dict[str, str]]]]] = None
     ) -> Any:
         if http_method == 'GET':
-            response = await self._session.get(
-                api_build_url(method),
-                headers={'Authorization': 'Bearer ' + self._token},
-                params=params
+            url = api_build_url(method)
+            return await self.in_flight.do(
+                ('GET', url, _freeze_params(params)),
+                lambda: self._api_get(url, params)
             )
         elif http_method == 'POST':
-            response = await self._session.post(
+            response = await self._send(
+                'POST',
                 api_build_sr_url(method),
                 json=json
             )
@@ -58,12 +373,42 @@ class Request:
         response.raise_for_status()
         return response.json()
 
-    async def get_osu_file(
+    async def _api_get(self, url: str, params: Optional[dict[str, Any]]) -> Any:
+        await self._refresh_token()
+        for retry in (False, True):
+            response = await self._send(
+                'GET',
+                url,
+                headers={'Authorization': 'Bearer ' + self._token},
+                params=params
+            )
+            if response.status_code != 401 or retry:
+                break
+            await self._refresh_token(force=True)
+        response.raise_for_status()
+        return response.json()
+
+    async def download_osu_file(
             self,
-            map_id: int
-    ) -> str:
-        r = await self._session.get(f"https://osu.ppy.sh/osu/{map_id}")
-        return r.text
+            map_id: int,
+            file: BinaryIO,
+    ) -> bytes:
+        """
+        Streams .osu file of the beatmap into `file`, writing chunks in the default executor.
+
+        :return: Contents of the file, collected while streaming so the caller doesn't have to read it back.
+        """
+        response = await self._send('GET', f"https://osu.ppy.sh/osu/{map_id}", 'osu_file', stream=True)
+        loop = get_running_loop()
+        chunks = []
+        try:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                await loop.run_in_executor(None, file.write, chunk)
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        return b''.join(chunks)
 
     async def get_user_beatmap_score(
             self,
@@ -98,6 +443,21 @@ class Request:
             {}
         )
 
+    async def get_beatmaps(
+            self,
+            beatmap_ids: list[int],
+    ) -> list[dict]:
+        """Looks up many beatmaps at once, 50 ids per request. Beatmaps that don't exist are left out."""
+        beatmaps = []
+        for i in range(0, len(beatmap_ids), BEATMAPS_PER_REQUEST):
+            response = await self.api_request(
+                'GET',
+                '/beatmaps',
+                {'ids[]': beatmap_ids[i:i + BEATMAPS_PER_REQUEST]}
+            )
+            beatmaps.extend(response['beatmaps'])
+        return beatmaps
+
     async def get_user_data(
             self,
             user_id: int,
@@ -124,18 +484,36 @@ class Request:
             return 0
         return response['id']
 
+    def _remember_availability(self, url: str, status_code: int) -> None:
+        available = status_code < 300
+        self.url_availability.set(url, available, URL_AVAILABLE_TTL if available else URL_UNAVAILABLE_TTL)
+
+    async def is_url_available(
+            self,
+            url: str
+    ) -> bool:
+        """Returns whether the url responds with 2xx, sending HEAD only if it wasn't checked or downloaded recently."""
+        available = self.url_availability.get(url)
+        if available is None:
+            available = await self.get_status_code(url) < 300
+        return available
+
     async def get_status_code(
             self,
             url: str
     ) -> int:
-        response = await self._session.head(url)
+        response = await self._send('HEAD', url, 'cdn')
+        self._remember_availability(url, response.status_code)
         return response.status_code
 
     async def get_pic_as_bytes(
             self,
             url: str
     ) -> bytes:
-        response = await self._session.get(url)
+        """Downloads an image. Raises `httpx.HTTPStatusError` on non-2xx, so error pages are never taken for images."""
+        response = await self._send('GET', url, 'cdn')
+        self._remember_availability(url, response.status_code)
+        response.raise_for_status()
         return response.content
 
     async def get_star_rating(
@@ -151,7 +529,7 @@ class Request:
         )
 
 
-async def create_request():
-    request = Request('')
+async def create_request(client_id: int, client_secret: str):
+    request = Request('', client_id, client_secret)
     await request.update_token()
     return request
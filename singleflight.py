@@ -0,0 +1,37 @@
+from asyncio import create_task, shield, Task
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls.
+
+    The first caller with a key starts the call, everyone who comes with the same key before it finishes awaits
+    the same result. Cancelling one caller doesn't cancel the call for the others.
+    """
+    def __init__(self):
+        self._calls: dict[Hashable, Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, task: Task) -> None:
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved by the callers, silences "exception was never retrieved" if they're all gone
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = create_task(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await shield(task)
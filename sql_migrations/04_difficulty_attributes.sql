@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS difficulty_attributes(
+    map_id INT NOT NULL,
+    mods INT NOT NULL,
+    last_updated TIMESTAMP WITH TIME ZONE NOT NULL,
+    aim DOUBLE PRECISION NOT NULL,
+    speed DOUBLE PRECISION NOT NULL,
+    stars DOUBLE PRECISION NOT NULL,
+    max_combo INT NOT NULL,
+    circles INT NOT NULL,
+    sliders INT NOT NULL,
+    objects INT NOT NULL,
+    ar DOUBLE PRECISION NOT NULL,
+    od DOUBLE PRECISION NOT NULL,
+    ss_pp DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (map_id, mods)
+);
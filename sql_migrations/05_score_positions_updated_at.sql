@@ -0,0 +1,3 @@
+ALTER TABLE score_positions ALTER COLUMN score_id TYPE BIGINT;
+ALTER TABLE score_positions ALTER COLUMN position DROP NOT NULL;
+ALTER TABLE score_positions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
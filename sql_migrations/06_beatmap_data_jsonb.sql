@@ -0,0 +1 @@
+ALTER TABLE beatmap_data ALTER COLUMN data TYPE JSONB USING data::jsonb;
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS telegram_files(
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (kind, source)
+);
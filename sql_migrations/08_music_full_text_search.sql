@@ -0,0 +1,60 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Search document is "artist title tags mappers", kept up to date by triggers on music and music_mappers
+ALTER TABLE music ADD COLUMN IF NOT EXISTS tags TEXT NOT NULL DEFAULT '';
+ALTER TABLE music ADD COLUMN IF NOT EXISTS search_document TEXT NOT NULL DEFAULT '';
+ALTER TABLE music ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', search_document)) STORED;
+
+CREATE OR REPLACE FUNCTION music_search_document(music_id BIGINT, artist TEXT, title TEXT, tags TEXT) RETURNS TEXT AS $$
+    SELECT concat_ws(' ', artist, title, nullif(tags, ''), (
+        SELECT string_agg(DISTINCT m.mapper, ' ')
+        FROM music_mappers msm
+        JOIN mappers m ON m.id = msm.mapper_id
+        WHERE msm.music_id = $1
+    ))
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION music_search_document_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_document := music_search_document(NEW.id, NEW.artist, NEW.title, NEW.tags);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION music_mappers_search_document_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    changed_music_id BIGINT := CASE WHEN TG_OP = 'DELETE' THEN OLD.music_id ELSE NEW.music_id END;
+BEGIN
+    UPDATE music
+    SET search_document = music_search_document(id, artist, title, tags)
+    WHERE id = changed_music_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS music_search_document ON music;
+CREATE TRIGGER music_search_document
+    BEFORE INSERT OR UPDATE OF artist, title, tags ON music
+    FOR EACH ROW EXECUTE FUNCTION music_search_document_trigger();
+
+DROP TRIGGER IF EXISTS music_mappers_search_document ON music_mappers;
+CREATE TRIGGER music_mappers_search_document
+    AFTER INSERT OR DELETE ON music_mappers
+    FOR EACH ROW EXECUTE FUNCTION music_mappers_search_document_trigger();
+
+UPDATE music SET search_document = music_search_document(id, artist, title, tags);
+
+CREATE INDEX IF NOT EXISTS music_search_vector_idx ON music USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS music_search_document_trgm_idx ON music USING GIN (search_document gin_trgm_ops);
+
+-- Tokens point at music rows instead of telegram file ids
+ALTER TABLE music_tokens ADD COLUMN IF NOT EXISTS music_id BIGINT REFERENCES music(id);
+UPDATE music_tokens mt SET music_id = music.id FROM music WHERE music.file_id = mt.file_id AND mt.music_id IS NULL;
+DELETE FROM music_tokens WHERE music_id IS NULL;
+ALTER TABLE music_tokens DROP COLUMN IF EXISTS file_id;
+ALTER TABLE music_tokens ALTER COLUMN music_id SET NOT NULL;
+DELETE FROM music_tokens a USING music_tokens b
+WHERE a.ctid < b.ctid AND a.word = b.word AND a.music_id = b.music_id;
+ALTER TABLE music_tokens DROP CONSTRAINT IF EXISTS music_tokens_word_music_id_key;
+ALTER TABLE music_tokens ADD CONSTRAINT music_tokens_word_music_id_key UNIQUE (word, music_id);
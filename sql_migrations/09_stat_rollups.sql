@@ -0,0 +1,24 @@
+-- Daily rollups of the stat table, days are in the stat time zone (STAT_TIME_ZONE in db.py)
+CREATE TABLE IF NOT EXISTS stat_daily_commands(
+    day DATE NOT NULL,
+    command TEXT NOT NULL,
+    count INT NOT NULL,
+    PRIMARY KEY (day, command)
+);
+
+CREATE TABLE IF NOT EXISTS stat_daily_users(
+    day DATE NOT NULL,
+    tg_user_id BIGINT NOT NULL,
+    PRIMARY KEY (day, tg_user_id)
+);
+
+INSERT INTO stat_daily_commands(day, command, count)
+SELECT (date AT TIME ZONE 'Asia/Yekaterinburg')::DATE, command, count(*)
+FROM stat
+GROUP BY 1, 2
+ON CONFLICT (day, command) DO UPDATE SET count = excluded.count;
+
+INSERT INTO stat_daily_users(day, tg_user_id)
+SELECT DISTINCT (date AT TIME ZONE 'Asia/Yekaterinburg')::DATE, tg_user_id
+FROM stat
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from message_constructors.utils.batch import BatchExecutor
+
+
+async def delayed(value: float) -> float:
+    await asyncio.sleep(value)
+    return value
+
+
+def test_results_keep_item_order():
+    async def run():
+        executor = BatchExecutor('test', limit=4, timeout=1)
+        result = await executor.map(delayed, [0.03, 0.01, 0.02, 0])
+        assert result.values() == [0.03, 0.01, 0.02, 0]
+        assert result.failed == 0
+        assert (executor.stats.batches, executor.stats.items) == (1, 4)
+
+    asyncio.run(run())
+
+
+def test_limit_is_shared_by_batches():
+    async def run():
+        executor = BatchExecutor('test', limit=2, timeout=1)
+        await asyncio.gather(executor.map(delayed, [0.01] * 3), executor.map(delayed, [0.01] * 3))
+        assert executor.stats.max_in_flight == 2
+        assert executor.stats.batches == 2
+
+    asyncio.run(run())
+
+
+def test_failed_and_timed_out_items_dont_fail_the_rest():
+    async def get(value: float) -> float:
+        if value < 0:
+            raise ValueError(value)
+        return await delayed(value)
+
+    async def run():
+        executor = BatchExecutor('test', limit=4, timeout=0.05)
+        result = await executor.map(get, [0, -1, 1, 0.01])
+        assert result.results[0] == 0 and result.results[3] == 0.01
+        assert isinstance(result.errors[1], ValueError)
+        assert isinstance(result.errors[2], asyncio.TimeoutError)
+        assert result.failed == 2
+        assert (executor.stats.failures, executor.stats.timeouts) == (2, 1)
+
+        assert result.values_or(lambda i: None) == [0, None, None, 0.01]
+        assert result.values_or(lambda i: -i) == [0, -1, -2, 0.01]
+        with pytest.raises(ValueError):
+            result.values()
+
+    asyncio.run(run())
+
+
+def test_waiting_for_a_slot_isnt_timed():
+    async def run():
+        executor = BatchExecutor('test', limit=1, timeout=0.05)
+        result = await executor.map(delayed, [0.03] * 3)
+        assert result.failed == 0
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_batch_cancels_the_caller():
+    async def run():
+        executor = BatchExecutor('test', limit=2, timeout=1)
+        task = asyncio.create_task(executor.map(delayed, [0.5, 0.5]))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
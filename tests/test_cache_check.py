@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from message_constructors.utils.cache_check import get_score_positions
+
+CREATED_AT = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeDb:
+    def __init__(self):
+        self.cached = []
+
+    async def get_user_score_positions(self, best_ids: list[int]) -> dict:
+        return {}
+
+    async def cache_user_score_positions(self, positions: list[tuple[int, int]]) -> None:
+        self.cached.extend(positions)
+
+
+class FakeRequest:
+    """Serves position = beatmap id, fails for negative beatmap ids."""
+    async def get_user_beatmap_score(self, beatmap_id: int, user_id: int) -> dict:
+        if beatmap_id < 0:
+            raise ConnectionError(beatmap_id)
+        return {'position': beatmap_id, 'score': {'created_at': CREATED_AT.isoformat()}}
+
+
+def build_score(beatmap_id: int, best_id=1):
+    return SimpleNamespace(best_id=best_id, beatmap=SimpleNamespace(id=beatmap_id), user_id=2, created_at=CREATED_AT)
+
+
+def test_failed_position_doesnt_fail_the_rest():
+    async def run():
+        db = FakeDb()
+        scores = [build_score(5), build_score(-1), build_score(7, best_id=None), build_score(9)]
+        positions = await get_score_positions(scores, ['ranked'] * len(scores), db, FakeRequest())
+        assert positions == [5, None, None, 9]
+        assert db.cached == [(1, 5), (1, 9)]
+
+    asyncio.run(run())
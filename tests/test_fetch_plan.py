@@ -0,0 +1,78 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+
+from message_constructors.utils.fetch_plan import FetchPlan
+
+
+def test_steps_get_required_results():
+    async def user() -> str:
+        return 'peppy'
+
+    async def scores(user: str) -> list[str]:
+        return [f'{user} score']
+
+    async def run():
+        plan = FetchPlan('test').add('user', user).add('scores', scores, 'user')
+        assert await plan.run() == {'user': 'peppy', 'scores': ['peppy score']}
+        assert set(plan.timings) == {'user', 'scores'}
+        assert plan.timings['scores'].started >= plan.timings['user'].started
+
+    asyncio.run(run())
+
+
+def test_independent_steps_run_concurrently():
+    async def slow(value: int) -> int:
+        await asyncio.sleep(0.1)
+        return value
+
+    async def run() -> float:
+        plan = FetchPlan('test')
+        for value in range(3):
+            plan.add(f'step {value}', lambda value=value: slow(value))
+        started = perf_counter()
+        assert await plan.run() == {'step 0': 0, 'step 1': 1, 'step 2': 2}
+        return perf_counter() - started
+
+    assert asyncio.run(run()) < 0.25
+
+
+def test_failed_step_cancels_the_rest():
+    cancelled = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('bancho is dead')
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append('slow')
+            raise
+
+    async def dependent(slow):
+        cancelled.append('dependent started')
+
+    async def run():
+        plan = FetchPlan('test').add('fail', fail).add('slow', slow).add('dependent', dependent, 'slow')
+        started = perf_counter()
+        with pytest.raises(ValueError, match='bancho is dead'):
+            await plan.run()
+        assert perf_counter() - started < 1
+        assert all(task.done() for task in asyncio.all_tasks() if task is not asyncio.current_task())
+
+    asyncio.run(run())
+    assert cancelled == ['slow']
+
+
+def test_steps_must_be_added_once_after_requirements():
+    async def step():
+        pass
+
+    plan = FetchPlan('test').add('user', step)
+    with pytest.raises(ValueError):
+        plan.add('user', step)
+    with pytest.raises(ValueError):
+        plan.add('scores', step, 'beatmaps')
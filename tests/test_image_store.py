@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+
+from message_constructors.utils.image_store import ImageStore, get_url_version, parse_file_name
+
+COVER_URL = 'https://assets.ppy.sh/beatmaps/{id}/covers/cover.jpg?{version}'
+
+
+class FakeDownloads:
+    """Download coroutine serving `{url: bytes}`, counting calls. Missing urls raise like a failed download."""
+    def __init__(self, content: dict[str, bytes]):
+        self.content = content
+        self.calls: list[str] = []
+
+    async def __call__(self, url: str) -> bytes:
+        self.calls.append(url)
+        if url not in self.content:
+            raise OSError(url)
+        return self.content[url]
+
+
+def stored_files(root) -> list[str]:
+    return sorted(name for _, _, names in os.walk(root) for name in names)
+
+
+def test_url_version_and_file_name():
+    assert get_url_version(COVER_URL.format(id=1, version=1650000000)) == 1650000000
+    assert get_url_version('https://assets.ppy.sh/beatmaps/1/covers/cover.jpg') == 0
+    assert parse_file_name('123_1650000000.jpg') == (123, 1650000000)
+    assert parse_file_name('123.jpg') == (123, 0)
+    assert parse_file_name('123_1.jpg.tmp') is None
+    assert parse_file_name('cover.jpg') is None
+
+
+def test_saved_image_is_served_from_disk(tmp_path):
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=1000)
+        url = COVER_URL.format(id=1, version=10)
+        download = FakeDownloads({url: b'cover'})
+        assert await store.get('cover', 1, url, download) == b'cover'
+        assert await store.get('cover', 1, url, download) == b'cover'
+        assert download.calls == [url]
+        assert (store.stats.hits, store.stats.misses) == (1, 1)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == ['1_10.jpg']
+
+
+def test_new_url_version_replaces_image(tmp_path):
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=1000)
+        old_url, new_url = COVER_URL.format(id=1, version=10), COVER_URL.format(id=1, version=20)
+        download = FakeDownloads({old_url: b'old', new_url: b'new cover'})
+        assert await store.get('cover', 1, old_url, download) == b'old'
+        assert await store.get('cover', 1, new_url, download) == b'new cover'
+        assert (len(store), store.size, store.stats.outdated_removed) == (1, len(b'new cover'), 1)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == ['1_20.jpg']
+
+
+def test_kinds_are_stored_separately(tmp_path):
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=1000)
+        cover_url = COVER_URL.format(id=1, version=10)
+        list_url = 'https://assets.ppy.sh/beatmaps/1/covers/list@2x.jpg?10'
+        download = FakeDownloads({cover_url: b'cover', list_url: b'list'})
+        assert await store.get('cover', 1, cover_url, download) == b'cover'
+        assert await store.get('list@2x', 1, list_url, download) == b'list'
+        assert len(store) == 2
+
+    asyncio.run(run())
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=25)
+        urls = [COVER_URL.format(id=owner_id, version=1) for owner_id in range(3)]
+        download = FakeDownloads({url: b'x' * 10 for url in urls})
+        await store.get('cover', 0, urls[0], download)
+        await store.get('cover', 1, urls[1], download)
+        await store.get('cover', 0, urls[0], download)  # 1 is the least recently used now
+        await store.get('cover', 2, urls[2], download)
+        assert (len(store), store.size, store.stats.evictions, store.stats.bytes_evicted) == (2, 20, 1, 10)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == ['0_1.jpg', '2_1.jpg']
+
+
+def test_failed_download_stores_nothing(tmp_path):
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=1000)
+        url = COVER_URL.format(id=1, version=10)
+        download = FakeDownloads({})
+        with pytest.raises(OSError):
+            await store.get('cover', 1, url, download)
+        with pytest.raises(OSError):
+            await store.get('cover', 1, url, download)
+        assert len(download.calls) == 2
+        assert (len(store), store.size) == (0, 0)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == []
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    for version in (10, 20):
+        path = tmp_path / 'cover' / '01' / f'1_{version}.jpg'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'v%d' % version)
+
+    async def run():
+        store = ImageStore(str(tmp_path), max_bytes=1000)
+        url = COVER_URL.format(id=1, version=20)
+        download = FakeDownloads({})
+        assert await store.get('cover', 1, url, download) == b'v20'
+        assert download.calls == []
+        assert store.stats.outdated_removed == 1
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == ['1_20.jpg']
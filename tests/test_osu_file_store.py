@@ -0,0 +1,122 @@
+import asyncio
+import gzip
+import os
+from datetime import datetime, timezone
+from typing import BinaryIO
+
+import pytest
+
+from message_constructors.utils.osu_file_store import EmptyOsuFile, OsuFileStore, parse_file_name
+
+OLD_VERSION = datetime(2020, 1, 1, tzinfo=timezone.utc)
+NEW_VERSION = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeDownloads:
+    """Download coroutine streaming `{beatmap_id: bytes}` into the file, counting calls."""
+    def __init__(self, content: dict[int, bytes]):
+        self.content = content
+        self.calls: list[int] = []
+
+    async def __call__(self, beatmap_id: int, file: BinaryIO) -> bytes:
+        self.calls.append(beatmap_id)
+        content = self.content[beatmap_id]
+        file.write(content)
+        return content
+
+
+def stored_files(root) -> list[str]:
+    return sorted(os.listdir(root))
+
+
+def test_parse_file_name():
+    assert parse_file_name('1_1577836800.osu') == (1, 1577836800, False)
+    assert parse_file_name('1_1577836800.osu.gz') == (1, 1577836800, True)
+    assert parse_file_name('1_1577836800.osu.part') is None
+    assert parse_file_name('1.osu') is None
+
+
+def test_stored_file_is_read_from_disk(tmp_path):
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=1000)
+        download = FakeDownloads({1: b'osu file v14'})
+        assert await store.get(1, OLD_VERSION, download) == b'osu file v14'
+        assert await store.get(1, OLD_VERSION, download) == b'osu file v14'
+        assert download.calls == [1]
+        assert (store.stats.hits, store.stats.misses, store.stats.bytes_downloaded) == (1, 1, 12)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == [f'1_{int(OLD_VERSION.timestamp())}.osu']
+
+
+def test_new_beatmap_version_replaces_file(tmp_path):
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=1000)
+        await store.get(1, OLD_VERSION, FakeDownloads({1: b'old'}))
+        assert await store.get(1, NEW_VERSION, FakeDownloads({1: b'updated'})) == b'updated'
+        assert (len(store), store.size, store.stats.outdated_removed) == (1, len(b'updated'), 1)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == [f'1_{int(NEW_VERSION.timestamp())}.osu']
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=25)
+        download = FakeDownloads({beatmap_id: b'x' * 10 for beatmap_id in range(3)})
+        await store.get(0, OLD_VERSION, download)
+        await store.get(1, OLD_VERSION, download)
+        await store.get(0, OLD_VERSION, download)  # 1 is the least recently used now
+        await store.get(2, OLD_VERSION, download)
+        assert (len(store), store.size, store.stats.evictions) == (2, 20, 1)
+
+    asyncio.run(run())
+    timestamp = int(OLD_VERSION.timestamp())
+    assert stored_files(tmp_path) == [f'0_{timestamp}.osu', f'2_{timestamp}.osu']
+
+
+def test_empty_download_stores_nothing(tmp_path):
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=1000)
+        with pytest.raises(EmptyOsuFile):
+            await store.get(1, OLD_VERSION, FakeDownloads({1: b''}))
+        assert (len(store), store.size) == (0, 0)
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == []
+
+
+def test_failed_download_removes_partial_file(tmp_path):
+    async def fail(beatmap_id: int, file: BinaryIO) -> bytes:
+        file.write(b'half of a file')
+        raise OSError(beatmap_id)
+
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=1000)
+        with pytest.raises(OSError):
+            await store.get(1, OLD_VERSION, fail)
+        assert len(store) == 0
+
+    asyncio.run(run())
+    assert stored_files(tmp_path) == []
+
+
+def test_cold_files_are_compressed(tmp_path):
+    content = b'[HitObjects]\n' * 100
+
+    async def run():
+        store = OsuFileStore(str(tmp_path), max_bytes=10000, cold_after=0)
+        download = FakeDownloads({1: content})
+        await store.get(1, OLD_VERSION, download)
+        await store._compress_cold_files()
+        assert store.stats.compressed == 1
+        assert store.size < len(content)
+        # compressed files are read transparently
+        assert await store.get(1, OLD_VERSION, download) == content
+        assert download.calls == [1]
+
+    asyncio.run(run())
+    compressed_name = f'1_{int(OLD_VERSION.timestamp())}.osu.gz'
+    assert stored_files(tmp_path) == [compressed_name]
+    with gzip.open(tmp_path / compressed_name, 'rb') as f:
+        assert f.read() == content
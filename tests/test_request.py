@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from time import monotonic, sleep
+
+import httpx
+import pytest
+
+from request import BASE_URL, RETRY_AFTER_DEFAULT, BanchoUnavailable, CircuitBreaker, Priority, Request, \
+    RequestScheduler, parse_retry_after, request_priority
+
+
+def test_scheduler_serves_interactive_lane_first():
+    async def run() -> list[Priority]:
+        scheduler = RequestScheduler(rate=10, burst=1)
+        served = []
+
+        async def acquire(lane: Priority):
+            with request_priority(lane):
+                await scheduler.acquire()
+            served.append(lane)
+
+        await scheduler.acquire()  # empties the bucket, everything after it has to queue
+        tasks = [asyncio.create_task(acquire(lane)) for lane in (Priority.BACKGROUND, Priority.BATCH,
+                                                                 Priority.INTERACTIVE)]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == {Priority.INTERACTIVE: 1, Priority.BATCH: 1, Priority.BACKGROUND: 1}
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(run()) == [Priority.INTERACTIVE, Priority.BATCH, Priority.BACKGROUND]
+
+
+def test_scheduler_keeps_fifo_order_within_lane():
+    async def run() -> list[int]:
+        scheduler = RequestScheduler(rate=100, burst=1)
+        served = []
+
+        async def acquire(number: int):
+            await scheduler.acquire(Priority.BATCH)
+            served.append(number)
+
+        await scheduler.acquire()
+        await asyncio.gather(*(acquire(number) for number in range(5)))
+        return served
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, 4]
+
+
+def test_scheduler_counts_lane_stats():
+    async def run() -> RequestScheduler:
+        scheduler = RequestScheduler(rate=100, burst=2)
+        await asyncio.gather(*(scheduler.acquire(Priority.INTERACTIVE) for _ in range(4)))
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    stats = scheduler.stats[Priority.INTERACTIVE]
+    assert stats.served == 4
+    assert 0 < stats.max_wait < 1
+    assert stats.average_wait <= stats.max_wait
+    assert scheduler.stats[Priority.BATCH].served == 0
+    assert scheduler.queue_depth[Priority.INTERACTIVE] == 0
+
+
+def test_scheduler_penalty_holds_requests():
+    async def run() -> float:
+        scheduler = RequestScheduler(rate=100, burst=10)
+        scheduler.penalize(0.2)
+        started = monotonic()
+        await scheduler.acquire()
+        assert scheduler.penalties == 1
+        return monotonic() - started
+
+    assert asyncio.run(run()) >= 0.2
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run() -> RequestScheduler:
+        scheduler = RequestScheduler(rate=10, burst=1)
+        await scheduler.acquire()
+        task = asyncio.create_task(scheduler.acquire(Priority.BATCH))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.queue_depth[Priority.BATCH] == 0
+    assert scheduler.stats[Priority.BATCH].served == 0
+
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.check()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(BanchoUnavailable):
+        breaker.check()
+    assert breaker.rejected == 1
+
+
+def test_circuit_breaker_success_resets_failures():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_circuit_breaker_half_open_trial():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    sleep(0.06)
+
+    breaker.check()  # the trial request goes through
+    breaker.record_failure()  # and fails, so the circuit opens again right away
+    assert breaker.is_open
+    with pytest.raises(BanchoUnavailable):
+        breaker.check()
+
+    sleep(0.06)
+    breaker.check()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.failures == 0
+    breaker.check()
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('120', 120),
+    ('1.5', 1.5),
+    ('-3', 0),
+    (None, RETRY_AFTER_DEFAULT),
+    ('soon', RETRY_AFTER_DEFAULT),
+    ('nan', RETRY_AFTER_DEFAULT),
+    ('inf', RETRY_AFTER_DEFAULT),
+    ('Wed, 21 Oct 2015 07:28:00 GMT', 0),  # already passed
+])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+def send_with_status(url: str, status_code: int, headers: dict[str, str]) -> Request:
+    async def run() -> Request:
+        request = Request('', 0, '', http2=False, max_retries=0)
+        request._session = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda _: httpx.Response(status_code, headers=headers)
+        ))
+        response = await request._send('GET', url)
+        assert response.status_code == status_code
+        await request._session.aclose()
+        return request
+
+    return asyncio.run(run())
+
+
+def test_429_from_osu_penalizes_scheduler():
+    request = send_with_status(f'{BASE_URL}/api/v2/me', 429, {'Retry-After': 'garbage'})
+    assert request.scheduler.penalties == 1
+
+
+def test_429_from_other_hosts_doesnt_penalize_scheduler():
+    request = send_with_status('https://assets.ppy.sh/beatmaps/1/covers/cover.jpg', 429, {'Retry-After': '5'})
+    assert request.scheduler.penalties == 0
@@ -0,0 +1,64 @@
+from db import BeatmapData
+from message_constructors.utils.search_index import SearchIndex, max_typos
+
+SONGS = [
+    BeatmapData(1, 11, 'file1', 'Freedom Dive', 'xi', 'Nakagawa-Kanon', 250),
+    BeatmapData(2, 12, 'file2', 'Blue Zenith', 'xi', 'Asphyxia', 240),
+    BeatmapData(3, 13, 'file3', 'Galaxy Collapse', 'Kurokotei', 'Mismagius', 360),
+    BeatmapData(4, 14, 'file4', 'Freedom', 'Some Artist', 'mapper', 120, tags='freedom freedom anthem'),
+    BeatmapData(5, 15, 'file5', 'Ascension to Heaven', 'xi', 'Fanzhen0', 200),
+]
+
+
+def build_index() -> SearchIndex:
+    index = SearchIndex()
+    index.rebuild(SONGS)
+    return index
+
+
+def music_ids(index: SearchIndex, query: str) -> list[int]:
+    return [song.music_id for song in index.search(query)]
+
+
+def test_bm25_ranks_rarer_and_more_frequent_words_higher():
+    index = build_index()
+    assert (len(index), index.last_music_id) == (5, 5)
+    # "freedom" is repeated in tags of 4, "dive" is only in 1
+    assert music_ids(index, 'freedom')[0] == 4
+    assert music_ids(index, 'freedom dive')[0] == 1
+    # songs matching more query words go first
+    assert music_ids(index, 'xi blue') == [2, 1, 5]
+
+
+def test_last_word_is_expanded_by_prefix():
+    index = build_index()
+    assert music_ids(index, 'galaxy col') == [3]
+    assert music_ids(index, 'asc') == [5]
+    assert music_ids(index, 'a') == []  # too short to expand
+
+
+def test_unknown_words_match_with_typos():
+    assert max_typos('xi') == 0
+    assert max_typos('blue') == 1
+    assert max_typos('kurokotei') == 2
+    index = build_index()
+    assert music_ids(index, 'kurokotie galaxy') == [3]
+    assert music_ids(index, 'zenth xi')[0] == 2
+    assert music_ids(index, 'xo') == []
+
+
+def test_mappers_are_searchable_and_added_incrementally():
+    index = build_index()
+    assert music_ids(index, 'asphyxia') == [2]
+    index.add([BeatmapData(2, 16, 'file2', 'Blue Zenith', 'xi', 'Sotarks', 240),
+               BeatmapData(6, 17, 'file6', 'Sidetracked Day', 'VINXIS', 'Sotarks', 300)])
+    assert sorted(music_ids(index, 'sotarks')) == [2, 6]
+    assert music_ids(index, 'asphyxia') == [2]
+    assert len(index) == 6 and index.last_music_id == 6
+
+
+def test_limit_and_stats():
+    index = build_index()
+    assert len(index.search('xi', limit=2)) == 2
+    assert index.stats.searches == 1
+    assert index.stats.max_seconds >= index.stats.average_seconds > 0
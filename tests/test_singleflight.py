@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch() -> int:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+        assert results == [1] * 5
+        assert (calls, flight.started, flight.coalesced) == (1, 1, 4)
+        assert flight.in_flight == 0
+
+        # finished calls aren't remembered, the next one starts over
+        assert await flight.do('key', fetch) == 2
+
+    asyncio.run(run())
+
+
+def test_different_keys_run_separately():
+    async def run():
+        flight = SingleFlight()
+
+        async def fetch(value: str) -> str:
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(flight.do('a', lambda: fetch('a')), flight.do('b', lambda: fetch('b')))
+        assert results == ['a', 'b']
+        assert (flight.started, flight.coalesced) == (2, 0)
+
+    asyncio.run(run())
+
+
+def test_error_reaches_every_caller_and_is_forgotten():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fail():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError(calls)
+
+        results = await asyncio.gather(*(flight.do('key', fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) and result.args == (1,) for result in results)
+        assert flight.in_flight == 0
+
+        with pytest.raises(ValueError, match='2'):
+            await flight.do('key', fail)
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_doesnt_cancel_call():
+    async def run():
+        flight = SingleFlight()
+
+        async def fetch() -> str:
+            await asyncio.sleep(0.02)
+            return 'done'
+
+        cancelled = asyncio.create_task(flight.do('key', fetch))
+        waiting = asyncio.create_task(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert await waiting == 'done'
+        assert cancelled.cancelled()
+        assert flight.in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+import pyttanko
+
+from db import DifficultyAttributes
+from message_constructors.utils import vectorized_calculators
+from message_constructors.utils.vectorized_calculators import HitObjectArrays
+
+BEATMAPS_PATH = os.path.join(os.path.dirname(__file__), 'beatmaps')
+BEATMAPS = sorted(name for name in os.listdir(BEATMAPS_PATH) if name.endswith('.osu'))
+MODS = [[], ['HD'], ['HR'], ['DT'], ['HD', 'HR', 'DT'], ['EZ'], ['HT'], ['HD', 'FL'], ['NF', 'SO']]
+MODS_IDS = [''.join(mods) or 'NM' for mods in MODS]
+ACCURACIES = [100.0, 99.5, 98.0, 95.0, 90.0, 80.0, 60.0]
+MISSES = [0, 1, 5, 20]
+# Same operations in a different order, only float rounding differs
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope='module', params=BEATMAPS)
+def expanded_beatmap_file(request) -> pyttanko.beatmap:
+    with open(os.path.join(BEATMAPS_PATH, request.param), encoding='utf-8') as f:
+        return pyttanko.parser().map(f)
+
+
+def mods_bitmask(mods: list[str]) -> int:
+    return sum(getattr(pyttanko, f'MODS_{mod}') for mod in mods)
+
+
+def build_attributes(stars: tuple[float, float, float], expanded_beatmap_file: pyttanko.beatmap) -> DifficultyAttributes:
+    aim, speed, total = stars
+    return DifficultyAttributes(
+        aim=aim,
+        speed=speed,
+        total=total,
+        max_combo=expanded_beatmap_file.max_combo(),
+        circles=expanded_beatmap_file.ncircles,
+        sliders=expanded_beatmap_file.nsliders,
+        objects=len(expanded_beatmap_file.hitobjects),
+        ar=expanded_beatmap_file.ar,
+        od=expanded_beatmap_file.od,
+        ss_pp=0.0,
+    )
+
+
+def test_corpus_has_marathon():
+    """Long maps span many strain blocks, they're where block-wise decay would drift first."""
+    with open(os.path.join(BEATMAPS_PATH, 'marathon.osu'), encoding='utf-8') as f:
+        expanded_beatmap_file = pyttanko.parser().map(f)
+    length = expanded_beatmap_file.hitobjects[-1].time - expanded_beatmap_file.hitobjects[0].time
+    assert length > 20 * vectorized_calculators.STRAIN_BLOCK_SECONDS * 1000
+
+
+@pytest.mark.parametrize('mods', MODS, ids=MODS_IDS)
+def test_star_rating_parity(expanded_beatmap_file, mods):
+    mods_calc = mods_bitmask(mods)
+    expected = pyttanko.diff_calc().calc(expanded_beatmap_file, mods_calc)
+    aim, speed, total = vectorized_calculators.calculate_difficulty(
+        HitObjectArrays.from_beatmap(expanded_beatmap_file), expanded_beatmap_file.cs, mods_calc
+    )
+    assert aim == pytest.approx(expected.aim, rel=TOLERANCE)
+    assert speed == pytest.approx(expected.speed, rel=TOLERANCE)
+    assert total == pytest.approx(expected.total, rel=TOLERANCE)
+
+
+@pytest.mark.parametrize('mods', MODS, ids=MODS_IDS)
+def test_pp_parity(expanded_beatmap_file, mods):
+    mods_calc = mods_bitmask(mods)
+    stars = pyttanko.diff_calc().calc(expanded_beatmap_file, mods_calc)
+    attributes = build_attributes((stars.aim, stars.speed, stars.total), expanded_beatmap_file)
+    grid = [(accuracy, misses) for misses in MISSES if misses < attributes.objects for accuracy in ACCURACIES]
+    accuracies, misses = (np.array(values) for values in zip(*grid))
+
+    n300, n100, n50 = vectorized_calculators.acc_round(accuracies, attributes.objects, misses)
+    pp = vectorized_calculators.ppv2(attributes, mods_calc, n300=n300, n100=n100, n50=n50, nmiss=misses)
+
+    for (accuracy, miss_count), value in zip(grid, pp):
+        expected_n300, expected_n100, expected_n50 = pyttanko.acc_round(accuracy, attributes.objects, miss_count)
+        expected, *_ = pyttanko.ppv2(
+            attributes.aim, attributes.speed, max_combo=attributes.max_combo, nsliders=attributes.sliders,
+            ncircles=attributes.circles, nobjects=attributes.objects, base_ar=attributes.ar,
+            base_od=attributes.od, mods=mods_calc, n300=expected_n300, n100=expected_n100, n50=expected_n50,
+            nmiss=miss_count,
+        )
+        assert value == pytest.approx(expected, rel=TOLERANCE), (accuracy, miss_count)